@@ -5,6 +5,10 @@ This ensures filtering will work correctly
 
 Run: python manage.py shell
 Then: exec(open('FIX_TRIP_DRIVER_IDS.py').read())
+
+This script only reports mismatches. To rewrite trips in place use:
+    python manage.py canonicalize_driver_ids --dry-run
+    python manage.py canonicalize_driver_ids
 """
 
 from monitoring.firebase_service import firebase_service
@@ -40,6 +40,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'monitoring.middleware.MetricsMiddleware',
+    'monitoring.middleware.ServerTimingMiddleware',
+    'monitoring.middleware.ReadBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +56,8 @@ ROOT_URLCONF = 'MobileFleet.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django templates, with render time reported in Server-Timing
+        'BACKEND': 'monitoring.timing.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -61,6 +65,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'monitoring.context_processors.firestore_status',
             ],
         },
     },
@@ -121,7 +126,7 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 import os
-from decouple import config
+from decouple import config, Csv
 
 # Add monitoring app
 INSTALLED_APPS.append('monitoring')
@@ -149,5 +154,44 @@ CLOUDINARY_CONFIG = {
     'api_secret': config('CLOUDINARY_API_SECRET', default=''),
 }
 
+# Trips started with a GPS position must begin this close to the start terminal
+TRIP_START_MAX_DISTANCE_M = config('TRIP_START_MAX_DISTANCE_M', default=500, cast=int)
+
+# Firestore operations slower than this, or billing more document reads,
+# are written to the slow query log (see `manage.py top_queries`)
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=250, cast=int)
+SLOW_QUERY_DOCUMENTS = config('SLOW_QUERY_DOCUMENTS', default=200, cast=int)
+SLOW_QUERY_LOG_PATH = os.path.join(BASE_DIR, config('SLOW_QUERY_LOG_PATH', default='logs/slow_queries.log'))
+
+# Per-view Firestore read budgets (see monitoring.budgets). The mode is
+# 'warn', 'strict' or 'shed'; FIRESTORE_READ_BUDGETS maps URL names to
+# {'reads': n, 'round_trips': n, 'mode': ...} and overrides @read_budget.
+# Strict budgets only raise with FIRESTORE_READ_BUDGET_RAISE (the tests set
+# both); otherwise they log like 'warn'.
+FIRESTORE_READ_BUDGET_MODE = config('FIRESTORE_READ_BUDGET_MODE', default='warn')
+FIRESTORE_READ_BUDGET_RAISE = config('FIRESTORE_READ_BUDGET_RAISE', default=DEBUG, cast=bool)
+FIRESTORE_READ_BUDGETS = {}
+
+# Firestore gRPC channels per worker process (see monitoring.channels).
+# Threads are pinned to a channel round-robin. Keepalive pings are sent even
+# while a channel is idle, so connections are not silently dropped between
+# bursts of traffic.
+FIRESTORE_CHANNEL_POOL_SIZE = config('FIRESTORE_CHANNEL_POOL_SIZE', default=4, cast=int)
+FIRESTORE_KEEPALIVE_TIME_MS = config('FIRESTORE_KEEPALIVE_TIME_MS', default=30000, cast=int)
+FIRESTORE_KEEPALIVE_TIMEOUT_MS = config('FIRESTORE_KEEPALIVE_TIMEOUT_MS', default=10000, cast=int)
+
+# Firestore call policy (see monitoring.resilience): a deadline per attempt,
+# retries with jittered backoff for idempotent reads, and a circuit breaker
+# that fails fast for FIRESTORE_BREAKER_RESET_SECONDS after
+# FIRESTORE_BREAKER_FAILURES transient failures in a row
+FIRESTORE_DEADLINE_SECONDS = config('FIRESTORE_DEADLINE_SECONDS', default=10.0, cast=float)
+FIRESTORE_READ_RETRIES = config('FIRESTORE_READ_RETRIES', default=2, cast=int)
+FIRESTORE_RETRY_BASE_SECONDS = config('FIRESTORE_RETRY_BASE_SECONDS', default=0.1, cast=float)
+FIRESTORE_BREAKER_FAILURES = config('FIRESTORE_BREAKER_FAILURES', default=5, cast=int)
+FIRESTORE_BREAKER_RESET_SECONDS = config('FIRESTORE_BREAKER_RESET_SECONDS', default=30.0, cast=float)
+
+# Addresses allowed to scrape /metrics without logging in (staff users always can)
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+
 # Time zone for Philippines
 TIME_ZONE = 'Asia/Manila'
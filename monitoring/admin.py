@@ -1,3 +1,26 @@
 from django.contrib import admin
+from django.utils import timezone
+from .models import Job, TripRollup
 
-# Register your models here.
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('created_at', 'started_at', 'finished_at', 'locked_by', 'locked_at', 'last_error')
+    # Payloads can carry account details (sealed passwords, emails)
+    exclude = ('payload',)
+    actions = ['requeue']
+
+    @admin.action(description="Requeue selected jobs")
+    def requeue(self, request, queryset):
+        count = queryset.exclude(status='running').update(
+            status='queued', attempts=0, run_at=timezone.now(), last_error='',
+        )
+        self.message_user(request, f"Requeued {count} job(s)")
+
+@admin.register(TripRollup)
+class TripRollupAdmin(admin.ModelAdmin):
+    list_display = ('granularity', 'bucket_start', 'start_terminal', 'destination_terminal',
+                    'trip_count', 'passenger_sum')
+    list_filter = ('granularity',)
+    date_hierarchy = 'bucket_start'
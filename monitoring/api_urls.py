@@ -11,14 +11,23 @@ urlpatterns = [
     
     # QR Code Scanning
     path('scan-qr/', api_views.scan_qr_code, name='api_scan_qr'),
+    path('terminals/nearest/', api_views.nearest_terminals_api, name='api_nearest_terminals'),
+    path('terminals/within/', api_views.terminals_within_api, name='api_terminals_within'),
     
     # Trip Management
     path('trips/start/', api_views.start_trip, name='api_start_trip'),
     path('trips/<str:trip_id>/stop/', api_views.stop_trip, name='api_stop_trip'),
     path('trips/<str:trip_id>/passengers/', api_views.update_trip_passengers, name='api_update_passengers'),
-    path('trips/<str:trip_id>/', api_views.get_trip_details, name='api_trip_details'),
+    path('trips/<str:trip_id>/passengers/delta/', api_views.update_trip_passengers_delta,
+         name='api_passengers_delta'),
     path('trips/active/', api_views.get_active_trips_api, name='api_active_trips'),
+    path('trips/<str:trip_id>/', api_views.get_trip_details, name='api_trip_details'),
     
+    # Analytics
+    path('analytics/rollups/', api_views.trip_rollups, name='api_trip_rollups'),
+    path('analytics/routes/', api_views.route_analytics, name='api_route_analytics'),
+    path('analytics/od-matrix/', api_views.od_matrix, name='api_od_matrix'),
+
     # Driver Information
     path('drivers/<str:driver_id>/', api_views.get_driver_info, name='api_driver_info'),
 ]
@@ -5,17 +5,35 @@ Handles trip start/stop, passenger tracking, and QR code scanning
 
 import json
 import logging
-from datetime import datetime
-from django.http import JsonResponse
+from datetime import datetime, timedelta
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
 from django.views import View
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.contrib.auth.decorators import login_required
+from django.utils import timezone
+from .budgets import read_budget
 from .firebase_service import firebase_service
+from .geo import nearest_terminals
+from .geohash import haversine_m, terminal_coordinates
+from .passengers import MAX_PASSENGER_DELTA, apply_passenger_delta
+from .rollups import record_trip_completion, rollup_series
+from .timing import JsonResponse
 
 logger = logging.getLogger(__name__)
 
+# Default and maximum number of days per rollup series request
+ROLLUP_RANGES = {
+    'hour': (2, 31),
+    'day': (30, 366),
+}
+OD_MATRIX_DEFAULT_DAYS = 7
+NEAREST_TERMINALS_MAX_K = 50
+TERMINALS_WITHIN_MAX_RADIUS_M = 50000
+OD_MATRIX_MAX_DAYS = 366
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def mobile_login(request):
@@ -152,6 +170,27 @@ def start_trip(request):
             return JsonResponse({'error': 'Start terminal not found'}, status=404)
         if not dest_term:
             return JsonResponse({'error': 'Destination terminal not found'}, status=404)
+
+        # Optional location check: the driver's position must be near the start terminal
+        if data.get('latitude') is not None and data.get('longitude') is not None:
+            position = terminal_coordinates(data)
+            if position is None:
+                return JsonResponse({'error': 'Invalid latitude/longitude'}, status=400)
+            terminal_position = terminal_coordinates(start_term)
+            max_distance = settings.TRIP_START_MAX_DISTANCE_M
+            if terminal_position and haversine_m(*position, *terminal_position) > max_distance:
+                nearby = firebase_service.get_terminals_within(*position, max_distance)
+                return JsonResponse({
+                    'error': 'You are too far from the start terminal',
+                    'nearby_terminals': [
+                        {
+                            'terminal_id': t.get('terminal_id') or t['id'],
+                            'name': t.get('name'),
+                            'distance_m': round(t['distance_m'], 1),
+                        }
+                        for t in nearby
+                    ],
+                }, status=400)
         
         # Create trip data
         trip_data = {
@@ -188,9 +227,13 @@ def start_trip(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@read_budget(reads=1, round_trips=2)
 def update_trip_passengers(request, trip_id):
     """
     Update passenger count for an active trip
+    The status check and the write are one conditional update (see
+    FirebaseService.update_trip_if), so a trip completed meanwhile is not
+    changed and the response needs no second read.
     """
     try:
         data = json.loads(request.body)
@@ -199,28 +242,23 @@ def update_trip_passengers(request, trip_id):
         if passengers is None:
             return JsonResponse({'error': 'passengers field is required'}, status=400)
         
-        # Validate trip exists and is active
-        trip = firebase_service.get_trip(trip_id)
-        if not trip:
-            return JsonResponse({'error': 'Trip not found'}, status=404)
-        
-        if trip.get('status') != 'in_progress':
-            return JsonResponse({'error': 'Trip is not active'}, status=400)
-        
-        # Update passenger count
+        # Update passenger count if the trip exists and is active
         update_data = {
             'passengers': int(passengers)
         }
         
-        success = firebase_service.update_trip(trip_id, update_data)
+        trip, error = firebase_service.update_trip_if(trip_id, 'in_progress', update_data)
         
-        if success:
-            # Get updated trip data
-            updated_trip = firebase_service.get_trip(trip_id)
-            
+        if error == 'not_found':
+            return JsonResponse({'error': 'Trip not found'}, status=404)
+        
+        if error == 'wrong_status':
+            return JsonResponse({'error': 'Trip is not active'}, status=400)
+        
+        if error is None:
             return JsonResponse({
                 'success': True,
-                'trip': updated_trip,
+                'trip': trip,
                 'message': 'Passenger count updated successfully'
             })
         else:
@@ -236,21 +274,59 @@ def update_trip_passengers(request, trip_id):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def stop_trip(request, trip_id):
+@read_budget(reads=1, round_trips=2)
+def update_trip_passengers_delta(request, trip_id):
     """
-    Stop/complete a trip from mobile app
-    Sets arrival time and marks trip as completed
+    Add or remove passengers on an active trip: {"delta": 1} or {"delta": -1}
+    Concurrent taps for the same trip are coalesced into one conditional
+    update (see monitoring.passengers); the count never goes below zero and
+    the response is built without reading the trip again.
     """
     try:
         data = json.loads(request.body)
-        
-        # Validate trip exists and is active
-        trip = firebase_service.get_trip(trip_id)
-        if not trip:
+        delta = data.get('delta')
+
+        if isinstance(delta, bool) or not isinstance(delta, int) or not delta:
+            return JsonResponse({'error': 'delta must be a non-zero integer'}, status=400)
+        if abs(delta) > MAX_PASSENGER_DELTA:
+            return JsonResponse({'error': f'delta must be between -{MAX_PASSENGER_DELTA} and {MAX_PASSENGER_DELTA}'},
+                                status=400)
+
+        # Applied only while the trip exists and is active
+        passengers, error, coalesced = apply_passenger_delta(trip_id, delta)
+        if error == 'not_found':
             return JsonResponse({'error': 'Trip not found'}, status=404)
-        
-        if trip.get('status') != 'in_progress':
+
+        if error == 'wrong_status':
             return JsonResponse({'error': 'Trip is not active'}, status=400)
+
+        if error is not None:
+            return JsonResponse({'error': 'Failed to update trip'}, status=500)
+
+        return JsonResponse({
+            'success': True,
+            'trip_id': trip_id,
+            'passengers': passengers,
+            'coalesced': coalesced,
+        })
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        logger.error(f"Error applying passenger delta: {e}")
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@read_budget(reads=1, round_trips=2)
+def stop_trip(request, trip_id):
+    """
+    Stop/complete a trip from mobile app
+    Sets arrival time and marks trip as completed, only if it is still in
+    progress (one conditional update, see FirebaseService.update_trip_if)
+    """
+    try:
+        data = json.loads(request.body)
         
         # Update trip to completed
         update_data = {
@@ -263,15 +339,20 @@ def stop_trip(request, trip_id):
         if final_passengers is not None:
             update_data['passengers'] = int(final_passengers)
         
-        success = firebase_service.update_trip(trip_id, update_data)
+        trip, error = firebase_service.update_trip_if(trip_id, 'in_progress', update_data)
         
-        if success:
-            # Get updated trip data
-            updated_trip = firebase_service.get_trip(trip_id)
+        if error == 'not_found':
+            return JsonResponse({'error': 'Trip not found'}, status=404)
+        
+        if error == 'wrong_status':
+            return JsonResponse({'error': 'Trip is not active'}, status=400)
+        
+        if error is None:
+            record_trip_completion({**trip, 'id': trip_id})
             
             return JsonResponse({
                 'success': True,
-                'trip': updated_trip,
+                'trip': trip,
                 'message': 'Trip completed successfully'
             })
         else:
@@ -286,6 +367,77 @@ def stop_trip(request, trip_id):
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
 @require_http_methods(["GET"])
+def nearest_terminals_api(request):
+    """
+    Nearest active terminals to a position, for when a QR code can't be scanned
+
+    Query parameters: lat, lng and k (default 5)
+    """
+    try:
+        lat = float(request.GET['lat'])
+        lng = float(request.GET['lng'])
+        k = min(max(int(request.GET.get('k', 5)), 1), NEAREST_TERMINALS_MAX_K)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'lat and lng are required numbers'}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return JsonResponse({'error': 'lat/lng out of range'}, status=400)
+
+    try:
+        terminals = [
+            {
+                'terminal_id': terminal.get('terminal_id') or terminal.get('id'),
+                'name': terminal.get('name'),
+                'latitude': terminal.get('latitude'),
+                'longitude': terminal.get('longitude'),
+                'distance_m': round(distance, 1),
+            }
+            for terminal, distance in nearest_terminals(lat, lng, k)
+        ]
+        return JsonResponse({
+            'success': True,
+            'terminals': terminals,
+            'count': len(terminals),
+        })
+    except Exception as e:
+        logger.error(f"Error finding nearest terminals: {e}")
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
+@require_http_methods(["GET"])
+def terminals_within_api(request):
+    """
+    Active terminals within a radius of a position, nearest first
+
+    Query parameters: lat, lng and radius (meters, default 1000)
+    """
+    try:
+        lat = float(request.GET['lat'])
+        lng = float(request.GET['lng'])
+        radius = float(request.GET.get('radius', 1000))
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'lat and lng are required numbers'}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return JsonResponse({'error': 'lat/lng out of range'}, status=400)
+    if not 0 < radius <= TERMINALS_WITHIN_MAX_RADIUS_M:
+        return JsonResponse({'error': f'radius must be between 0 and {TERMINALS_WITHIN_MAX_RADIUS_M}'}, status=400)
+
+    terminals = [
+        {
+            'terminal_id': terminal.get('terminal_id') or terminal.get('id'),
+            'name': terminal.get('name'),
+            'latitude': terminal.get('latitude'),
+            'longitude': terminal.get('longitude'),
+            'distance_m': round(terminal['distance_m'], 1),
+        }
+        for terminal in firebase_service.get_terminals_within(lat, lng, radius)
+    ]
+    return JsonResponse({
+        'success': True,
+        'terminals': terminals,
+        'count': len(terminals),
+    })
+
+@require_http_methods(["GET"])
+@read_budget(reads=200, mode='shed')
 def get_active_trips_api(request):
     """
     Get all active trips for mobile app
@@ -313,6 +465,7 @@ def get_active_trips_api(request):
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
 @require_http_methods(["GET"])
+@read_budget(reads=4, round_trips=4)
 def get_trip_details(request, trip_id):
     """
     Get detailed information about a specific trip
@@ -341,6 +494,7 @@ def get_trip_details(request, trip_id):
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
 @require_http_methods(["GET"])
+@read_budget(reads=100)
 def get_driver_info(request, driver_id):
     """
     Get driver information for mobile app
@@ -365,3 +519,122 @@ def get_driver_info(request, driver_id):
     except Exception as e:
         logger.error(f"Error getting driver info: {e}")
         return JsonResponse({'error': 'Internal server error'}, status=500)
+
+@login_required(login_url='login')
+@require_http_methods(["GET"])
+def trip_rollups(request):
+    """
+    Trip and passenger time series from the hourly/daily rollups
+
+    Query parameters: granularity (hour|day), start and end (YYYY-MM-DD,
+    end inclusive), terminal, destination and group (terminal|route)
+    """
+    granularity = request.GET.get('granularity', 'day')
+    if granularity not in ROLLUP_RANGES:
+        return JsonResponse({'error': 'granularity must be hour or day'}, status=400)
+    default_days, max_days = ROLLUP_RANGES[granularity]
+
+    try:
+        today = timezone.localdate()
+        end = datetime.strptime(request.GET['end'], '%Y-%m-%d').date() if request.GET.get('end') else today
+        start = (datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if request.GET.get('start')
+                 else end - timedelta(days=default_days - 1))
+    except ValueError:
+        return JsonResponse({'error': 'Dates must be in YYYY-MM-DD format'}, status=400)
+    if end < start:
+        return JsonResponse({'error': 'end must not be before start'}, status=400)
+    if (end - start).days + 1 > max_days:
+        return JsonResponse({'error': f'At most {max_days} days per {granularity} series'}, status=400)
+
+    try:
+        series = rollup_series(
+            granularity,
+            timezone.make_aware(datetime.combine(start, datetime.min.time())),
+            timezone.make_aware(datetime.combine(end + timedelta(days=1), datetime.min.time())),
+            start_terminal=request.GET.get('terminal') or None,
+            destination_terminal=request.GET.get('destination') or None,
+            group_by=request.GET.get('group') or None,
+        )
+        return JsonResponse({
+            'success': True,
+            'granularity': granularity,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'series': series,
+        })
+    except Exception as e:
+        logger.error(f"Error reading trip rollups: {e}")
+        return JsonResponse({'error': 'Internal server error'}, status=500)
+
+@login_required(login_url='login')
+@require_http_methods(["GET"])
+def route_analytics(request):
+    """
+    Per-route travel time percentiles and passengers per trip
+
+    Query parameters: terminal (start terminal) and min_trips
+    """
+    # numpy is only loaded by the analytics views, not with the URLconf
+    from .analytics import get_route_stats
+
+    try:
+        min_trips = int(request.GET.get('min_trips', 1))
+    except ValueError:
+        return JsonResponse({'error': 'min_trips must be a number'}, status=400)
+    terminal = request.GET.get('terminal')
+
+    terminal_names = {t.get('terminal_id', t.get('id')): t.get('name', 'Unknown Terminal')
+                      for t in firebase_service.get_all_terminals()}
+    routes = []
+    for route in get_route_stats():
+        if route['trips'] < min_trips or (terminal and route['start_terminal'] != terminal):
+            continue
+        routes.append({
+            **route,
+            'start_terminal_name': terminal_names.get(route['start_terminal'], route['start_terminal']),
+            'destination_terminal_name': terminal_names.get(route['destination_terminal'], route['destination_terminal']),
+        })
+
+    return JsonResponse({
+        'success': True,
+        'routes': routes,
+        'count': len(routes),
+    })
+
+@login_required(login_url='login')
+@require_http_methods(["GET"])
+def od_matrix(request):
+    """
+    Terminal origin-destination matrix of trips and passengers
+
+    Query parameters: start and end (YYYY-MM-DD, end inclusive) and
+    top (keep only the N busiest terminals)
+    """
+    from .od_matrix import window_matrix, od_matrix_context
+
+    try:
+        today = timezone.localdate()
+        end = datetime.strptime(request.GET['end'], '%Y-%m-%d').date() if request.GET.get('end') else today
+        start = (datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if request.GET.get('start')
+                 else end - timedelta(days=OD_MATRIX_DEFAULT_DAYS - 1))
+        top = int(request.GET['top']) if request.GET.get('top') else None
+    except ValueError:
+        return JsonResponse({'error': 'Dates must be YYYY-MM-DD and top a number'}, status=400)
+    if end < start or (end - start).days + 1 > OD_MATRIX_MAX_DAYS:
+        return JsonResponse({'error': f'Window must be 1 to {OD_MATRIX_MAX_DAYS} days'}, status=400)
+
+    try:
+        terminal_map = {t.get('terminal_id', t.get('id')): t.get('name', 'Unknown Terminal')
+                        for t in firebase_service.get_all_terminals()}
+        matrix = window_matrix(start, min(end, today), terminals=terminal_map)
+        if top:
+            matrix = matrix.top(top)
+        return JsonResponse({
+            'success': True,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            **od_matrix_context(matrix, terminal_map),
+        })
+    except Exception as e:
+        logger.error(f"Error building O-D matrix: {e}")
+        return JsonResponse({'error': 'Internal server error'}, status=500)
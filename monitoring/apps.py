@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MonitoringConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'monitoring'
+
+    def ready(self):
+        # Register the Firestore instrumentation listeners
+        from . import channels, metrics, slow_queries, timing  # noqa: F401
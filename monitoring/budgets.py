@@ -0,0 +1,119 @@
+"""
+Per-view Firestore read budgets
+A view declares how many document reads (and optionally round trips) one
+request may cost, with @read_budget or in settings.FIRESTORE_READ_BUDGETS
+(keyed by URL name, overriding the decorator). ReadBudgetMiddleware
+measures each budgeted request and, when it goes over, acts on the mode:
+
+    warn    log a warning and count it in the read budget metrics
+    strict  raise ReadBudgetExceeded when settings.FIRESTORE_READ_BUDGET_RAISE
+            is on (DEBUG and the test suite), otherwise behave like warn
+    shed    like warn, and for the next SHED_COOLDOWN seconds serve the
+            last response that stayed within budget (per path and user)
+            instead of running the view again
+
+The default mode is settings.FIRESTORE_READ_BUDGET_MODE.
+"""
+
+import hashlib
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+READ_BUDGET_MODES = ('warn', 'strict', 'shed')
+# How long a view that went over budget is served from its last good response
+SHED_COOLDOWN = 60
+# How long a within-budget response is kept for shedding
+SHED_RESPONSE_TIMEOUT = 300
+
+budget_exceeded = metrics.Counter(
+    'firestore_read_budget_exceeded_total', 'Requests that went over their Firestore read budget',
+    ('view', 'mode'))
+budget_shed = metrics.Counter(
+    'firestore_read_budget_shed_total', 'Requests served from a cached response to stay within budget',
+    ('view',))
+
+
+class ReadBudgetExceeded(Exception):
+    """A view used more Firestore reads or round trips than its budget allows (strict mode)"""
+
+
+def read_budget(reads, round_trips=None, mode=None):
+    """
+    Declare the Firestore cost one request to a view may have
+
+    Args:
+        reads (int): Maximum billed document reads
+        round_trips (int): Maximum Firestore round trips (None for no limit)
+        mode (str): 'warn', 'strict' or 'shed' (None for the settings default)
+    """
+    if mode is not None and mode not in READ_BUDGET_MODES:
+        raise ValueError(f"Unknown read budget mode: {mode}")
+
+    def decorator(view_func):
+        view_func.read_budget = {'reads': reads, 'round_trips': round_trips, 'mode': mode}
+        return view_func
+    return decorator
+
+
+def view_budget(view_name, view_func):
+    """The effective budget for a view: settings override the decorator"""
+    budget = dict(getattr(view_func, 'read_budget', None) or {})
+    budget.update(getattr(settings, 'FIRESTORE_READ_BUDGETS', {}).get(view_name) or {})
+    if not budget.get('reads') and not budget.get('round_trips'):
+        return None
+    budget['mode'] = budget.get('mode') or settings.FIRESTORE_READ_BUDGET_MODE
+    return budget
+
+
+def over_budget(budget, reads, round_trips):
+    """Human-readable reasons a request went over budget ([] if it did not)"""
+    reasons = []
+    if budget.get('reads') is not None and reads > budget['reads']:
+        reasons.append(f"{reads} reads > {budget['reads']}")
+    if budget.get('round_trips') is not None and round_trips > budget['round_trips']:
+        reasons.append(f"{round_trips} round trips > {budget['round_trips']}")
+    return reasons
+
+
+def _shed_keys(view_name, request):
+    user = request.user.pk if getattr(request, 'user', None) and request.user.is_authenticated else 'anon'
+    digest = hashlib.md5(f"{request.get_full_path()}|{user}".encode()).hexdigest()
+    return f"read_budget:over:{view_name}", f"read_budget:response:{view_name}:{digest}"
+
+
+def shed_response(view_name, request):
+    """The last good response for this request if the view is cooling down, else None"""
+    over_key, response_key = _shed_keys(view_name, request)
+    if not cache.get(over_key):
+        return None
+    response = cache.get(response_key)
+    if response is not None:
+        budget_shed.inc(view_name)
+        response['X-Read-Budget'] = 'shed'
+    return response
+
+
+def enforce(view_name, budget, request, response, reads, round_trips):
+    """Apply the budget mode to a finished request; returns the response to send"""
+    reasons = over_budget(budget, reads, round_trips)
+    mode = budget['mode']
+    over_key, response_key = _shed_keys(view_name, request)
+
+    if not reasons:
+        if (mode == 'shed' and request.method == 'GET' and response.status_code == 200
+                and not response.streaming):
+            cache.set(response_key, response, SHED_RESPONSE_TIMEOUT)
+        return response
+
+    budget_exceeded.inc(view_name, mode)
+    message = f"Firestore read budget exceeded by {view_name}: {', '.join(reasons)}"
+    if mode == 'strict' and settings.FIRESTORE_READ_BUDGET_RAISE:
+        raise ReadBudgetExceeded(message)
+    logger.warning(message)
+    if mode == 'shed':
+        cache.set(over_key, True, SHED_COOLDOWN)
+    return response
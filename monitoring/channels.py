@@ -0,0 +1,159 @@
+"""
+Firestore gRPC channel pool
+A Firestore client multiplexes every call over one gRPC channel (one
+HTTP/2 connection), so all threads of a worker would otherwise queue on
+the same connection and its concurrent stream limit. ClientPool holds
+FIRESTORE_CHANNEL_POOL_SIZE clients, each with its own channel, and pins
+every thread to one of them round-robin on its first Firestore call, so a
+thread's calls always use the same connection.
+
+Channels send keepalive pings every FIRESTORE_KEEPALIVE_TIME_MS, also
+while idle, and never drop to the idle state, so the first request after
+a quiet period does not pay for a new TLS handshake.
+
+Channel utilization is exported with the other metrics: operations and
+busy seconds (the sum of round trip durations; its rate is the average
+number of calls in flight) per channel, and the threads pinned to each.
+"""
+
+import itertools
+import threading
+import weakref
+from django.conf import settings
+from . import metrics
+from .instrumentation import add_listener
+
+# gRPC's maximum timeout; a channel never goes idle and disconnects
+NEVER = 2 ** 31 - 1
+
+_state = threading.local()
+# The pool created last in this process (FirebaseService has one)
+_current_pool = None
+
+
+def channel_options():
+    """gRPC channel arguments for pooled Firestore clients"""
+    return [
+        ('grpc.keepalive_time_ms', settings.FIRESTORE_KEEPALIVE_TIME_MS),
+        ('grpc.keepalive_timeout_ms', settings.FIRESTORE_KEEPALIVE_TIMEOUT_MS),
+        ('grpc.keepalive_permit_without_calls', 1),
+        ('grpc.http2.max_pings_without_data', 0),
+        ('grpc.client_idle_timeout_ms', NEVER),
+        # Same as the SDK's own channels
+        ('grpc.max_send_message_length', -1),
+        ('grpc.max_receive_message_length', -1),
+    ]
+
+
+def create_client(credentials, project, options=None):
+    """
+    A Firestore client whose channel is created with the given gRPC options
+
+    Args:
+        credentials: google.auth credentials
+        project (str): Google Cloud project ID
+        options (list): gRPC channel arguments (defaults to channel_options())
+
+    Returns:
+        google.cloud.firestore.Client: Connects on its first call
+    """
+    from google.cloud import firestore
+    from google.cloud.firestore_v1.services.firestore import client as firestore_client
+    from google.cloud.firestore_v1.services.firestore.transports import grpc as firestore_grpc
+
+    options = channel_options() if options is None else options
+
+    class PooledClient(firestore.Client):
+        # The SDK builds its channel with fixed options; this is the same
+        # lazy getter (google.cloud.firestore_v1.Client._firestore_api) with ours
+        @property
+        def _firestore_api(self):
+            if self._emulator_host is not None:
+                return super()._firestore_api
+            if self._firestore_api_internal is None:
+                channel = firestore_grpc.FirestoreGrpcTransport.create_channel(
+                    self._target, credentials=self._credentials, options=options)
+                self._transport = firestore_grpc.FirestoreGrpcTransport(host=self._target, channel=channel)
+                self._firestore_api_internal = firestore_client.FirestoreClient(
+                    transport=self._transport, client_options=self._client_options)
+                firestore_client._client_info = self._client_info
+            return self._firestore_api_internal
+
+    return PooledClient(project=project, credentials=credentials)
+
+
+class ClientPool:
+    """
+    Several Firestore clients behind the client interface; each thread uses
+    the one it was pinned to
+    """
+
+    def __init__(self, factory, size):
+        global _current_pool
+        self.clients = [factory() for _ in range(max(1, size))]
+        self._next = itertools.count()
+        # Threads pinned to each client, for the utilization metrics
+        self._threads = [weakref.WeakSet() for _ in self.clients]
+        self._threads_lock = threading.Lock()
+        _current_pool = self
+
+    def __len__(self):
+        return len(self.clients)
+
+    def channel_index(self):
+        """Index of the client the current thread is pinned to, pinning it on first use"""
+        if getattr(_state, 'pool', None) is not self:
+            # next() on itertools.count is atomic under the GIL
+            index = next(self._next) % len(self.clients)
+            with self._threads_lock:
+                self._threads[index].add(threading.current_thread())
+            _state.pool, _state.index = self, index
+        return _state.index
+
+    def client(self):
+        return self.clients[self.channel_index()]
+
+    def pinned_threads(self):
+        """{(channel index,): live threads pinned to it}"""
+        with self._threads_lock:
+            return {(str(index),): len(threads) for index, threads in enumerate(self._threads)}
+
+    def collection(self, name):
+        return self.client().collection(name)
+
+    def batch(self):
+        return self.client().batch()
+
+    def __getattr__(self, name):
+        return getattr(self.client(), name)
+
+
+def current_channel():
+    """Channel index the current thread uses in the active pool, or None"""
+    if _current_pool is not None and getattr(_state, 'pool', None) is _current_pool:
+        return _state.index
+    return None
+
+
+channel_operations = metrics.Counter(
+    'firestore_channel_operations_total', 'Firestore round trips by gRPC channel', ('channel',))
+channel_busy_seconds = metrics.Counter(
+    'firestore_channel_busy_seconds_total', 'Time spent in Firestore round trips by gRPC channel', ('channel',))
+channel_threads = metrics.Gauge(
+    'firestore_channel_threads', 'Threads pinned to each Firestore gRPC channel', ('channel',),
+    callback=lambda: _current_pool.pinned_threads() if _current_pool is not None else {})
+channel_pool_size = metrics.Gauge(
+    'firestore_channel_pool_size', 'Firestore gRPC channels in this process',
+    callback=lambda: {(): len(_current_pool)} if _current_pool is not None else {})
+
+
+def record_channel_operation(operation):
+    """Instrumentation listener attributing each round trip to its channel"""
+    index = current_channel()
+    if index is None:
+        return
+    channel_operations.inc(str(index))
+    channel_busy_seconds.inc(str(index), amount=operation.duration)
+
+
+add_listener(record_channel_operation)
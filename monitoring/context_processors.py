@@ -0,0 +1,14 @@
+from . import resilience, timing
+
+
+def firestore_status(request):
+    """
+    Whether Firestore data on this page may be stale or missing
+
+    True while the circuit breaker is open, or when a Firestore call made
+    for this request failed (see monitoring.resilience).
+    """
+    cost = timing.current_cost()
+    return {
+        'firestore_degraded': resilience.breaker.is_open or bool(cost and cost.degraded),
+    }
@@ -0,0 +1,102 @@
+"""
+Streaming trip exports (CSV and NDJSON)
+Rows are generated lazily from FirebaseService.iter_trips, so an export of
+any size holds at most one Firestore page in memory.
+"""
+
+import csv
+import json
+from datetime import datetime, timedelta
+from .firebase_service import firebase_service
+
+TRIP_EXPORT_FIELDS = [
+    'trip_id', 'status', 'driver_id', 'driver_name',
+    'start_terminal', 'start_terminal_name',
+    'destination_terminal', 'destination_terminal_name',
+    'passengers', 'start_time', 'arrival_time', 'created_at',
+]
+
+TRIP_EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+STATUS_FILTERS = {
+    'active': 'in_progress',
+    'in_progress': 'in_progress',
+    'completed': 'completed',
+    'cancelled': 'cancelled',
+}
+
+class _Echo:
+    """File-like object whose write() just returns the value (for csv.writer)"""
+    def write(self, value):
+        return value
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def parse_export_filters(params):
+    """
+    Build iter_trips() keyword arguments from request/command parameters
+
+    Args:
+        params (dict): status, driver, start and end (YYYY-MM-DD, end inclusive)
+
+    Raises:
+        ValueError: If a date is malformed
+    """
+    filters = {
+        'status': STATUS_FILTERS.get(params.get('status') or ''),
+        'driver_id': None,
+        'start': None,
+        'end': None,
+    }
+    if params.get('driver'):
+        filters['driver_id'] = firebase_service.canonical_driver_id(params['driver'])
+    if params.get('start'):
+        filters['start'] = datetime.strptime(params['start'], '%Y-%m-%d')
+    if params.get('end'):
+        filters['end'] = datetime.strptime(params['end'], '%Y-%m-%d') + timedelta(days=1)
+    return filters
+
+def iter_trip_export_rows(**filters):
+    """Yield export dicts for trips matching the filters, with resolved names"""
+    terminal_map = {t.get('terminal_id', t.get('id')): t.get('name', '')
+                    for t in firebase_service.get_all_terminals()}
+    driver_map = {d.get('id'): d.get('name', '') for d in firebase_service.get_all_drivers()}
+
+    for trip in firebase_service.iter_trips(**filters):
+        yield {
+            'trip_id': trip.get('trip_id') or trip['id'],
+            'status': trip.get('status'),
+            'driver_id': trip.get('driver_id'),
+            'driver_name': driver_map.get(trip.get('driver_id'), ''),
+            'start_terminal': trip.get('start_terminal'),
+            'start_terminal_name': terminal_map.get(trip.get('start_terminal'), ''),
+            'destination_terminal': trip.get('destination_terminal'),
+            'destination_terminal_name': terminal_map.get(trip.get('destination_terminal'), ''),
+            'passengers': trip.get('passengers'),
+            'start_time': _format_value(trip.get('start_time')),
+            'arrival_time': _format_value(trip.get('arrival_time')),
+            'created_at': _format_value(trip.get('created_at')),
+        }
+
+def iter_csv(rows):
+    """Encode export rows as CSV lines, header first"""
+    writer = csv.DictWriter(_Echo(), fieldnames=TRIP_EXPORT_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+def iter_ndjson(rows):
+    """Encode export rows as newline-delimited JSON"""
+    for row in rows:
+        yield json.dumps(row, default=str) + '\n'
+
+def iter_trip_export(fmt, **filters):
+    """Stream a trip export in 'csv' or 'ndjson' format"""
+    rows = iter_trip_export_rows(**filters)
+    return iter_csv(rows) if fmt == 'csv' else iter_ndjson(rows)
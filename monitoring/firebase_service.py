@@ -1,46 +1,324 @@
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
 from django.conf import settings
+from django.core.cache import cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import hashlib
 import logging
+import os
+import threading
+import time
+from .geohash import covering_ranges, encode as geohash_encode, haversine_m, terminal_coordinates
+from .instrumentation import InstrumentedClient
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
+# Firestore allows at most 500 writes in a single batch
+BATCH_WRITE_LIMIT = 500
+# Firebase Auth imports/deletes at most 1000 users per call
+AUTH_BATCH_LIMIT = 1000
+
+# Small lookup documents kept in the 'meta' collection
+DRIVER_ALIASES_DOC = 'driver_aliases'
+TRIP_DRIVER_IDS_DOC = 'trip_driver_ids'
+
+DRIVERS_CACHE_KEY = 'firebase:drivers'
+TERMINALS_CACHE_KEY = 'firebase:terminals'
+DRIVER_ALIASES_CACHE_KEY = 'firebase:driver_aliases'
+TRIP_DRIVER_IDS_CACHE_KEY = 'firebase:trip_driver_ids'
+DASHBOARD_COUNTS_CACHE_KEY = 'firebase:dashboard_counts'
+TRIP_STATE_CACHE_KEY = 'firebase:trip_state:{}'
+# Bumped by trip writes that move trips between list positions; part of the
+# trip list's page hint keys (see QuerySequence), so bumping drops them all
+TRIP_PAGES_VERSION_KEY = 'firebase:trip_pages:version'
+# Trip fields the trip list filters or orders by
+TRIP_LIST_FIELDS = ('status', 'driver_id', 'created_at')
+CACHE_TIMEOUT = 300
+# Stale-while-revalidate (see FirebaseService._cached): how long an expired
+# value may still be served while one background refresh replaces it
+CACHE_MAX_STALE = 900
+# Dashboard trip counts are fresh for a short time and never older than this
+DASHBOARD_CACHE_TIMEOUT = 30
+DASHBOARD_MAX_STALE = 300
+# A background refresh that has not finished by then may be started again
+REFRESH_LOCK_TIMEOUT = 60
+REFRESH_WORKERS = 2
+# Trips as last read or written here, with their Firestore update time; the
+# version lets update_trip_if() skip its read (its precondition catches
+# copies that are out of date). Writes through this service refresh or drop
+# them
+TRIP_STATE_CACHE_TIMEOUT = 15
+# Conditional trip updates that keep losing to concurrent writes give up
+TRIP_UPDATE_ATTEMPTS = 5
+# Last good copies of cached reads, served while Firestore is failing
+FALLBACK_CACHE_TIMEOUT = 24 * 60 * 60
+# Page counts and page cursors are hints; trip writes made here drop them,
+# and a short expiry bounds how long other processes keep using old ones
+PAGE_HINT_CACHE_TIMEOUT = 60
+# Firestore 'in' filters accept at most 30 values
+IN_FILTER_LIMIT = 30
+# google.cloud.firestore.Query.DESCENDING, without importing the SDK
+DESCENDING = 'DESCENDING'
+
+
+def normalize_driver_alias(value):
+    """Normalize a driver identifier (ID, auth UID or email) for alias lookups"""
+    if value is None:
+        return ''
+    return str(value).strip().lower()
+
+
+class QuerySequence:
+    """
+    Countable, sliceable view of an ordered Firestore query
+
+    Lets django.core.paginator.Paginator page through a collection without
+    loading it: the length is a count aggregation and each page is one
+    limited query. The count and the last document of every page served
+    are remembered under cache_key, so moving to the next page starts
+    after that document instead of using an offset (Firestore bills every
+    document an offset skips).
+    """
+
+    def __init__(self, query, collection, cache_key):
+        self.query = query
+        self.collection = collection
+        self.cache_key = cache_key
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            key = f"{self.cache_key}:count"
+            self._count = cache.get(key)
+            if self._count is None:
+                self._count = int(self.query.count().get()[0][0].value)
+                cache.set(key, self._count, PAGE_HINT_CACHE_TIMEOUT)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def _cursor(self, position):
+        """Snapshot of the document just before `position`, if one was remembered"""
+        document_id = cache.get(f"{self.cache_key}:after:{position}")
+        if document_id:
+            snapshot = self.collection.document(document_id).get()
+            if snapshot.exists:
+                return snapshot
+        return None
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            items = self[index:index + 1]
+            if not items:
+                raise IndexError('QuerySequence index out of range')
+            return items[0]
+
+        start, stop = index.start or 0, index.stop
+        if start < 0 or (stop is not None and stop < 0) or index.step not in (None, 1):
+            raise ValueError('QuerySequence only supports forward slices')
+        if stop is not None and stop <= start:
+            return []
+
+        query = self.query
+        cursor = self._cursor(start) if start else None
+        if cursor is not None:
+            query = query.start_after(cursor)
+        elif start:
+            query = query.offset(start)
+        if stop is not None:
+            query = query.limit(stop - start)
+
+        items = []
+        last_id = None
+        for doc in query.stream():
+            data = doc.to_dict()
+            data['id'] = doc.id
+            items.append(data)
+            last_id = doc.id
+        if last_id:
+            cache.set(f"{self.cache_key}:after:{start + len(items)}", last_id, PAGE_HINT_CACHE_TIMEOUT)
+        return items
+
+
 class FirebaseService:
+    """
+    Firestore and Firebase Auth access for the whole app
+
+    Nothing is initialized at import time: the Firebase Admin SDK, gRPC and
+    the pool of Firestore clients (see monitoring.channels) are loaded on
+    first use, under a lock, so manage.py commands that never touch
+    Firestore do not pay for them. A forked child (e.g. a gunicorn worker
+    after preload) drops the parent's clients and creates its own, since a
+    gRPC channel must not cross a fork.
+    """
     _instance = None
     _db = None
+    _auth = None
+    # Runs stale-while-revalidate refreshes; created on first use
+    _executor = None
+    # Guards initialization; replaced in a forked child (see _reset_after_fork)
+    _init_lock = threading.Lock()
+    # Bumped on every terminal write in this process (see monitoring.geo)
+    terminals_version = 0
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(FirebaseService, cls).__new__(cls)
-            cls._instance._initialize_firebase()
+            # Background refreshes in flight, by cache key
+            cls._instance._refreshes = {}
         return cls._instance
 
+    def _initialize_app(self):
+        """The default Firebase Admin app, created from the service account on first use"""
+        import firebase_admin
+        from firebase_admin import credentials
+
+        if not firebase_admin._apps:
+            # Use the service account JSON file path
+            cred = credentials.Certificate(settings.FIREBASE_SERVICE_ACCOUNT_PATH)
+            firebase_admin.initialize_app(cred, {
+                'projectId': settings.FIREBASE_PROJECT_ID
+            })
+        return firebase_admin.get_app()
+
     def _initialize_firebase(self):
-        """Initialize Firebase Admin SDK"""
-        try:
-            if not firebase_admin._apps:
-                # Use the service account JSON file path
-                cred = credentials.Certificate(settings.FIREBASE_SERVICE_ACCOUNT_PATH)
-                firebase_admin.initialize_app(cred, {
-                    'projectId': settings.FIREBASE_PROJECT_ID
-                })
-            self._db = firestore.client()
-            logger.info("Firebase initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize Firebase: {e}")
-            self._db = None
+        """Initialize Firebase Admin SDK and this process's Firestore client"""
+        with self._init_lock:
+            if self._db is not None:
+                return
+            try:
+                from .channels import ClientPool, create_client
+
+                app = self._initialize_app()
+                credential = app.credential.get_credential()
+                # Our own clients rather than firebase_admin.firestore.client(), which
+                # caches one per app and would hand a forked child its parent's channel
+                pool = ClientPool(lambda: create_client(credential, app.project_id),
+                                  settings.FIRESTORE_CHANNEL_POOL_SIZE)
+                # Every Firestore call is counted (see monitoring.instrumentation)
+                self._db = InstrumentedClient(pool)
+                logger.info(f"Firebase initialized successfully ({len(pool)} Firestore channels)")
+            except Exception as e:
+                logger.error(f"Failed to initialize Firebase: {e}")
+                self._db = None
+
+    def _reset_after_fork(self):
+        """Forget the parent's client in a forked child; the next call creates a new one"""
+        FirebaseService._init_lock = threading.Lock()
+        self._db = None
+        # The parent's refresh threads do not exist in the child
+        self._executor = None
+        self._refreshes = {}
 
     @property
     def db(self):
-        """Get Firestore database instance"""
+        """Get Firestore database instance, initializing it on first use"""
         if self._db is None:
             self._initialize_firebase()
         return self._db
 
+    @property
+    def auth(self):
+        """The firebase_admin.auth module, with the default app initialized"""
+        if self._auth is None:
+            with self._init_lock:
+                if self._auth is None:
+                    from firebase_admin import auth
+
+                    try:
+                        self._initialize_app()
+                    except Exception as e:
+                        # Auth calls then fail (and are logged) where they are made
+                        logger.error(f"Failed to initialize Firebase: {e}")
+                        return auth
+                    self._auth = auth
+        return self._auth
+
+    def _cached(self, key, loader, timeout=CACHE_TIMEOUT, max_stale=None):
+        """
+        Return a cached value, calling loader() to populate it on a miss
+
+        With max_stale, a value that expired less than max_stale seconds ago
+        is still returned at once (stale-while-revalidate): the first request
+        to see it starts one background refresh and nobody waits on
+        Firestore. That is one refresh per cache: per process with the
+        default local-memory cache, across all processes only when CACHES
+        points at a shared backend (memcached, Redis). Writes delete the
+        key, so changes made through this service are never served stale.
+
+        A copy is also kept for FALLBACK_CACHE_TIMEOUT and returned when
+        loader() fails, so a Firestore outage shows older data instead of
+        none (the request is marked degraded by monitoring.resilience).
+        """
+        entry = cache.get(key)
+        if entry is not None:
+            value, fresh_until = entry
+            if time.time() < fresh_until:
+                metrics.cache_requests.inc(key, 'hit')
+                return value
+            if max_stale is not None:
+                metrics.cache_requests.inc(key, 'stale')
+                self._refresh_later(key, entry, loader, timeout, max_stale)
+                return value
+        metrics.cache_requests.inc(key, 'miss')
+        try:
+            value = loader()
+        except Exception as e:
+            fallback = cache.get(f"{key}:fallback")
+            if fallback is None:
+                raise
+            metrics.cache_fallbacks.inc(key)
+            logger.warning(f"Serving last good copy of {key} after Firestore error: {e}")
+            return fallback
+        self._store(key, value, timeout, max_stale)
+        return value
+
+    def _store(self, key, value, timeout, max_stale):
+        cache.set(key, (value, time.time() + timeout), timeout + (max_stale or 0))
+        cache.set(f"{key}:fallback", value, FALLBACK_CACHE_TIMEOUT)
+
+    def _refresh_later(self, key, entry, loader, timeout, max_stale):
+        """Reload a stale cache entry on a background thread, unless a refresh is running"""
+        # cache.add is atomic, so only one refresh per key runs among the
+        # processes sharing this cache
+        if not cache.add(f"{key}:refreshing", True, REFRESH_LOCK_TIMEOUT):
+            return
+        if self._executor is None:
+            with self._init_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS,
+                                                        thread_name_prefix='cache-refresh')
+        self._refreshes[key] = self._executor.submit(self._refresh, key, entry, loader, timeout, max_stale)
+
+    def _refresh(self, key, entry, loader, timeout, max_stale):
+        try:
+            value = loader()
+            # Only replace the entry that was stale: if a write invalidated it
+            # (and maybe a request already loaded newer data), drop this result.
+            # Entries are told apart by their fresh_until timestamp
+            current = cache.get(key)
+            if current is not None and current[1] == entry[1]:
+                self._store(key, value, timeout, max_stale)
+            metrics.cache_refreshes.inc(key, 'ok')
+        except Exception as e:
+            logger.error(f"Error refreshing {key}: {e}")
+            metrics.cache_refreshes.inc(key, 'error')
+        finally:
+            cache.delete(f"{key}:refreshing")
+
     # Authentication Management
     def create_auth_user(self, email, password, display_name=None):
-        """Create a Firebase Auth user"""
+        """
+        Create a Firebase Auth user
+
+        Returns:
+            str: The new user's uid, or None on failure
+
+        Raises:
+            auth.EmailAlreadyExistsError: The email is taken (retrying cannot help)
+        """
+        auth = self.auth
         try:
             user = auth.create_user(
                 email=email,
@@ -51,20 +329,61 @@ class FirebaseService:
             return user.uid
         except auth.EmailAlreadyExistsError:
             logger.error(f"Email already exists: {email}")
-            return None
+            raise
         except Exception as e:
             logger.error(f"Error creating auth user {email}: {e}")
             return None
 
+    def import_auth_users(self, users, password_rounds):
+        """
+        Bulk import Firebase Auth users with pre-hashed PBKDF2-SHA256 passwords
+
+        Args:
+            users (list): dicts with uid, email, display_name, password_hash and
+                          password_salt (bytes)
+            password_rounds (int): PBKDF2 rounds used for every hash
+
+        Returns:
+            dict: {index in users: failure reason} for users that were not imported
+        """
+        failures = {}
+        auth = self.auth
+        hash_alg = auth.UserImportHash.pbkdf2_sha256(rounds=password_rounds)
+        for start in range(0, len(users), AUTH_BATCH_LIMIT):
+            chunk = users[start:start + AUTH_BATCH_LIMIT]
+            records = [auth.ImportUserRecord(**user) for user in chunk]
+            try:
+                result = auth.import_users(records, hash_alg=hash_alg)
+                for error in result.errors:
+                    failures[start + error.index] = error.reason
+                logger.info(f"Firebase Auth import: {result.success_count} imported, {result.failure_count} failed")
+            except Exception as e:
+                logger.error(f"Error importing auth users: {e}")
+                for index in range(len(chunk)):
+                    failures[start + index] = str(e)
+        return failures
+
+    def delete_auth_users(self, uids):
+        """Bulk delete Firebase Auth users (used to roll back a failed import)"""
+        uids = list(uids)
+        auth = self.auth
+        for start in range(0, len(uids), AUTH_BATCH_LIMIT):
+            try:
+                auth.delete_users(uids[start:start + AUTH_BATCH_LIMIT])
+            except Exception as e:
+                logger.error(f"Error deleting auth users: {e}")
+
     # Terminal Management
     def create_terminal(self, terminal_data):
         """Create a new terminal in Firestore"""
         try:
             terminal_data['created_at'] = datetime.now()
             terminal_data['updated_at'] = datetime.now()
+            terminal_data['geohash'] = self.terminal_geohash(terminal_data)
             doc_ref = self.db.collection('terminals').document()
             terminal_data['terminal_id'] = doc_ref.id
             doc_ref.set(terminal_data)
+            self._invalidate_terminals()
             logger.info(f"Terminal created: {doc_ref.id}")
             return doc_ref.id
         except Exception as e:
@@ -82,16 +401,90 @@ class FirebaseService:
             logger.error(f"Error getting terminal {terminal_id}: {e}")
             return None
 
-    def get_all_terminals(self):
-        """Get all terminals"""
+    def _load_all_terminals(self):
+        terminals = []
+        docs = self.db.collection('terminals').stream()
+        for doc in docs:
+            terminal_data = doc.to_dict()
+            terminal_data['id'] = doc.id
+            terminals.append(terminal_data)
+        return terminals
+
+    @staticmethod
+    def terminal_geohash(terminal_data):
+        """Geohash of a terminal's coordinates, or None if it has none"""
+        coordinates = terminal_coordinates(terminal_data)
+        return geohash_encode(*coordinates) if coordinates else None
+
+    def get_terminals_within(self, lat, lng, radius_m, active_only=True):
+        """
+        Get terminals within radius_m meters of a point, nearest first
+
+        Issues a few geohash range queries (at most 9) covering the circle,
+        so reads scale with the number of nearby terminals. Radii larger
+        than the coarsest geohash cells fall back to the cached terminal
+        list. Each terminal gets a 'distance_m' key.
+        """
         try:
+            ranges = covering_ranges(lat, lng, radius_m)
+            if ranges:
+                candidates = {}
+                for low, high in ranges:
+                    query = (self.db.collection('terminals')
+                             .where('geohash', '>=', low)
+                             .where('geohash', '<=', high))
+                    for doc in query.stream():
+                        terminal_data = doc.to_dict()
+                        terminal_data['id'] = doc.id
+                        candidates[doc.id] = terminal_data
+                candidates = candidates.values()
+            else:
+                candidates = self.get_all_terminals()
+
             terminals = []
-            docs = self.db.collection('terminals').stream()
-            for doc in docs:
-                terminal_data = doc.to_dict()
-                terminal_data['id'] = doc.id
-                terminals.append(terminal_data)
+            for terminal_data in candidates:
+                coordinates = terminal_coordinates(terminal_data)
+                if not coordinates or (active_only and not terminal_data.get('is_active', True)):
+                    continue
+                distance = haversine_m(lat, lng, *coordinates)
+                if distance <= radius_m:
+                    terminals.append({**terminal_data, 'distance_m': distance})
+            terminals.sort(key=lambda t: t['distance_m'])
             return terminals
+        except Exception as e:
+            logger.error(f"Error getting terminals within {radius_m}m of ({lat}, {lng}): {e}")
+            return []
+
+    def batch_update_terminals(self, updates, batch_size=BATCH_WRITE_LIMIT):
+        """
+        Apply {terminal_id: update_data} in batched writes (for derived fields;
+        updated_at is left alone). Returns the number of terminals written.
+        """
+        items = list(updates.items())
+        batch_size = min(batch_size, BATCH_WRITE_LIMIT)
+        written = 0
+        try:
+            for start in range(0, len(items), batch_size):
+                batch = self.db.batch()
+                for terminal_id, update_data in items[start:start + batch_size]:
+                    batch.update(self.db.collection('terminals').document(terminal_id), update_data)
+                batch.commit()
+                written += len(items[start:start + batch_size])
+            logger.info(f"Batch updated {written} terminals")
+        except Exception as e:
+            logger.error(f"Error batch updating terminals after {written} writes: {e}")
+        if written:
+            self._invalidate_terminals()
+        return written
+
+    def _invalidate_terminals(self):
+        cache.delete(TERMINALS_CACHE_KEY)
+        self.terminals_version += 1
+
+    def get_all_terminals(self):
+        """Get all terminals (cached, refreshed in the background; invalidated on terminal writes)"""
+        try:
+            return self._cached(TERMINALS_CACHE_KEY, self._load_all_terminals, max_stale=CACHE_MAX_STALE)
         except Exception as e:
             logger.error(f"Error getting terminals: {e}")
             return []
@@ -100,7 +493,13 @@ class FirebaseService:
         """Update a terminal"""
         try:
             update_data['updated_at'] = datetime.now()
+            if 'latitude' in update_data or 'longitude' in update_data:
+                position = update_data
+                if not ('latitude' in update_data and 'longitude' in update_data):
+                    position = {**(self.get_terminal(terminal_id) or {}), **update_data}
+                update_data['geohash'] = self.terminal_geohash(position)
             self.db.collection('terminals').document(terminal_id).update(update_data)
+            self._invalidate_terminals()
             logger.info(f"Terminal updated: {terminal_id}")
             return True
         except Exception as e:
@@ -111,6 +510,7 @@ class FirebaseService:
         """Delete a terminal"""
         try:
             self.db.collection('terminals').document(terminal_id).delete()
+            self._invalidate_terminals()
             logger.info(f"Terminal deleted: {terminal_id}")
             return True
         except Exception as e:
@@ -126,12 +526,55 @@ class FirebaseService:
             doc_ref = self.db.collection('drivers').document()
             driver_data['driver_id'] = doc_ref.id
             doc_ref.set(driver_data)
+            cache.delete(DRIVERS_CACHE_KEY)
             logger.info(f"Driver created: {doc_ref.id}")
+            self.register_driver_aliases(doc_ref.id, self.driver_aliases_for(driver_data))
             return doc_ref.id
         except Exception as e:
             logger.error(f"Error creating driver: {e}")
             return None
 
+    def new_driver_id(self):
+        """Allocate a driver document ID without writing anything"""
+        return self.db.collection('drivers').document().id
+
+    def batch_create_drivers(self, drivers):
+        """
+        Create drivers in batched writes
+
+        Args:
+            drivers (dict): {driver_id: driver_data}, IDs from new_driver_id()
+
+        Returns:
+            list: IDs of the drivers that were written
+        """
+        written = []
+        items = list(drivers.items())
+        try:
+            for start in range(0, len(items), BATCH_WRITE_LIMIT):
+                chunk = items[start:start + BATCH_WRITE_LIMIT]
+                batch = self.db.batch()
+                for driver_id, driver_data in chunk:
+                    driver_data['created_at'] = datetime.now()
+                    driver_data['updated_at'] = datetime.now()
+                    driver_data['driver_id'] = driver_id
+                    batch.set(self.db.collection('drivers').document(driver_id), driver_data)
+                batch.commit()
+                written.extend(driver_id for driver_id, _ in chunk)
+            logger.info(f"Batch created {len(written)} drivers")
+        except Exception as e:
+            logger.error(f"Error batch creating drivers after {len(written)} writes: {e}")
+        finally:
+            cache.delete(DRIVERS_CACHE_KEY)
+
+        aliases = {}
+        for driver_id in written:
+            for alias in self.driver_aliases_for(drivers[driver_id]):
+                aliases[alias] = driver_id
+        if aliases:
+            self.register_driver_alias_map(aliases)
+        return written
+
     def get_driver(self, driver_id):
         """Get a driver by ID"""
         try:
@@ -143,16 +586,19 @@ class FirebaseService:
             logger.error(f"Error getting driver {driver_id}: {e}")
             return None
 
+    def _load_all_drivers(self):
+        drivers = []
+        docs = self.db.collection('drivers').stream()
+        for doc in docs:
+            driver_data = doc.to_dict()
+            driver_data['id'] = doc.id
+            drivers.append(driver_data)
+        return drivers
+
     def get_all_drivers(self):
-        """Get all drivers"""
+        """Get all drivers (cached, refreshed in the background; invalidated on driver writes)"""
         try:
-            drivers = []
-            docs = self.db.collection('drivers').stream()
-            for doc in docs:
-                driver_data = doc.to_dict()
-                driver_data['id'] = doc.id
-                drivers.append(driver_data)
-            return drivers
+            return self._cached(DRIVERS_CACHE_KEY, self._load_all_drivers, max_stale=CACHE_MAX_STALE)
         except Exception as e:
             logger.error(f"Error getting drivers: {e}")
             return []
@@ -162,6 +608,11 @@ class FirebaseService:
         try:
             update_data['updated_at'] = datetime.now()
             self.db.collection('drivers').document(driver_id).update(update_data)
+            cache.delete(DRIVERS_CACHE_KEY)
+            # New identifiers must resolve too; old ones stay mapped for existing trips
+            aliases = self.driver_aliases_for({key: update_data.get(key) for key in ('auth_uid', 'email')})
+            if aliases:
+                self.register_driver_aliases(driver_id, aliases)
             logger.info(f"Driver updated: {driver_id}")
             return True
         except Exception as e:
@@ -172,22 +623,131 @@ class FirebaseService:
         """Delete a driver"""
         try:
             self.db.collection('drivers').document(driver_id).delete()
+            cache.delete(DRIVERS_CACHE_KEY)
             logger.info(f"Driver deleted: {driver_id}")
             return True
         except Exception as e:
             logger.error(f"Error deleting driver {driver_id}: {e}")
             return False
 
+    # Driver Identity
+    @staticmethod
+    def driver_aliases_for(driver_data):
+        """Get every identifier trips may use to reference a driver"""
+        aliases = set()
+        for key in ('driver_id', 'id', 'auth_uid', 'email'):
+            alias = normalize_driver_alias(driver_data.get(key))
+            if alias:
+                aliases.add(alias)
+        return aliases
+
+    def _load_driver_alias_map(self):
+        doc = self.db.collection('meta').document(DRIVER_ALIASES_DOC).get()
+        if doc.exists:
+            return doc.to_dict().get('aliases', {})
+        return {}
+
+    def get_driver_alias_map(self):
+        """Get the alias -> canonical driver ID map"""
+        try:
+            return self._cached(DRIVER_ALIASES_CACHE_KEY, self._load_driver_alias_map)
+        except Exception as e:
+            logger.error(f"Error getting driver aliases: {e}")
+            return {}
+
+    def register_driver_aliases(self, driver_id, aliases):
+        """Point each alias at the canonical driver ID"""
+        mapping = {normalize_driver_alias(alias): driver_id for alias in aliases}
+        mapping[normalize_driver_alias(driver_id)] = driver_id
+        return self.register_driver_alias_map(mapping)
+
+    def register_driver_alias_map(self, mapping):
+        """Merge {alias: canonical driver ID} entries into the alias map in one write"""
+        try:
+            mapping = {normalize_driver_alias(alias): driver_id for alias, driver_id in mapping.items()}
+            self.db.collection('meta').document(DRIVER_ALIASES_DOC).set({'aliases': mapping}, merge=True)
+            cache.delete(DRIVER_ALIASES_CACHE_KEY)
+            return True
+        except Exception as e:
+            logger.error(f"Error registering driver aliases: {e}")
+            return False
+
+    def replace_driver_alias_map(self, alias_map):
+        """Overwrite the whole alias map (used by the canonicalization command)"""
+        try:
+            self.db.collection('meta').document(DRIVER_ALIASES_DOC).set({
+                'aliases': alias_map,
+                'updated_at': datetime.now(),
+            })
+            cache.delete(DRIVER_ALIASES_CACHE_KEY)
+            logger.info(f"Driver alias map replaced: {len(alias_map)} aliases")
+            return True
+        except Exception as e:
+            logger.error(f"Error replacing driver alias map: {e}")
+            return False
+
+    def canonical_driver_id(self, identifier):
+        """Resolve any known driver identifier to the canonical driver ID"""
+        if not identifier:
+            return identifier
+        return self.get_driver_alias_map().get(normalize_driver_alias(identifier), identifier)
+
+    def _load_trip_driver_ids(self):
+        doc = self.db.collection('meta').document(TRIP_DRIVER_IDS_DOC).get()
+        if doc.exists:
+            return set(doc.to_dict().get('driver_ids', []))
+        return set()
+
+    def get_trip_driver_ids(self):
+        """Get every driver ID referenced by any trip, from the distinct-values index"""
+        try:
+            return self._cached(TRIP_DRIVER_IDS_CACHE_KEY, self._load_trip_driver_ids)
+        except Exception as e:
+            logger.error(f"Error getting trip driver IDs: {e}")
+            return set()
+
+    def record_trip_driver_id(self, driver_id):
+        """Add a driver ID to the distinct-values index if it is not already known"""
+        if not driver_id or driver_id in self.get_trip_driver_ids():
+            return
+        try:
+            from google.cloud.firestore import ArrayUnion
+
+            self.db.collection('meta').document(TRIP_DRIVER_IDS_DOC).set({
+                'driver_ids': ArrayUnion([driver_id]),
+            }, merge=True)
+            cache.delete(TRIP_DRIVER_IDS_CACHE_KEY)
+        except Exception as e:
+            logger.error(f"Error recording trip driver ID {driver_id}: {e}")
+
+    def replace_trip_driver_ids(self, driver_ids):
+        """Overwrite the distinct-values index (used when rebuilding it from all trips)"""
+        try:
+            self.db.collection('meta').document(TRIP_DRIVER_IDS_DOC).set({
+                'driver_ids': sorted(driver_ids),
+                'updated_at': datetime.now(),
+            })
+            cache.delete(TRIP_DRIVER_IDS_CACHE_KEY)
+            return True
+        except Exception as e:
+            logger.error(f"Error replacing trip driver IDs: {e}")
+            return False
+
     # Trip Management
     def create_trip(self, trip_data):
         """Create a new trip in Firestore"""
         try:
+            if trip_data.get('driver_id'):
+                trip_data['driver_id'] = self.canonical_driver_id(trip_data['driver_id'])
             trip_data['created_at'] = datetime.now()
             trip_data['updated_at'] = datetime.now()
             doc_ref = self.db.collection('trips').document()
             trip_data['trip_id'] = doc_ref.id
-            doc_ref.set(trip_data)
+            result = doc_ref.set(trip_data)
+            self._remember_trip(doc_ref.id, trip_data, result.update_time)
+            self._invalidate_trip_pages()
             logger.info(f"Trip created: {doc_ref.id}")
+            self.record_trip_driver_id(trip_data.get('driver_id'))
             return doc_ref.id
         except Exception as e:
             logger.error(f"Error creating trip: {e}")
@@ -198,17 +758,123 @@ class FirebaseService:
         try:
             doc = self.db.collection('trips').document(trip_id).get()
             if doc.exists:
-                return doc.to_dict()
+                trip = doc.to_dict()
+                self._remember_trip(trip_id, trip, doc.update_time)
+                return trip
             return None
         except Exception as e:
             logger.error(f"Error getting trip {trip_id}: {e}")
             return None
 
+    def _remember_trip(self, trip_id, trip, update_time):
+        """
+        Cache a trip's data with the Firestore update time it has at that
+        version (None when unknown)
+        """
+        state = (trip, update_time)
+        cache.set(TRIP_STATE_CACHE_KEY.format(trip_id), state, TRIP_STATE_CACHE_TIMEOUT)
+        return state
+
+    def update_trip_if(self, trip_id, expected_status, changes):
+        """
+        Update a trip only while it has the expected status
+
+        The write carries a last-update-time precondition for the version of
+        the trip whose status was checked, so it fails instead of overwriting
+        a concurrent change; the trip is then read again and checked anew.
+        That version comes from the trip state cache when this process read
+        or wrote the trip recently (one round trip in all), otherwise from a
+        read (two). The trip returned is that version merged with the
+        changes, so it is not read again afterwards.
+
+        Args:
+            trip_id (str): Trip document ID
+            expected_status (str): Status the trip must have
+            changes (dict or callable): Top-level fields to set, or a function
+                building them from the current trip data (called again if
+                the trip changed in the meantime)
+
+        Returns:
+            tuple: (trip, error) - the updated trip data and None on success;
+                   otherwise error is 'not_found', 'wrong_status' (trip is
+                   then the current data) or 'failed' (trip is None)
+        """
+        key = TRIP_STATE_CACHE_KEY.format(trip_id)
+        state = cache.get(key)
+        try:
+            document = self.db.collection('trips').document(trip_id)
+            for _ in range(TRIP_UPDATE_ATTEMPTS):
+                cached = state is not None and state[1] is not None
+                if not cached:
+                    snapshot = document.get()
+                    if not snapshot.exists:
+                        cache.delete(key)
+                        metrics.firestore_conditional_updates.inc('not_found')
+                        return None, 'not_found'
+                    state = self._remember_trip(trip_id, snapshot.to_dict(), snapshot.update_time)
+                trip, update_time = state
+
+                if trip.get('status') != expected_status:
+                    if cached:
+                        # The cached copy may be behind; refuse only on what Firestore says
+                        state = None
+                        continue
+                    metrics.firestore_conditional_updates.inc('wrong_status')
+                    return trip, 'wrong_status'
+
+                update_data = dict(changes(trip) if callable(changes) else changes)
+                update_data['updated_at'] = datetime.now()
+                try:
+                    result = document.update(
+                        update_data, option=self.db.write_option(last_update_time=update_time))
+                except Exception as e:
+                    if type(e).__name__ != 'FailedPrecondition':
+                        raise
+                    # Someone else wrote the trip after this version
+                    metrics.firestore_conditional_updates.inc('conflict')
+                    state = None
+                    continue
+
+                trip = {**trip, **update_data}
+                self._remember_trip(trip_id, trip, result.update_time)
+                if any(field in update_data for field in TRIP_LIST_FIELDS):
+                    self._invalidate_trip_pages()
+                metrics.firestore_conditional_updates.inc('updated')
+                logger.info(f"Trip updated: {trip_id}")
+                self.record_trip_driver_id(update_data.get('driver_id'))
+                return trip, None
+            logger.error(f"Trip {trip_id} kept changing; gave up after {TRIP_UPDATE_ATTEMPTS} attempts")
+        except Exception as e:
+            logger.error(f"Error updating trip {trip_id}: {e}")
+        cache.delete(key)
+        metrics.firestore_conditional_updates.inc('failed')
+        return None, 'failed'
+
+    def increment_trip_passengers(self, trip_id, delta):
+        """
+        Add delta to an active trip's passenger count, never going below zero
+
+        A conditional update (see update_trip_if): a trip completed or
+        cancelled meanwhile, by any process, is left alone, and a concurrent
+        change to the count makes the update start over from the new count.
+        When this process knows the trip's current version, that is one write.
+
+        Args:
+            trip_id (str): Trip document ID
+            delta (int): Passengers boarding (positive) or leaving (negative)
+
+        Returns:
+            tuple: (trip, error) as returned by update_trip_if
+        """
+        return self.update_trip_if(trip_id, 'in_progress', lambda trip: {
+            'passengers': max(0, int(trip.get('passengers') or 0) + delta),
+        })
+
     def get_all_trips(self, limit=None):
         """Get all trips with optional limit"""
         try:
             trips = []
-            query = self.db.collection('trips').order_by('created_at', direction=firestore.Query.DESCENDING)
+            query = self.db.collection('trips').order_by('created_at', direction=DESCENDING)
             if limit:
                 query = query.limit(limit)
             docs = query.stream()
@@ -221,6 +887,126 @@ class FirebaseService:
             logger.error(f"Error getting trips: {e}")
             return []
 
+    def get_trips(self, status=None, driver_id=None):
+        """Get trips matching an exact status and/or driver ID, newest first"""
+        try:
+            trips = []
+            query = self.db.collection('trips')
+            if status:
+                query = query.where('status', '==', status)
+            if driver_id:
+                query = query.where('driver_id', '==', driver_id)
+            if not status and not driver_id:
+                query = query.order_by('created_at', direction=DESCENDING)
+            docs = query.stream()
+            for doc in docs:
+                trip_data = doc.to_dict()
+                trip_data['id'] = doc.id
+                trips.append(trip_data)
+            if status or driver_id:
+                # Sorting here avoids a composite index per filter combination
+                trips.sort(key=lambda t: t.get('created_at') or datetime.min, reverse=True)
+            return trips
+        except Exception as e:
+            logger.error(f"Error getting trips (status={status}, driver_id={driver_id}): {e}")
+            return []
+
+    def get_trip_sequence(self, status=None, driver_ids=None):
+        """
+        Trips newest first as a lazily paginated sequence
+
+        Filtering and ordering run in Firestore, which needs the composite
+        indexes in firestore.indexes.json. Trips without created_at are not
+        included.
+
+        Args:
+            status (str): Exact status to match
+            driver_ids (list): Canonical driver IDs to match (None for any)
+
+        Returns:
+            QuerySequence or list: The trips; a plain list when more driver
+                                   IDs are given than one 'in' filter allows
+        """
+        if driver_ids is not None:
+            driver_ids = sorted(set(driver_ids))
+            if not driver_ids:
+                return []
+            if len(driver_ids) > IN_FILTER_LIMIT:
+                wanted = set(driver_ids)
+                return [trip for trip in self.get_trips(status=status)
+                        if trip.get('driver_id') in wanted and trip.get('created_at')]
+
+        collection = self.db.collection('trips')
+        query = collection
+        if status:
+            query = query.where('status', '==', status)
+        if driver_ids and len(driver_ids) == 1:
+            query = query.where('driver_id', '==', driver_ids[0])
+        elif driver_ids:
+            query = query.where('driver_id', 'in', driver_ids)
+        query = query.order_by('created_at', direction=DESCENDING)
+
+        shape = hashlib.md5(repr((status, driver_ids)).encode()).hexdigest()
+        version = cache.get(TRIP_PAGES_VERSION_KEY, 0)
+        return QuerySequence(query, collection, f"firebase:trip_pages:{version}:{shape}")
+
+    def _invalidate_trip_pages(self):
+        """
+        Drop the trip list's page counts and cursors: a trip added, removed or
+        moved between filters shifts every page boundary after it
+        """
+        try:
+            cache.incr(TRIP_PAGES_VERSION_KEY)
+        except ValueError:
+            cache.set(TRIP_PAGES_VERSION_KEY, 1, None)
+
+    def iter_trips(self, status=None, driver_id=None, start=None, end=None, page_size=500):
+        """
+        Stream trips newest first in cursor-paginated pages
+
+        Only one page is held in memory at a time, so this is safe for
+        exporting the whole history. Filtering on status and/or driver_id
+        while ordering by created_at needs the matching composite index in
+        firestore.indexes.json; a created_at range alone does not.
+
+        Args:
+            status (str): Exact status to match
+            driver_id (str): Exact (canonical) driver ID to match
+            start (datetime): Include trips created at or after this time
+            end (datetime): Include trips created before this time
+            page_size (int): Documents fetched per round trip
+
+        Yields:
+            dict: Trip data with 'id'
+        """
+        query = self.db.collection('trips')
+        if status:
+            query = query.where('status', '==', status)
+        if driver_id:
+            query = query.where('driver_id', '==', driver_id)
+        if start:
+            query = query.where('created_at', '>=', start)
+        if end:
+            query = query.where('created_at', '<', end)
+        query = query.order_by('created_at', direction=DESCENDING).limit(page_size)
+
+        last_doc = None
+        try:
+            while True:
+                page = query.start_after(last_doc) if last_doc else query
+                docs = list(page.stream())
+                for doc in docs:
+                    trip_data = doc.to_dict()
+                    trip_data['id'] = doc.id
+                    yield trip_data
+                if len(docs) < page_size:
+                    return
+                last_doc = docs[-1]
+        except Exception as e:
+            # Re-raise so a partial export fails visibly instead of looking complete
+            logger.error(f"Error streaming trips after {last_doc.id if last_doc else 'start'}: {e}")
+            raise
+
     def get_trips_by_status(self, status):
         """Get trips by status"""
         try:
@@ -254,22 +1040,103 @@ class FirebaseService:
         try:
             update_data['updated_at'] = datetime.now()
             self.db.collection('trips').document(trip_id).update(update_data)
+            cache.delete(TRIP_STATE_CACHE_KEY.format(trip_id))
+            if any(field in update_data for field in TRIP_LIST_FIELDS):
+                self._invalidate_trip_pages()
             logger.info(f"Trip updated: {trip_id}")
+            self.record_trip_driver_id(update_data.get('driver_id'))
             return True
         except Exception as e:
             logger.error(f"Error updating trip {trip_id}: {e}")
             return False
 
+    def batch_update_trips(self, updates, batch_size=BATCH_WRITE_LIMIT, progress=None):
+        """
+        Apply {trip_id: update_data} in batched writes.
+        Calls progress(written, total) after each committed batch.
+        Returns the number of trips written.
+        """
+        items = list(updates.items())
+        batch_size = min(batch_size, BATCH_WRITE_LIMIT)
+        written = 0
+        try:
+            for start in range(0, len(items), batch_size):
+                batch = self.db.batch()
+                for trip_id, update_data in items[start:start + batch_size]:
+                    update_data['updated_at'] = datetime.now()
+                    batch.update(self.db.collection('trips').document(trip_id), update_data)
+                batch.commit()
+                cache.delete_many([TRIP_STATE_CACHE_KEY.format(trip_id)
+                                   for trip_id, _ in items[start:start + batch_size]])
+                if any(field in update_data for _, update_data in items[start:start + batch_size]
+                       for field in TRIP_LIST_FIELDS):
+                    self._invalidate_trip_pages()
+                written += len(items[start:start + batch_size])
+                if progress:
+                    progress(written, len(items))
+            logger.info(f"Batch updated {written} trips")
+        except Exception as e:
+            logger.error(f"Error batch updating trips after {written} writes: {e}")
+        return written
+
     def delete_trip(self, trip_id):
         """Delete a trip"""
         try:
             self.db.collection('trips').document(trip_id).delete()
+            cache.delete(TRIP_STATE_CACHE_KEY.format(trip_id))
+            self._invalidate_trip_pages()
             logger.info(f"Trip deleted: {trip_id}")
             return True
         except Exception as e:
             logger.error(f"Error deleting trip {trip_id}: {e}")
             return False
 
+    def _load_dashboard_counts(self):
+        trips = self.db.collection('trips')
+        return {
+            status: int(trips.where('status', '==', status).count().get()[0][0].value)
+            for status in ('in_progress', 'completed')
+        }
+
+    def get_dashboard_counts(self):
+        """
+        Number of active and completed trips for the dashboard
+
+        Count aggregations, cached for DASHBOARD_CACHE_TIMEOUT and refreshed
+        in the background; never more than DASHBOARD_MAX_STALE seconds old.
+
+        Returns:
+            dict: {'in_progress': n, 'completed': n}
+        """
+        try:
+            return self._cached(DASHBOARD_COUNTS_CACHE_KEY, self._load_dashboard_counts,
+                                timeout=DASHBOARD_CACHE_TIMEOUT, max_stale=DASHBOARD_MAX_STALE)
+        except Exception as e:
+            logger.error(f"Error getting dashboard counts: {e}")
+            return {'in_progress': 0, 'completed': 0}
+
+    def count_trips(self, start=None, end=None):
+        """
+        Number of trips created in a time range, as one count aggregation
+
+        Args:
+            start (datetime): Include trips created at or after this time
+            end (datetime): Include trips created before this time
+
+        Returns:
+            int: Trip count, or None if it could not be read
+        """
+        try:
+            query = self.db.collection('trips')
+            if start:
+                query = query.where('created_at', '>=', start)
+            if end:
+                query = query.where('created_at', '<', end)
+            return int(query.count().get()[0][0].value)
+        except Exception as e:
+            logger.error(f"Error counting trips: {e}")
+            return None
+
     def get_active_trips(self):
         """Get all active/in-progress trips"""
         return self.get_trips_by_status('in_progress')
@@ -279,5 +1146,8 @@ class FirebaseService:
         return self.get_trips_by_status('completed')
 
 
-# Singleton instance
-firebase_service = FirebaseService()
\ No newline at end of file
+# Singleton instance (initializes lazily, see FirebaseService)
+firebase_service = FirebaseService()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=firebase_service._reset_after_fork)
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+Terminal spatial index
+Active terminals with coordinates are kept in an in-memory KD-tree over
+unit-sphere (x, y, z) points, where straight-line distance orders points
+the same way as great-circle distance. The tree is rebuilt after terminal
+writes in this process, and otherwise when the terminal cache expires.
+"""
+
+import heapq
+import logging
+import math
+import threading
+import time
+from .firebase_service import firebase_service, CACHE_TIMEOUT
+from .geohash import haversine_m, terminal_coordinates
+
+logger = logging.getLogger(__name__)
+
+def to_unit_vector(lat, lng):
+    phi, lmb = math.radians(lat), math.radians(lng)
+    return (math.cos(phi) * math.cos(lmb), math.cos(phi) * math.sin(lmb), math.sin(phi))
+
+class TerminalIndex:
+    """KD-tree over terminal positions for k-nearest queries"""
+
+    def __init__(self, terminals, version=None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.terminals = []
+        points = []
+        for terminal in terminals:
+            coordinates = terminal_coordinates(terminal)
+            if coordinates and terminal.get('is_active', True):
+                points.append((to_unit_vector(*coordinates), len(self.terminals)))
+                self.terminals.append((terminal, coordinates))
+        self.root = self._build(points, 0)
+
+    def __len__(self):
+        return len(self.terminals)
+
+    def _build(self, points, depth):
+        """Nodes are (point, terminal index, axis, left, right) tuples"""
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda item: item[0][axis])
+        middle = len(points) // 2
+        point, index = points[middle]
+        return (point, index, axis,
+                self._build(points[:middle], depth + 1),
+                self._build(points[middle + 1:], depth + 1))
+
+    def _search(self, node, target, k, heap):
+        point, index, axis, left, right = node
+        distance = ((point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2
+                    + (point[2] - target[2]) ** 2)
+        if len(heap) < k:
+            heapq.heappush(heap, (-distance, index))
+        elif distance < -heap[0][0]:
+            heapq.heapreplace(heap, (-distance, index))
+
+        offset = target[axis] - point[axis]
+        near, far = (left, right) if offset < 0 else (right, left)
+        if near is not None:
+            self._search(near, target, k, heap)
+        # The other side can only hold closer points if the splitting plane is
+        # nearer than the current k-th best
+        if far is not None and (len(heap) < k or offset * offset < -heap[0][0]):
+            self._search(far, target, k, heap)
+
+    def nearest(self, lat, lng, k=1):
+        """
+        The k nearest terminals to a point
+
+        Returns:
+            list: (terminal dict, distance in meters) tuples, nearest first
+        """
+        if self.root is None or k < 1:
+            return []
+        heap = []
+        self._search(self.root, to_unit_vector(lat, lng), k, heap)
+        results = []
+        for _, index in sorted(heap, key=lambda item: -item[0]):
+            terminal, (terminal_lat, terminal_lng) = self.terminals[index]
+            results.append((terminal, haversine_m(lat, lng, terminal_lat, terminal_lng)))
+        return results
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_terminal_index():
+    """The current terminal index, rebuilt after terminal writes or cache expiry"""
+    global _index
+    index = _index
+    if (index is None or index.version != firebase_service.terminals_version
+            or time.monotonic() - index.built_at > CACHE_TIMEOUT):
+        with _index_lock:
+            if _index is index:
+                version = firebase_service.terminals_version
+                _index = TerminalIndex(firebase_service.get_all_terminals(), version)
+                logger.info(f"Terminal index built with {len(_index)} terminals")
+            index = _index
+    return index
+
+def nearest_terminals(lat, lng, k=1):
+    """The k nearest active terminals as (terminal, distance in meters) tuples"""
+    return get_terminal_index().nearest(lat, lng, k)
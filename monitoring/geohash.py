@@ -0,0 +1,116 @@
+"""
+Geohash encoding and radius coverage
+A geohash is a base-32 string whose prefixes are nested lat/lng cells, so
+"all points in a cell" is a single string range. Terminals store a geohash
+and radius searches become a handful of Firestore range queries (see
+FirebaseService.get_terminals_within).
+"""
+
+import math
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+# Most cells (Firestore range queries before merging) used to cover a circle
+MAX_COVERING_CELLS = 9
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_M / 360
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters between two (lat, lng) points in degrees"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def terminal_coordinates(terminal):
+    """(lat, lng) of a terminal as floats, or None if missing or out of range"""
+    try:
+        lat, lng = float(terminal.get('latitude')), float(terminal.get('longitude'))
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+def encode(lat, lng, precision=GEOHASH_PRECISION):
+    """Geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        interval, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(chars)
+
+def cell_size_degrees(precision):
+    """(height, width) in degrees of a geohash cell; longitude gets the odd bit"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+def _successor(cell):
+    """The geohash cell right after `cell` in string order at the same precision"""
+    index = GEOHASH_ALPHABET.index(cell[-1])
+    if index == len(GEOHASH_ALPHABET) - 1:
+        return None
+    return cell[:-1] + GEOHASH_ALPHABET[index + 1]
+
+def covering_ranges(lat, lng, radius_m, max_cells=MAX_COVERING_CELLS):
+    """
+    Geohash string ranges that together cover a circle
+
+    Picks the finest precision at which the circle's bounding box spans at
+    most max_cells cells, then merges cells that are adjacent in string
+    order into a single range.
+
+    Returns:
+        list: (low, high) inclusive string ranges, or [] if the circle is
+              too large even for the coarsest cells (callers should fall
+              back to a full scan)
+    """
+    dlat = radius_m / METERS_PER_DEGREE
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    # Longitude degrees shrink towards the poles; size the box for the poleward edge
+    edge_scale = math.cos(math.radians(max(abs(south), abs(north))))
+    dlng = dlat / edge_scale if edge_scale > dlat / 180.0 else 180.0
+    west, east = lng - dlng, lng + dlng
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size_degrees(precision)
+        first_row = math.floor((south + 90.0) / height)
+        last_row = min(math.floor((north + 90.0) / height), round(180.0 / height) - 1)
+        first_column = math.floor((west + 180.0) / width)
+        last_column = math.floor((east + 180.0) / width)
+        columns = min(last_column - first_column + 1, round(360.0 / width))
+        if (last_row - first_row + 1) * columns > max_cells:
+            continue
+
+        cells = set()
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, first_column + columns):
+                cell_lat = -90.0 + (row + 0.5) * height
+                cell_lng = (-180.0 + (column + 0.5) * width + 180.0) % 360.0 - 180.0
+                cells.add(encode(cell_lat, cell_lng, precision))
+
+        ranges = []
+        for cell in sorted(cells):
+            if ranges and _successor(ranges[-1][1]) == cell:
+                ranges[-1][1] = cell
+            else:
+                ranges.append([cell, cell])
+        return [(low, high + '~') for low, high in ranges]
+    return []
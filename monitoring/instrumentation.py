@@ -0,0 +1,329 @@
+"""
+Firestore operation instrumentation
+FirebaseService wraps its Firestore client in InstrumentedClient, so every
+document read, query, write and batch commit passes through one place.
+Each finished operation is reported to the registered listeners as a
+FirestoreOperation; tests count them (see monitoring.testing) and metrics
+or logging can subscribe the same way.
+
+Reads follow Firestore billing: a query is charged for every document it
+returns or skips with an offset, and at least one read even when it
+returns nothing.
+
+Each wrapper sends its call through monitoring.resilience, which adds a
+deadline, retries idempotent reads and applies the circuit breaker. Every
+attempt that reaches Firestore is reported as its own operation.
+"""
+
+import logging
+import threading
+import time
+from . import resilience
+
+logger = logging.getLogger(__name__)
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+
+class FirestoreOperation:
+    """One Firestore round trip and what it cost"""
+
+    __slots__ = ('kind', 'collection', 'reads', 'writes', 'duration', 'shape', 'error', 'thread_id')
+
+    def __init__(self, kind, collection, reads=0, writes=0, duration=0.0, shape=None, error=None):
+        self.kind = kind
+        self.collection = collection
+        self.reads = reads
+        self.writes = writes
+        self.duration = duration
+        self.shape = shape or {}
+        # Exception class name if the operation failed
+        self.error = error
+        self.thread_id = threading.get_ident()
+
+    def __repr__(self):
+        return (f"<FirestoreOperation {self.kind} {self.collection} "
+                f"reads={self.reads} writes={self.writes} {self.duration * 1000:.1f}ms>")
+
+
+def add_listener(listener):
+    """Call listener(operation) after every instrumented Firestore operation"""
+    global _listeners
+    with _listeners_lock:
+        _listeners = _listeners + [listener]
+
+
+def remove_listener(listener):
+    """Stop calling a listener registered with add_listener"""
+    global _listeners
+    with _listeners_lock:
+        _listeners = [item for item in _listeners if item is not listener]
+
+
+class FirestoreCounter:
+    """
+    Context manager that records the Firestore operations issued by the
+    current thread while it is active
+
+        with FirestoreCounter() as counter:
+            firebase_service.get_trip(trip_id)
+        counter.round_trips, counter.reads, counter.writes
+    """
+
+    def __init__(self):
+        self.operations = []
+        self._thread_id = None
+
+    def _record(self, operation):
+        if operation.thread_id == self._thread_id:
+            self.operations.append(operation)
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        add_listener(self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_listener(self._record)
+        return False
+
+    @property
+    def round_trips(self):
+        return len(self.operations)
+
+    @property
+    def reads(self):
+        return sum(operation.reads for operation in self.operations)
+
+    @property
+    def writes(self):
+        return sum(operation.writes for operation in self.operations)
+
+    def summary(self):
+        """Multi-line description of the recorded operations, for failure messages"""
+        lines = [f"{self.round_trips} round trips, {self.reads} reads, {self.writes} writes"]
+        for number, operation in enumerate(self.operations, 1):
+            lines.append(f"{number}. {operation.kind} {operation.collection} reads={operation.reads} "
+                         f"writes={operation.writes} {operation.shape or ''}".rstrip())
+        return '\n'.join(lines)
+
+
+def _emit(kind, collection, started, reads=0, writes=0, shape=None, error=None):
+    operation = FirestoreOperation(kind, collection, reads, writes, time.perf_counter() - started, shape, error)
+    for listener in _listeners:
+        try:
+            listener(operation)
+        except Exception as e:
+            logger.error(f"Firestore instrumentation listener failed: {e}")
+
+
+def _unwrap(value):
+    """The SDK object behind an instrumented wrapper"""
+    return getattr(value, '_wrapped', value)
+
+
+class InstrumentedClient:
+    """Firestore client wrapper that reports every operation to the listeners"""
+
+    def __init__(self, client):
+        self._wrapped = client
+
+    def collection(self, name):
+        return InstrumentedQuery(self._wrapped.collection(name), name)
+
+    def batch(self):
+        return InstrumentedBatch(self._wrapped.batch())
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+
+class InstrumentedQuery:
+    """Wraps a CollectionReference or Query; builder methods keep the wrapper"""
+
+    def __init__(self, query, collection, shape=None):
+        self._wrapped = query
+        self._collection = collection
+        self._shape = shape or {'filters': [], 'order_by': []}
+
+    def _derive(self, query, **changes):
+        shape = dict(self._shape, **changes)
+        return InstrumentedQuery(query, self._collection, shape)
+
+    def where(self, field_path, op_string, value):
+        return self._derive(self._wrapped.where(field_path, op_string, value),
+                            filters=self._shape['filters'] + [(field_path, op_string)])
+
+    def order_by(self, field_path, **kwargs):
+        direction = kwargs.get('direction', 'ASCENDING')
+        return self._derive(self._wrapped.order_by(field_path, **kwargs),
+                            order_by=self._shape['order_by'] + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._derive(self._wrapped.limit(count), limit=count)
+
+    def offset(self, num_to_skip):
+        return self._derive(self._wrapped.offset(num_to_skip), offset=num_to_skip)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._derive(self._wrapped.start_after(document_fields_or_snapshot), cursor=True)
+
+    def select(self, field_paths):
+        return self._derive(self._wrapped.select(field_paths), select=list(field_paths))
+
+    def count(self, **kwargs):
+        return InstrumentedAggregation(self._wrapped.count(**kwargs), self._collection, self._shape)
+
+    def document(self, document_id=None):
+        ref = self._wrapped.document(document_id) if document_id else self._wrapped.document()
+        return InstrumentedDocument(ref, self._collection)
+
+    def stream(self, *args, **kwargs):
+        return resilience.stream(lambda: self._stream(args, kwargs))
+
+    def _stream(self, args, kwargs):
+        started = time.perf_counter()
+        returned = 0
+        error = None
+        try:
+            for snapshot in self._wrapped.stream(*args, **resilience.deadline(kwargs)):
+                returned += 1
+                yield snapshot
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # Also reached when the caller stops early or the stream fails.
+            # Documents skipped by an offset are billed too.
+            reads = max(returned + self._shape.get('offset', 0), 1)
+            _emit('query', self._collection, started, reads=reads, shape=self._shape, error=error)
+
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+
+class InstrumentedAggregation:
+    """Wraps an aggregation query such as query.count()"""
+
+    def __init__(self, aggregation, collection, shape):
+        self._wrapped = aggregation
+        self._collection = collection
+        self._shape = dict(shape, aggregation='count')
+
+    def get(self, *args, **kwargs):
+        return resilience.call(lambda: self._get(args, kwargs), idempotent=True, operation='aggregation')
+
+    def _get(self, args, kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            return self._wrapped.get(*args, **resilience.deadline(kwargs))
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # Firestore bills small aggregations as one read
+            _emit('aggregation', self._collection, started, reads=1, shape=self._shape, error=error)
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+
+class InstrumentedDocument:
+    """Wraps a DocumentReference"""
+
+    def __init__(self, ref, collection):
+        self._wrapped = ref
+        self._collection = collection
+
+    @property
+    def id(self):
+        return self._wrapped.id
+
+    def _call(self, kind, method, *args, **kwargs):
+        return resilience.call(lambda: self._attempt(kind, method, args, kwargs),
+                               idempotent=kind == 'get', operation=kind)
+
+    def _attempt(self, kind, method, args, kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            return getattr(self._wrapped, method)(*args, **resilience.deadline(kwargs))
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if kind == 'get':
+                _emit(kind, self._collection, started, reads=1, error=error)
+            else:
+                _emit(kind, self._collection, started, writes=1, error=error)
+
+    def get(self, *args, **kwargs):
+        return self._call('get', 'get', *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._call('write', 'set', *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        return self._call('write', 'create', *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._call('write', 'update', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call('write', 'delete', *args, **kwargs)
+
+    def collection(self, name):
+        return InstrumentedQuery(self._wrapped.collection(name), f"{self._collection}/{name}")
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+
+class InstrumentedBatch:
+    """Wraps a WriteBatch; the commit is one round trip for all its writes"""
+
+    def __init__(self, batch):
+        self._wrapped = batch
+        self._writes = 0
+        self._collections = set()
+
+    def _add(self, method, reference, *args, **kwargs):
+        self._writes += 1
+        self._collections.add(getattr(reference, '_collection', None) or '')
+        getattr(self._wrapped, method)(_unwrap(reference), *args, **kwargs)
+        return self
+
+    def set(self, reference, *args, **kwargs):
+        return self._add('set', reference, *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        return self._add('create', reference, *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        return self._add('update', reference, *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        return self._add('delete', reference, *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        return resilience.call(lambda: self._commit(args, kwargs), idempotent=False, operation='commit')
+
+    def _commit(self, args, kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            return self._wrapped.commit(*args, **resilience.deadline(kwargs))
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            collection = ','.join(sorted(self._collections))
+            _emit('commit', collection, started, writes=self._writes, error=error)
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
@@ -0,0 +1,207 @@
+"""
+Durable job queue backed by the local database
+Views enqueue slow remote side effects (Firebase Auth, Cloudinary, ...) and
+return immediately; `manage.py run_workers` processes them with per-job
+retry, exponential backoff and dead-lettering.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 600
+# Running jobs whose lock has not been refreshed for this many seconds are
+# assumed lost (e.g. the worker process was killed) and are requeued
+VISIBILITY_TIMEOUT = 300
+# How often a worker refreshes the lock of the job it is running
+HEARTBEAT_INTERVAL = 60
+# How often run_workers looks for stale jobs
+STALE_CHECK_INTERVAL = 60
+
+_handlers = {}
+
+class PermanentJobError(Exception):
+    """Raised by a handler for a failure retrying cannot fix; the job is dead-lettered at once"""
+
+def job(name, max_attempts=DEFAULT_MAX_ATTEMPTS, on_dead=None, scrub=()):
+    """
+    Register a function as the handler for jobs called `name`
+
+    Args:
+        name (str): Job name used with enqueue()
+        max_attempts (int): Attempts before the job is dead-lettered
+        on_dead (callable): Called with the payload when the job is dead-lettered
+        scrub (tuple): Payload keys removed once the job has finished (e.g. passwords)
+    """
+    def decorator(func):
+        _handlers[name] = {
+            'func': func,
+            'max_attempts': max_attempts,
+            'on_dead': on_dead,
+            'scrub': tuple(scrub),
+        }
+        return func
+    return decorator
+
+def enqueue(name, payload=None, delay=0, max_attempts=None):
+    """Queue a job for the workers and return the Job row"""
+    handler = _handlers.get(name, {})
+    queued = Job.objects.create(
+        name=name,
+        payload=payload or {},
+        max_attempts=max_attempts or handler.get('max_attempts', DEFAULT_MAX_ATTEMPTS),
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    logger.info(f"Job queued: {queued.pk} {name}")
+    return queued
+
+def worker_id(suffix=''):
+    """Identifier recorded on the jobs a worker claims"""
+    return f"{socket.gethostname()}:{os.getpid()}{suffix}"
+
+def requeue_stale_jobs():
+    """Return jobs held by workers that died mid-run (no heartbeat) to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=VISIBILITY_TIMEOUT)
+    count = Job.objects.filter(status='running', locked_at__lt=cutoff).update(
+        status='queued', locked_by='', locked_at=None, last_error='Worker timed out',
+    )
+    if count:
+        logger.warning(f"Requeued {count} stale job(s)")
+    return count
+
+def claim_next_job(worker, candidates=10):
+    """
+    Atomically claim the next due job
+
+    The conditional UPDATE only succeeds for one worker per job, so any
+    number of worker threads and processes can poll the same table.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_at__lte=now).values_list('pk', flat=True)[:candidates]
+    for pk in due:
+        claimed = Job.objects.filter(pk=pk, status='queued').update(
+            status='running', locked_by=worker, locked_at=now, started_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+def touch_job(queued):
+    """Refresh a running job's lock; False if this worker no longer holds it"""
+    return bool(Job.objects.filter(pk=queued.pk, status='running', locked_by=queued.locked_by).update(
+        locked_at=timezone.now(),
+    ))
+
+@contextmanager
+def heartbeat(queued, interval=HEARTBEAT_INTERVAL):
+    """Keep a running job's lock fresh so requeue_stale_jobs leaves it alone"""
+    done = threading.Event()
+
+    def beat():
+        try:
+            while not done.wait(interval):
+                if not touch_job(queued):
+                    logger.warning(f"Job {queued.pk} {queued.name} lock lost while running")
+        except Exception as e:
+            logger.error(f"Heartbeat for job {queued.pk} failed: {e}")
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'job-heartbeat-{queued.pk}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+def retry_delay(attempt):
+    """Exponential backoff with jitter for the given (1-based) attempt"""
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY)
+    return delay + random.uniform(0, delay / 2)
+
+def run_job(queued):
+    """Run a claimed job and record success, retry or dead-lettering"""
+    handler = _handlers.get(queued.name)
+    queued.attempts += 1
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job '{queued.name}'")
+        with heartbeat(queued):
+            handler['func'](**queued.payload)
+    except Exception as e:
+        queued.last_error = f"{e}\n{traceback.format_exc()}"
+        if queued.attempts >= queued.max_attempts or isinstance(e, PermanentJobError):
+            queued.status = 'dead'
+            queued.finished_at = timezone.now()
+            logger.error(f"Job {queued.pk} {queued.name} dead after {queued.attempts} attempt(s): {e}")
+            if handler and handler['on_dead']:
+                try:
+                    handler['on_dead'](**queued.payload)
+                except Exception as hook_error:
+                    logger.error(f"on_dead hook for job {queued.pk} failed: {hook_error}")
+        else:
+            queued.status = 'queued'
+            queued.run_at = timezone.now() + timedelta(seconds=retry_delay(queued.attempts))
+            logger.warning(f"Job {queued.pk} {queued.name} failed (attempt {queued.attempts}), retry at {queued.run_at}: {e}")
+    else:
+        queued.status = 'succeeded'
+        queued.finished_at = timezone.now()
+        queued.last_error = ''
+        logger.info(f"Job {queued.pk} {queued.name} succeeded")
+
+    if handler and queued.status != 'queued':
+        for key in handler['scrub']:
+            queued.payload.pop(key, None)
+    queued.locked_by = ''
+    queued.locked_at = None
+    queued.save()
+    return queued.status
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def queue_stats(sample=1000):
+    """
+    Queue depth and latency summary
+
+    Returns:
+        dict: counts by status, per-name queued depth, oldest queued age and
+              wait/run latency (seconds) over the most recent finished jobs
+    """
+    now = timezone.now()
+    by_status = dict(Job.objects.order_by().values_list('status').annotate(count=Count('pk')))
+    depth_by_name = dict(
+        Job.objects.filter(status='queued').order_by().values_list('name').annotate(count=Count('pk'))
+    )
+    oldest = Job.objects.filter(status='queued', run_at__lte=now).order_by('created_at').first()
+
+    finished = Job.objects.filter(status='succeeded').order_by('-finished_at')[:sample]
+    waits = [(j.started_at - j.created_at).total_seconds() for j in finished if j.started_at]
+    runs = [(j.finished_at - j.started_at).total_seconds() for j in finished if j.started_at and j.finished_at]
+
+    return {
+        'by_status': {status: by_status.get(status, 0) for status, _ in Job.STATUS_CHOICES},
+        'queued_by_name': depth_by_name,
+        'oldest_queued_seconds': (now - oldest.created_at).total_seconds() if oldest else 0,
+        'wait_p50_seconds': _percentile(waits, 0.5),
+        'wait_p95_seconds': _percentile(waits, 0.95),
+        'run_p50_seconds': _percentile(runs, 0.5),
+        'run_p95_seconds': _percentile(runs, 0.95),
+    }
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from monitoring.firebase_service import firebase_service
+
+class Command(BaseCommand):
+    help = 'Store a geohash on every terminal with coordinates (used by radius queries)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would change without writing anything',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        self.stdout.write("🌐 Backfilling terminal geohashes...")
+        if dry_run:
+            self.stdout.write(self.style.WARNING("Dry run: no changes will be written"))
+        self.stdout.write("=" * 50)
+
+        try:
+            updates = {}
+            missing = []
+            for doc in firebase_service.db.collection('terminals').stream():
+                terminal = doc.to_dict()
+                geohash = firebase_service.terminal_geohash(terminal)
+                if geohash is None:
+                    missing.append((doc.id, terminal.get('name')))
+                if terminal.get('geohash') != geohash:
+                    updates[doc.id] = {'geohash': geohash}
+                    if dry_run:
+                        self.stdout.write(f"   {doc.id}: {terminal.get('geohash')} -> {geohash}")
+
+            self.stdout.write(f"   {len(updates)} terminals to update, {len(missing)} without coordinates")
+
+            if updates and not dry_run:
+                written = firebase_service.batch_update_terminals(updates)
+                if written == len(updates):
+                    self.stdout.write(self.style.SUCCESS(f"✅ Updated {written} terminals"))
+                else:
+                    self.stdout.write(self.style.ERROR(f"❌ Only {written} of {len(updates)} terminals were written"))
+
+            if missing:
+                self.stdout.write(self.style.WARNING(
+                    f"\n⚠️  {len(missing)} terminals have no valid coordinates:"
+                ))
+                for terminal_id, name in missing[:10]:
+                    self.stdout.write(f"   {terminal_id}: {name}")
+
+            self.stdout.write("\n" + "=" * 50)
+            self.stdout.write(self.style.SUCCESS("🎉 Done!"))
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"❌ Error: {e}"))
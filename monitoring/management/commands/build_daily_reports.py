@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from monitoring.reports import build_daily_reports
+import time
+
+class Command(BaseCommand):
+    help = 'Build (or backfill) cached daily fleet PDF reports in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', default='', help='First day (YYYY-MM-DD, defaults to yesterday)')
+        parser.add_argument('--end', default='', help='Last day (YYYY-MM-DD, defaults to --start)')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Parallel workers (defaults to the CPU count)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rebuild reports that are already cached',
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        try:
+            start = datetime.strptime(options['start'], '%Y-%m-%d').date() if options['start'] else today - timedelta(days=1)
+            end = datetime.strptime(options['end'], '%Y-%m-%d').date() if options['end'] else start
+        except ValueError:
+            raise CommandError("Dates must be in YYYY-MM-DD format")
+        end = min(end, today)
+        if end < start:
+            raise CommandError("--end must not be before --start")
+
+        days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+        self.stdout.write(f"📊 Building daily fleet reports for {start} to {end} ({len(days)} days)...")
+        self.stdout.write("=" * 50)
+
+        try:
+            started = time.monotonic()
+
+            def progress(day, path):
+                self.stdout.write(f"   {day}: {path}")
+
+            paths = build_daily_reports(days, workers=options['workers'], force=options['force'], progress=progress)
+            elapsed = time.monotonic() - started
+
+            skipped = len(days) - len(paths)
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Built {len(paths)} report(s) in {elapsed:.2f}s ({skipped} already cached)"
+            ))
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"❌ Error: {e}"))
@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand
+from monitoring.firebase_service import firebase_service, normalize_driver_alias, BATCH_WRITE_LIMIT
+
+class Command(BaseCommand):
+    help = 'Rebuild the driver alias map and rewrite trip driver_ids to canonical driver IDs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would change without writing anything',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_WRITE_LIMIT,
+            help=f'Trips per batched write (max {BATCH_WRITE_LIMIT})',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        self.stdout.write("🪪 Canonicalizing trip driver IDs...")
+        if dry_run:
+            self.stdout.write(self.style.WARNING("Dry run: no changes will be written"))
+        self.stdout.write("=" * 50)
+
+        try:
+            # Step 1: Build alias -> canonical driver ID map from driver records
+            self.stdout.write("\n1. Building driver alias map...")
+            drivers = firebase_service.get_all_drivers()
+            alias_map = {}
+            names = {}
+            for driver in drivers:
+                canonical_id = driver['id']
+                for alias in firebase_service.driver_aliases_for(driver):
+                    alias_map[alias] = canonical_id
+                alias_map[normalize_driver_alias(canonical_id)] = canonical_id
+
+                # Names are only usable as aliases when they are unique
+                name = normalize_driver_alias(driver.get('name'))
+                if name:
+                    names[name] = canonical_id if name not in names else None
+
+            self.stdout.write(f"   {len(drivers)} drivers, {len(alias_map)} aliases")
+
+            if not dry_run:
+                firebase_service.replace_driver_alias_map(alias_map)
+                self.stdout.write(self.style.SUCCESS("✅ Alias map saved"))
+
+            # Step 2: Work out which trips reference a non-canonical ID
+            self.stdout.write("\n2. Scanning trips...")
+            # Stream unordered: ordering by created_at would skip legacy trips without it
+            trips = []
+            for doc in firebase_service.db.collection('trips').stream():
+                trip = doc.to_dict()
+                trip['id'] = doc.id
+                trips.append(trip)
+
+            updates = {}
+            unresolved = []
+            for trip in trips:
+                current = trip.get('driver_id')
+                canonical = alias_map.get(normalize_driver_alias(current))
+                if canonical is None:
+                    canonical = names.get(normalize_driver_alias(trip.get('driver_name')))
+                if canonical is None:
+                    unresolved.append(trip)
+                elif canonical != current:
+                    updates[trip['id']] = {'driver_id': canonical}
+                    if dry_run:
+                        self.stdout.write(f"   {trip['id']}: '{current}' -> '{canonical}'")
+
+            self.stdout.write(f"   {len(trips)} trips, {len(updates)} to rewrite, {len(unresolved)} unresolved")
+
+            # Step 3: Rewrite in batches
+            if updates and not dry_run:
+                self.stdout.write("\n3. Rewriting trips...")
+
+                def progress(written, total):
+                    self.stdout.write(f"   {written}/{total} trips written")
+
+                written = firebase_service.batch_update_trips(
+                    updates, batch_size=options['batch_size'], progress=progress
+                )
+                if written == len(updates):
+                    self.stdout.write(self.style.SUCCESS(f"✅ Rewrote {written} trips"))
+                else:
+                    self.stdout.write(self.style.ERROR(f"❌ Only {written} of {len(updates)} trips were written"))
+
+            # Step 4: Rebuild the distinct trip driver ID index from the final IDs
+            if not dry_run:
+                driver_ids = {updates.get(trip['id'], {}).get('driver_id', trip.get('driver_id'))
+                              for trip in trips if trip.get('driver_id')}
+                firebase_service.replace_trip_driver_ids(driver_ids)
+                self.stdout.write(self.style.SUCCESS(f"✅ Trip driver ID index rebuilt ({len(driver_ids)} IDs)"))
+
+            if unresolved:
+                self.stdout.write(self.style.WARNING(
+                    f"\n⚠️  {len(unresolved)} trips reference unknown drivers:"
+                ))
+                for trip in unresolved[:10]:
+                    self.stdout.write(f"   {trip['id']}: driver_id='{trip.get('driver_id')}'")
+
+            self.stdout.write("\n" + "=" * 50)
+            self.stdout.write(self.style.SUCCESS("🎉 Done!"))
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"❌ Error: {e}"))
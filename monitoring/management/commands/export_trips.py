@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from monitoring.exports import parse_export_filters, iter_trip_export, TRIP_EXPORT_CONTENT_TYPES
+import time
+
+class Command(BaseCommand):
+    help = 'Export trips as CSV or NDJSON, streaming them from Firestore page by page'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=sorted(TRIP_EXPORT_CONTENT_TYPES),
+            default='csv',
+            help='Output format',
+        )
+        parser.add_argument('--output', default=None, help='File to write (defaults to trips.<format>)')
+        parser.add_argument('--status', default='all', help='all, active, completed or cancelled')
+        parser.add_argument('--driver', default='', help='Driver ID, auth UID or email')
+        parser.add_argument('--start', default='', help='First day to include (YYYY-MM-DD)')
+        parser.add_argument('--end', default='', help='Last day to include (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        output_path = options['output'] or f"trips.{fmt}"
+
+        self.stdout.write("📤 Exporting trips...")
+        self.stdout.write("=" * 50)
+
+        try:
+            filters = parse_export_filters(options)
+            started = time.monotonic()
+            chunks = 0
+            with open(output_path, 'w', encoding='utf-8', newline='') as output:
+                for chunk in iter_trip_export(fmt, **filters):
+                    output.write(chunk)
+                    chunks += 1
+            elapsed = time.monotonic() - started
+
+            # CSV has a header line; NDJSON is one line per trip
+            count = chunks - 1 if fmt == 'csv' else chunks
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Wrote {count} trips to {output_path} in {elapsed:.2f}s"
+            ))
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"❌ Error: {e}"))
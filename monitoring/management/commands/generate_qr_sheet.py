@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from monitoring.firebase_service import firebase_service
+from monitoring.utils import render_qr_sheet_pdf
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Generate a printable PDF sheet with the QR codes of all active terminals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default='terminal_qr_codes.pdf',
+            help='Path of the PDF file to write',
+        )
+        parser.add_argument('--columns', type=int, default=3, help='QR codes per row')
+        parser.add_argument('--rows', type=int, default=4, help='Rows per page')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Processes used to rasterize QR codes (defaults to the CPU count)',
+        )
+        parser.add_argument(
+            '--include-inactive',
+            action='store_true',
+            help='Include inactive terminals',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("🖨️  Generating terminal QR sheet...")
+        self.stdout.write("=" * 50)
+
+        try:
+            terminals = firebase_service.get_all_terminals()
+            if not options['include_inactive']:
+                terminals = [t for t in terminals if t.get('is_active', True)]
+            terminals.sort(key=lambda t: (t.get('name') or '').lower())
+
+            if not terminals:
+                self.stdout.write(self.style.WARNING("⚠️  No terminals found"))
+                return
+
+            started = time.monotonic()
+            with open(options['output'], 'wb') as output:
+                count = render_qr_sheet_pdf(
+                    terminals, output,
+                    columns=options['columns'], rows=options['rows'], workers=options['workers'],
+                )
+            elapsed = time.monotonic() - started
+
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Wrote {count} QR codes to {options['output']} in {elapsed:.2f}s"
+            ))
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"❌ Error: {e}"))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from monitoring.driver_import import read_driver_rows, import_drivers
+import time
+
+class Command(BaseCommand):
+    help = 'Bulk create drivers from a CSV or XLSX file (name, email, password, contact, license_number)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file to import')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate the file without creating anything',
+        )
+        parser.add_argument(
+            '--default-password',
+            default=None,
+            help='Password for rows that do not specify one',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Threads used for password hashing (defaults to the CPU count)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"👥 Importing drivers from {options['path']}...")
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING("Dry run: nothing will be created"))
+        self.stdout.write("=" * 50)
+
+        try:
+            with open(options['path'], 'rb') as f:
+                rows = read_driver_rows(f, options['path'])
+        except OSError as e:
+            raise CommandError(f"Could not read {options['path']}: {e}")
+
+        started = time.monotonic()
+        report = import_drivers(
+            rows,
+            default_password=options['default_password'],
+            dry_run=options['dry_run'],
+            workers=options['workers'],
+        )
+        elapsed = time.monotonic() - started
+
+        summary = {}
+        for entry in report:
+            summary[entry['status']] = summary.get(entry['status'], 0) + 1
+            line = f"   row {entry['row']}: {entry['email'] or '-'} {entry['status']}"
+            if entry['status'] in ('created', 'valid'):
+                self.stdout.write(self.style.SUCCESS(line))
+            elif entry['status'] == 'skipped':
+                self.stdout.write(self.style.WARNING(f"{line} ({entry['message']})"))
+            else:
+                self.stdout.write(self.style.ERROR(f"{line} ({entry['message']})"))
+
+        self.stdout.write("\n" + "=" * 50)
+        counts = ', '.join(f"{count} {status}" for status, count in summary.items())
+        self.stdout.write(self.style.SUCCESS(f"🎉 {len(report)} rows in {elapsed:.2f}s: {counts}"))
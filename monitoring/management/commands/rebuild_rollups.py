@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from monitoring.firebase_service import firebase_service
+from monitoring.rollups import rebuild_rollups
+import time
+
+class Command(BaseCommand):
+    help = 'Rebuild the hourly and daily trip rollups from all completed trips'
+
+    def handle(self, *args, **options):
+        self.stdout.write("📈 Rebuilding trip rollups...")
+        self.stdout.write("=" * 50)
+
+        try:
+            started = time.monotonic()
+
+            def completed_trips():
+                # Stream unordered: ordering by created_at would skip legacy trips without it
+                for doc in firebase_service.db.collection('trips').where('status', '==', 'completed').stream():
+                    trip = doc.to_dict()
+                    trip['id'] = doc.id
+                    yield trip
+
+            trips, buckets = rebuild_rollups(completed_trips())
+            elapsed = time.monotonic() - started
+
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Rolled up {trips} completed trips into {buckets} buckets in {elapsed:.2f}s"
+            ))
+
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"❌ Error: {e}"))
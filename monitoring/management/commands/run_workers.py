@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from monitoring import jobs
+import monitoring.tasks  # noqa: F401  (registers the job handlers)
+import json
+import signal
+import threading
+
+class Command(BaseCommand):
+    help = 'Process queued background jobs (QR uploads, Firebase Auth users, ...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Worker threads in this process (run more processes to scale further)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the queue is empty',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the due jobs and exit instead of polling forever',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print queue depth and latency and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(jobs.queue_stats(), indent=2))
+            return
+
+        stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda *_: stop.set())
+
+        concurrency = max(1, options['concurrency'])
+        self.stdout.write(f"⚙️  Starting {concurrency} worker(s) ({jobs.worker_id()})")
+
+        threads = [
+            threading.Thread(
+                target=self._work,
+                args=(jobs.worker_id(f'/{n}'), stop, options['poll_interval'], options['once']),
+                name=f'job-worker-{n}',
+            )
+            for n in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        self._watch(threads)
+
+        self.stdout.write(self.style.SUCCESS("✅ Workers stopped"))
+
+    def _watch(self, threads):
+        """Requeue jobs of dead workers (in any process) until the workers stop"""
+        try:
+            while True:
+                close_old_connections()
+                jobs.requeue_stale_jobs()
+                alive = [thread for thread in threads if thread.is_alive()]
+                if not alive:
+                    break
+                alive[0].join(jobs.STALE_CHECK_INTERVAL)
+        finally:
+            connection.close()
+
+    def _work(self, worker, stop, poll_interval, once):
+        processed = 0
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                queued = jobs.claim_next_job(worker)
+                if queued is None:
+                    if once:
+                        break
+                    stop.wait(poll_interval)
+                    continue
+                status = jobs.run_job(queued)
+                processed += 1
+                self.stdout.write(f"   [{worker}] job {queued.pk} {queued.name}: {status}")
+        finally:
+            connection.close()
+        return processed
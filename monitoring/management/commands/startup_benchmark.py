@@ -0,0 +1,106 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Third-party packages that are expensive to import, and the project modules that used to pull them in
+HEAVY_MODULES = (
+    'firebase_admin',
+    'google.cloud.firestore',
+    'grpc',
+    'cloudinary',
+    'openpyxl',
+    'reportlab',
+    'numpy',
+    'monitoring.firebase_service',
+    'monitoring.utils',
+    'monitoring.views',
+)
+SDK_MODULES = ('firebase_admin', 'google.cloud.firestore', 'grpc')
+
+
+def parse_importtime(output):
+    """
+    Cumulative import times from `python -X importtime` output
+
+    Returns:
+        dict: {module name: cumulative microseconds}
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            continue  # the header line
+    return times
+
+
+def run_command(project_dir, command):
+    """
+    Run one manage.py command in a fresh interpreter
+
+    Returns:
+        tuple: (wall seconds, {module: cumulative import microseconds}, return code)
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    env.pop('PYTHONPROFILEIMPORTTIME', None)
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', os.path.join(project_dir, 'manage.py'), *command.split()],
+        cwd=project_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    return time.perf_counter() - started, parse_importtime(result.stderr), result.returncode
+
+
+class Command(BaseCommand):
+    help = 'Measure manage.py start-up time and which heavy modules each command imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('commands', nargs='*', default=['check', 'help'],
+                            help='manage.py commands to time (quote commands with arguments)')
+        parser.add_argument('--runs', type=int, default=5, help='Runs per command (the median is reported)')
+        parser.add_argument('--project-dir', default=None,
+                            help='Checkout to benchmark instead of this one (e.g. a git worktree of '
+                                 'an older commit, for a before/after comparison)')
+
+    def handle(self, *args, **options):
+        project_dir = os.path.abspath(options['project_dir'] or settings.BASE_DIR)
+        runs = max(1, options['runs'])
+
+        self.stdout.write("⏱️  manage.py start-up benchmark")
+        self.stdout.write("=" * 50)
+        self.stdout.write(f"📁 {project_dir} ({runs} runs per command)\n")
+
+        for command in options['commands']:
+            walls = []
+            imports = {}
+            failed = False
+            for _ in range(runs):
+                wall, times, returncode = run_command(project_dir, command)
+                walls.append(wall)
+                failed = failed or returncode != 0
+                for module in HEAVY_MODULES:
+                    if module in times:
+                        imports.setdefault(module, []).append(times[module])
+
+            self.stdout.write(self.style.WARNING(f"manage.py {command}"))
+            self.stdout.write(
+                f"   wall: {statistics.median(walls) * 1000:.0f}ms median, "
+                f"{min(walls) * 1000:.0f}ms min"
+            )
+            if failed:
+                self.stdout.write(self.style.ERROR("   ❌ command exited with an error in at least one run"))
+            for module in HEAVY_MODULES:
+                if module in imports:
+                    self.stdout.write(f"   {module}: {statistics.median(imports[module]) / 1000:.1f}ms import")
+            if any(module in imports for module in SDK_MODULES):
+                self.stdout.write(self.style.WARNING("   ⚠️  Firebase SDK loaded at start-up"))
+            else:
+                self.stdout.write(self.style.SUCCESS("   ✅ Firebase SDK not loaded"))
+            self.stdout.write("")
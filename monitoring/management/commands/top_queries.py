@@ -0,0 +1,115 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.core.management.base import BaseCommand
+from monitoring.slow_queries import read_log, query_shape
+
+SORT_KEYS = {
+    'documents': lambda group: group['documents'],
+    'duration': lambda group: group['duration_ms'],
+    'count': lambda group: group['count'],
+}
+
+
+def summarize(records):
+    """
+    Aggregate slow query log records by query shape
+
+    Returns:
+        list: Dicts with the shape fields, count, documents (total),
+              duration_ms (total), max_duration_ms and the most common
+              callers and views
+    """
+    groups = {}
+    for record in records:
+        key = query_shape(record)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                'kind': record.get('kind'),
+                'collection': record.get('collection'),
+                'filters': record.get('filters') or [],
+                'order_by': record.get('order_by') or [],
+                'limit': record.get('limit'),
+                'offset': bool(record.get('offset')),
+                'cursor': bool(record.get('cursor')),
+                'method': record.get('method'),
+                'count': 0,
+                'documents': 0,
+                'duration_ms': 0.0,
+                'max_duration_ms': 0.0,
+                'callers': Counter(),
+                'views': Counter(),
+            }
+        group['count'] += 1
+        group['documents'] += record.get('documents') or 0
+        group['duration_ms'] += record.get('duration_ms') or 0
+        group['max_duration_ms'] = max(group['max_duration_ms'], record.get('duration_ms') or 0)
+        if record.get('caller'):
+            group['callers'][record['caller']] += 1
+        if record.get('view'):
+            group['views'][record['view']] += 1
+    return list(groups.values())
+
+
+def describe_shape(group):
+    """One-line, SQL-ish description of a query shape"""
+    parts = [f"{group['kind']} {group['collection']}"]
+    if group['filters']:
+        parts.append('where ' + ' and '.join(f"{field} {op} ?" for field, op in group['filters']))
+    if group['order_by']:
+        parts.append('order by ' + ', '.join(
+            f"{field}{' desc' if direction == 'DESCENDING' else ''}" for field, direction in group['order_by']))
+    if group['limit']:
+        parts.append(f"limit {group['limit']}")
+    if group['offset']:
+        parts.append('offset ?')
+    if group['cursor']:
+        parts.append('after cursor')
+    return ' '.join(parts)
+
+
+class Command(BaseCommand):
+    help = 'Summarize the slow Firestore query log by query shape'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='documents',
+                            help='Rank shapes by total documents read, total duration or occurrences')
+        parser.add_argument('--limit', type=int, default=10, help='Number of query shapes to show')
+        parser.add_argument('--hours', type=float, default=None, help='Only include the last N hours')
+        parser.add_argument('--log', default=None, help='Log file to read (defaults to SLOW_QUERY_LOG_PATH)')
+
+    def handle(self, *args, **options):
+        self.stdout.write("🐢 Top slow and expensive Firestore queries")
+        self.stdout.write("=" * 50)
+
+        records = read_log(options['log'])
+        if options['hours'] is not None:
+            since = datetime.now(dt_timezone.utc) - timedelta(hours=options['hours'])
+            records = (record for record in records
+                       if datetime.fromisoformat(record.get('time', '1970-01-01T00:00:00+00:00')) >= since)
+
+        groups = summarize(records)
+        if not groups:
+            self.stdout.write(self.style.SUCCESS("✅ No slow queries logged"))
+            return
+
+        groups.sort(key=SORT_KEYS[options['sort']], reverse=True)
+        total = sum(group['count'] for group in groups)
+        self.stdout.write(f"📊 {total} logged operations in {len(groups)} query shapes\n")
+
+        for rank, group in enumerate(groups[:options['limit']], 1):
+            average = group['duration_ms'] / group['count']
+            self.stdout.write(self.style.WARNING(f"{rank}. {describe_shape(group)}"))
+            if group['method']:
+                self.stdout.write(f"   FirebaseService.{group['method']}")
+            self.stdout.write(
+                f"   {group['count']}x, {group['documents']} documents "
+                f"({group['documents'] // group['count']} avg), "
+                f"{average:.1f}ms avg, {group['max_duration_ms']:.1f}ms max"
+            )
+            for caller, count in group['callers'].most_common(3):
+                self.stdout.write(f"   ↳ {caller} ({count}x)")
+            if group['views']:
+                views = ', '.join(f"{view} ({count}x)" for view, count in group['views'].most_common(3))
+                self.stdout.write(f"   views: {views}")
+            self.stdout.write("")
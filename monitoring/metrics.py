@@ -0,0 +1,262 @@
+"""
+In-process metrics in the Prometheus text format
+Counters and histograms keep one shard per thread, so recording a value is
+a plain dict update by the owning thread and never takes a lock; shards
+are only summed when /metrics is scraped. When a thread ends, its shard is
+folded into a per-metric total of finished threads, so thread-per-request
+servers and short-lived pools do not grow the shard list. Values are per
+process (each gunicorn worker reports its own), which Prometheus
+aggregates on its side.
+
+Firestore operations are recorded from the instrumentation listener
+(monitoring.instrumentation), retries and circuit breaker rejections from
+monitoring.resilience, cache lookups from FirebaseService._cached
+and view latency from monitoring.middleware.MetricsMiddleware.
+"""
+
+import bisect
+import threading
+import weakref
+from . import resilience
+from .instrumentation import add_listener
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Documents billed per query
+DOCUMENT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        # Totals of the threads that have ended
+        self._retired = {}
+        # Only taken the first time a thread records a value, when a thread
+        # ends and when scraping
+        self._shards_lock = threading.Lock()
+        _registry.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+        return shard
+
+    def _retire(self, shard):
+        """Fold the shard of a thread that has ended into the retired totals"""
+        with self._shards_lock:
+            self._shards = [live for live in self._shards if live is not shard]
+            for labels, value in shard.items():
+                self._retired[labels] = self._add(self._retired.get(labels), value)
+
+    def _add(self, total, value):
+        raise NotImplementedError
+
+    def _snapshots(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+            retired = dict(self._retired)
+        # dict.copy() is atomic, so a shard being written is copied consistently
+        return [retired] + [shard.copy() for shard in shards]
+
+    def _labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+
+    metric_type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _add(self, total, value):
+        return (total or 0) + value
+
+    def values(self):
+        """{label values: total} summed over all threads"""
+        totals = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def _samples(self):
+        return [f"{self.name}{self._labels(labels)} {_number(value)}"
+                for labels, value in sorted(self.values().items())]
+
+
+class Histogram(_Metric):
+    """Bucketed distribution per label set"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # Per-bucket (non-cumulative) counts with +Inf last, then the sum
+            entry = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def _add(self, total, value):
+        counts, value_sum = value
+        if total is None:
+            return [list(counts), value_sum]
+        return [[a + b for a, b in zip(total[0], counts)], total[1] + value_sum]
+
+    def values(self):
+        """{label values: (per-bucket counts, sum)} summed over all threads"""
+        totals = {}
+        for shard in self._snapshots():
+            for labels, (counts, total) in shard.items():
+                counts = list(counts)
+                if labels in totals:
+                    merged, merged_total = totals[labels]
+                    totals[labels] = ([a + b for a, b in zip(merged, counts)], merged_total + total)
+                else:
+                    totals[labels] = (counts, total)
+        return totals
+
+    def _samples(self):
+        lines = []
+        for labels, (counts, total) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append(f"{self.name}_bucket{self._labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._labels(labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Current value per label set, read from a callback when scraped"""
+
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        # Returns {label values: value}
+        self.callback = callback
+
+    def values(self):
+        return dict(self.callback()) if self.callback else {}
+
+    def _samples(self):
+        return [f"{self.name}{self._labels(labels)} {_number(value)}"
+                for labels, value in sorted(self.values().items())]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+firestore_operations = Counter(
+    'firestore_operations_total', 'Firestore round trips by operation and collection',
+    ('operation', 'collection'))
+firestore_errors = Counter(
+    'firestore_errors_total', 'Failed Firestore round trips by operation, collection and error',
+    ('operation', 'collection', 'error'))
+firestore_documents_read = Counter(
+    'firestore_documents_read_total', 'Billed Firestore document reads',
+    ('operation', 'collection'))
+firestore_documents_written = Counter(
+    'firestore_documents_written_total', 'Firestore document writes',
+    ('operation', 'collection'))
+firestore_duration = Histogram(
+    'firestore_operation_duration_seconds', 'Firestore round trip latency',
+    ('operation', 'collection'))
+firestore_query_documents = Histogram(
+    'firestore_query_documents', 'Documents billed per Firestore query',
+    ('collection',), buckets=DOCUMENT_BUCKETS)
+firestore_retries = Counter(
+    'firestore_retries_total', 'Firestore reads retried after a transient error',
+    ('operation',))
+firestore_rejections = Counter(
+    'firestore_circuit_rejections_total', 'Firestore calls failed fast by the open circuit breaker',
+    ('operation',))
+firestore_conditional_updates = Counter(
+    'firestore_conditional_updates_total',
+    'Precondition-guarded trip updates by result (updated, conflict, wrong_status, not_found or failed)',
+    ('result',))
+firestore_circuit_open = Gauge(
+    'firestore_circuit_open', '1 while the Firestore circuit breaker rejects calls',
+    callback=lambda: {(): int(resilience.breaker.is_open)})
+cache_fallbacks = Counter(
+    'cache_fallbacks_total', 'Reads served from the last good cached copy because Firestore failed',
+    ('cache',))
+cache_requests = Counter(
+    'cache_requests_total', 'FirebaseService cache lookups by key and result (hit, stale or miss)',
+    ('cache', 'result'))
+cache_refreshes = Counter(
+    'cache_refreshes_total', 'Background refreshes of stale cache entries by key and result (ok or error)',
+    ('cache', 'result'))
+view_requests = Counter(
+    'http_requests_total', 'Requests by view, method and status code',
+    ('view', 'method', 'status'))
+view_duration = Histogram(
+    'http_request_duration_seconds', 'Request latency by view',
+    ('view', 'method'))
+
+
+def record_firestore_operation(operation):
+    """Instrumentation listener feeding the Firestore metrics"""
+    labels = (operation.kind, operation.collection)
+    firestore_operations.inc(*labels)
+    firestore_duration.observe(operation.duration, *labels)
+    if operation.reads:
+        firestore_documents_read.inc(*labels, amount=operation.reads)
+    if operation.writes:
+        firestore_documents_written.inc(*labels, amount=operation.writes)
+    if operation.kind == 'query':
+        firestore_query_documents.observe(operation.reads, operation.collection)
+    if operation.error:
+        firestore_errors.inc(*labels, operation.error)
+
+
+add_listener(record_firestore_operation)
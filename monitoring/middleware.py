@@ -0,0 +1,78 @@
+import time
+from django.conf import settings
+from . import budgets, metrics, resilience, timing
+
+
+class MetricsMiddleware:
+    """Record request count and latency per resolved view (see monitoring.metrics)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        # URL names keep the label set small; unresolved paths share one label
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        metrics.view_duration.observe(time.perf_counter() - started, view, request.method)
+        metrics.view_requests.inc(view, request.method, str(response.status_code))
+        return response
+
+
+class ServerTimingMiddleware:
+    """
+    Add a Server-Timing header splitting the response time into Firestore,
+    template rendering, JSON serialization and everything else (see
+    monitoring.timing). With DEBUG on, X-Request-Cost carries a JSON
+    breakdown of the Firestore round trips and reads per collection.
+    X-Firestore-Degraded is set when Firestore data may be stale or missing
+    (see monitoring.resilience).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            cost = timing.finish_request()
+        response['Server-Timing'] = cost.server_timing()
+        if cost.degraded or resilience.breaker.is_open:
+            response['X-Firestore-Degraded'] = '1'
+        if settings.DEBUG:
+            response['X-Request-Cost'] = timing.cost_header(cost)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        cost = timing.current_cost()
+        if cost is not None and request.resolver_match:
+            cost.view = request.resolver_match.view_name
+
+
+class ReadBudgetMiddleware:
+    """Enforce per-view Firestore read budgets (see monitoring.budgets)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        budget = getattr(request, '_read_budget', None)
+        cost = timing.current_cost()
+        if budget is None or cost is None or getattr(response, '_read_budget_shed', False):
+            return response
+        return budgets.enforce(request.resolver_match.view_name, budget, request, response,
+                               cost.reads, cost.round_trips)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = request.resolver_match.view_name
+        request._read_budget = budgets.view_budget(view_name, view_func)
+        if request._read_budget and request._read_budget['mode'] == 'shed':
+            response = budgets.shed_response(view_name, request)
+            if response is not None:
+                response._read_budget_shed = True
+                return response
+        return None
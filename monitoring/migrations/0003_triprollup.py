@@ -0,0 +1,34 @@
+# Generated by Django 4.2.23 on 2026-10-19 14:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0002_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('start_terminal', models.CharField(max_length=100)),
+                ('destination_terminal', models.CharField(max_length=100)),
+                ('trip_count', models.IntegerField(default=0)),
+                ('passenger_sum', models.IntegerField(default=0)),
+                ('duration_sum_seconds', models.FloatField(default=0)),
+                ('duration_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['granularity', 'bucket_start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='triprollup',
+            constraint=models.UniqueConstraint(fields=('granularity', 'bucket_start', 'start_terminal', 'destination_terminal'), name='unique_trip_rollup_bucket'),
+        ),
+    ]
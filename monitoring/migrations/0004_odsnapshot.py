@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-19 14:29
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0003_triprollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ODSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('terminals', models.JSONField(default=list)),
+                ('trips', models.JSONField(default=list)),
+                ('passengers', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+import base64
+import hashlib
+from django.conf import settings
+from django.db import migrations
+
+
+def seal_password(password):
+    # A frozen copy of monitoring.tasks.seal_password: tokens must open with
+    # tasks.open_password, but migrations must not import live app code
+    from cryptography.fernet import Fernet
+
+    key = hashlib.sha256(f"monitoring.tasks.password:{settings.SECRET_KEY}".encode()).digest()
+    return Fernet(base64.urlsafe_b64encode(key)).encrypt(password.encode()).decode()
+
+
+def seal_passwords(apps, schema_editor):
+    """Replace plain-text passwords in Firebase Auth jobs with sealed tokens"""
+    Job = apps.get_model('monitoring', 'Job')
+    for queued in Job.objects.filter(name='create_driver_auth_user'):
+        password = queued.payload.pop('password', None)
+        if password is None:
+            continue
+        if queued.status in ('queued', 'running'):
+            queued.payload['password_token'] = seal_password(password)
+        queued.save(update_fields=['payload'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0004_odsnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(seal_passwords, migrations.RunPython.noop),
+    ]
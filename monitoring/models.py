@@ -67,3 +67,76 @@ class Trip(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+
+class Job(models.Model):
+    """Durable background job queued in the local database (see monitoring.jobs)"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('dead', 'Dead'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Job {self.pk} {self.name} - {self.status}"
+
+    class Meta:
+        ordering = ['run_at']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+class TripRollup(models.Model):
+    """Materialized per-route trip totals for one hour or day (see monitoring.rollups)"""
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    start_terminal = models.CharField(max_length=100)
+    destination_terminal = models.CharField(max_length=100)
+    trip_count = models.IntegerField(default=0)
+    passenger_sum = models.IntegerField(default=0)
+    duration_sum_seconds = models.FloatField(default=0)
+    duration_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.granularity} {self.bucket_start} {self.start_terminal}->{self.destination_terminal}"
+
+    class Meta:
+        ordering = ['granularity', 'bucket_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket_start', 'start_terminal', 'destination_terminal'],
+                name='unique_trip_rollup_bucket',
+            ),
+        ]
+
+class ODSnapshot(models.Model):
+    """Dense origin-destination matrices for one closed day (see monitoring.od_matrix)"""
+    day = models.DateField(unique=True)
+    terminals = models.JSONField(default=list)
+    trips = models.JSONField(default=list)
+    passengers = models.JSONField(default=list)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"O-D snapshot {self.day}"
+
+    class Meta:
+        ordering = ['day']
@@ -0,0 +1,146 @@
+"""
+Terminal origin-destination (O-D) matrices
+The daily TripRollup rows are updated as trips complete and already hold
+one cell per (day, origin, destination). Closed days are materialized into
+dense ODSnapshot matrices once, and a window query sums one matrix per day
+(plus today's live rollups) instead of touching individual trips.
+"""
+
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+from django.utils import timezone
+from .models import ODSnapshot, TripRollup
+
+logger = logging.getLogger(__name__)
+
+class ODMatrix:
+    """Dense N x N trip and passenger counts indexed by terminal position"""
+
+    def __init__(self, terminals=()):
+        self.terminals = []
+        self.index = {}
+        self.trips = np.zeros((0, 0), dtype=np.int64)
+        self.passengers = np.zeros((0, 0), dtype=np.int64)
+        for terminal_id in terminals:
+            self.position(terminal_id)
+
+    def position(self, terminal_id):
+        """Row/column of a terminal, growing the matrix for unseen terminals"""
+        if terminal_id not in self.index:
+            self.index[terminal_id] = len(self.terminals)
+            self.terminals.append(terminal_id)
+            self.trips = np.pad(self.trips, ((0, 1), (0, 1)))
+            self.passengers = np.pad(self.passengers, ((0, 1), (0, 1)))
+        return self.index[terminal_id]
+
+    def add(self, origin, destination, trips=1, passengers=0):
+        """Add trips on one route"""
+        row, column = self.position(origin), self.position(destination)
+        self.trips[row, column] += trips
+        self.passengers[row, column] += passengers
+
+    def add_matrix(self, other):
+        """Add another matrix, aligning terminals by ID"""
+        positions = [self.position(terminal_id) for terminal_id in other.terminals]
+        cells = np.ix_(positions, positions)
+        self.trips[cells] += other.trips
+        self.passengers[cells] += other.passengers
+
+    @classmethod
+    def from_rollups(cls, rows):
+        """Build a matrix from (start_terminal, destination_terminal, trip_count, passenger_sum) rows"""
+        matrix = cls()
+        for origin, destination, trips, passengers in rows:
+            matrix.add(origin, destination, trips, passengers)
+        return matrix
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Load a matrix stored in an ODSnapshot"""
+        matrix = cls()
+        matrix.terminals = list(snapshot.terminals)
+        matrix.index = {terminal_id: i for i, terminal_id in enumerate(matrix.terminals)}
+        size = len(matrix.terminals)
+        matrix.trips = np.array(snapshot.trips, dtype=np.int64).reshape(size, size)
+        matrix.passengers = np.array(snapshot.passengers, dtype=np.int64).reshape(size, size)
+        return matrix
+
+    def top(self, limit):
+        """Copy restricted to the `limit` terminals with the most departures plus arrivals"""
+        volume = self.trips.sum(axis=0) + self.trips.sum(axis=1)
+        keep = sorted(np.argsort(-volume, kind='stable')[:limit])
+        matrix = ODMatrix()
+        matrix.terminals = [self.terminals[i] for i in keep]
+        matrix.index = {terminal_id: i for i, terminal_id in enumerate(matrix.terminals)}
+        matrix.trips = self.trips[np.ix_(keep, keep)]
+        matrix.passengers = self.passengers[np.ix_(keep, keep)]
+        return matrix
+
+def _day_rollups(day):
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    return TripRollup.objects.filter(granularity='day', bucket_start=start).values_list(
+        'start_terminal', 'destination_terminal', 'trip_count', 'passenger_sum',
+    )
+
+def day_matrix(day):
+    """O-D matrix for one day: a stored snapshot for closed days, live rollups for today"""
+    if day >= timezone.localdate():
+        return ODMatrix.from_rollups(_day_rollups(day))
+
+    snapshot = ODSnapshot.objects.filter(day=day).first()
+    if snapshot is None:
+        matrix = ODMatrix.from_rollups(_day_rollups(day))
+        ODSnapshot.objects.update_or_create(day=day, defaults={
+            'terminals': matrix.terminals,
+            'trips': matrix.trips.tolist(),
+            'passengers': matrix.passengers.tolist(),
+        })
+        return matrix
+    return ODMatrix.from_snapshot(snapshot)
+
+def window_matrix(start, end, terminals=()):
+    """
+    Sum of the daily O-D matrices for a date window
+
+    Args:
+        start (date): First day
+        end (date): Last day (inclusive)
+        terminals (iterable): Terminal IDs that fix the leading row/column order
+
+    Returns:
+        ODMatrix: Trip and passenger counts for the window
+    """
+    matrix = ODMatrix(terminals)
+    day = start
+    while day <= end:
+        matrix.add_matrix(day_matrix(day))
+        day += timedelta(days=1)
+    return matrix
+
+def invalidate_day(day):
+    """Drop a closed day's snapshot after its rollups change (e.g. a late completion)"""
+    if day < timezone.localdate():
+        ODSnapshot.objects.filter(day=day).delete()
+
+def od_matrix_context(matrix, terminal_map):
+    """
+    Template/JSON-ready view of a matrix using the views' terminal_map lookups
+
+    Returns:
+        dict: terminals (id, name), trips and passengers as nested lists,
+              and per-cell heat levels 0-4 relative to the busiest route
+    """
+    peak = int(matrix.trips.max()) if matrix.trips.size else 0
+    levels = np.zeros_like(matrix.trips)
+    if peak:
+        levels = np.ceil(matrix.trips * 4 / peak).astype(np.int64)
+    return {
+        'terminals': [{'id': terminal_id, 'name': terminal_map.get(terminal_id, terminal_id or 'Unknown')}
+                      for terminal_id in matrix.terminals],
+        'trips': matrix.trips.tolist(),
+        'passengers': matrix.passengers.tolist(),
+        'levels': levels.tolist(),
+        'total_trips': int(matrix.trips.sum()),
+        'total_passengers': int(matrix.passengers.sum()),
+    }
@@ -0,0 +1,80 @@
+"""
+Coalesced passenger count updates
+Conductors tap +1/-1 as passengers board, often several times a second.
+apply_passenger_delta() groups the deltas that reach this process for the
+same trip within PASSENGER_DELTA_WINDOW seconds: the first request waits
+out the window and applies their sum in one conditional update
+(FirebaseService.increment_trip_passengers), and every request in the
+group answers with its result. The update only applies to a trip that is
+still in progress and starts over when another worker changed the trip
+first, so overlapping taps are never lost and a completed trip is never
+changed. The count does not go below zero.
+"""
+
+import threading
+import time
+from .firebase_service import firebase_service
+
+# How long the first delta for a trip waits for others to join its write
+PASSENGER_DELTA_WINDOW = 0.05
+# Largest change a single request may make
+MAX_PASSENGER_DELTA = 50
+# Followers give up if the write has not finished by then
+WRITE_TIMEOUT = 30
+
+
+class _Burst:
+    """Deltas for one trip that will be written together"""
+
+    __slots__ = ('delta', 'requests', 'done', 'result')
+
+    def __init__(self):
+        self.delta = 0
+        self.requests = 0
+        self.done = threading.Event()
+        self.result = (None, 'failed')
+
+
+_bursts = {}
+_bursts_lock = threading.Lock()
+
+
+def apply_passenger_delta(trip_id, delta):
+    """
+    Add delta to a trip's passenger count, coalescing concurrent requests
+
+    Args:
+        trip_id (str): Trip document ID
+        delta (int): Passengers boarding (positive) or leaving (negative)
+
+    Returns:
+        tuple: (passenger count after the write or None if it was not made,
+                error as from FirebaseService.update_trip_if or None,
+                number of requests the write covered)
+    """
+    with _bursts_lock:
+        burst = _bursts.get(trip_id)
+        leader = burst is None
+        if leader:
+            burst = _bursts[trip_id] = _Burst()
+        burst.delta += delta
+        burst.requests += 1
+
+    if not leader:
+        burst.done.wait(WRITE_TIMEOUT)
+        return _answer(burst)
+
+    time.sleep(PASSENGER_DELTA_WINDOW)
+    with _bursts_lock:
+        # Deltas arriving from now on start the next burst
+        del _bursts[trip_id]
+    try:
+        burst.result = firebase_service.increment_trip_passengers(trip_id, burst.delta)
+    finally:
+        burst.done.set()
+    return _answer(burst)
+
+
+def _answer(burst):
+    trip, error = burst.result
+    return (trip.get('passengers') if error is None else None), error, burst.requests
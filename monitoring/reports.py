@@ -0,0 +1,170 @@
+"""
+Daily fleet PDF reports
+Each day's figures are read from the daily trip rollups (see
+monitoring.rollups) rather than by scanning trips, rendered with reportlab
+and cached under MEDIA_ROOT/reports, so the dashboard serves a finished
+file. Days before the rollups existed need `manage.py rebuild_rollups`
+first. A past day's report is cached for good once it
+was built after that day ended; today's report (and one built while its
+day was still running) is rebuilt once it is older than TODAY_REPORT_MAX_AGE
+(or at once for a day that has since ended).
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .firebase_service import firebase_service
+from .models import Trip, TripRollup
+from .utils import write_daily_report_pdf
+
+logger = logging.getLogger(__name__)
+
+REPORT_DIR = os.path.join(settings.MEDIA_ROOT, 'reports')
+TODAY_REPORT_MAX_AGE = 15 * 60
+
+def day_bounds(day):
+    """Start and end (exclusive) of a local calendar day as aware datetimes"""
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    return start, start + timedelta(days=1)
+
+def daily_report_path(day):
+    """Cache path of the PDF report for a day"""
+    return os.path.join(REPORT_DIR, f"fleet-{day.isoformat()}.pdf")
+
+def compute_daily_summary(day):
+    """
+    Report figures for a day from the daily rollups
+
+    Terminal, route and travel time figures cover the trips completed that
+    day (bucketed by start time, see monitoring.rollups); driver activity
+    comes from the local Trip table the rollups fill, which has the driver.
+    Only the total trip count reads Firestore (one count aggregation).
+
+    Args:
+        day (date): Local calendar day
+
+    Returns:
+        dict: Plain (picklable) figures: totals, per-terminal, per-route and
+              per-driver rows, and the average travel time in minutes
+    """
+    start, end = day_bounds(day)
+    terminal_names = {t.get('terminal_id', t.get('id')): t.get('name', 'Unknown Terminal')
+                      for t in firebase_service.get_all_terminals()}
+    driver_names = {d.get('id'): d.get('name', 'Unknown Driver') for d in firebase_service.get_all_drivers()}
+
+    terminals = defaultdict(lambda: {'departures': 0, 'arrivals': 0})
+    routes = defaultdict(lambda: {'trips': 0, 'passengers': 0})
+    completed_trips = total_passengers = duration_count = 0
+    duration_sum = 0.0
+
+    for origin, destination, trips, passengers, seconds, timed in TripRollup.objects.filter(
+            granularity='day', bucket_start=start).values_list(
+            'start_terminal', 'destination_terminal', 'trip_count', 'passenger_sum',
+            'duration_sum_seconds', 'duration_count'):
+        completed_trips += trips
+        total_passengers += passengers
+        terminals[origin]['departures'] += trips
+        terminals[destination]['arrivals'] += trips
+        routes[(origin, destination)]['trips'] += trips
+        routes[(origin, destination)]['passengers'] += passengers
+        duration_sum += seconds
+        duration_count += timed
+
+    drivers = Trip.objects.filter(status='completed', start_time__gte=start, start_time__lt=end).order_by(
+        'driver_id').values('driver_id').annotate(trips=Count('pk'), passengers=Sum('passengers'))
+
+    def terminal_name(terminal_id):
+        return terminal_names.get(terminal_id, terminal_id or 'Unknown')
+
+    return {
+        'date': day.isoformat(),
+        'generated_at': timezone.localtime().strftime('%Y-%m-%d %H:%M'),
+        'total_trips': firebase_service.count_trips(start, end),
+        'completed_trips': completed_trips,
+        'total_passengers': total_passengers,
+        'avg_travel_minutes': duration_sum / duration_count / 60 if duration_count else None,
+        'terminals': sorted(
+            ({'name': terminal_name(tid), **counts} for tid, counts in terminals.items()),
+            key=lambda row: -(row['departures'] + row['arrivals']),
+        ),
+        'routes': sorted(
+            ({'name': f"{terminal_name(origin)} -> {terminal_name(destination)}", **counts}
+             for (origin, destination), counts in routes.items()),
+            key=lambda row: -row['passengers'],
+        ),
+        'drivers': sorted(
+            ({'name': driver_names.get(row['driver_id'], row['driver_id'] or 'Unknown'),
+              'trips': row['trips'], 'passengers': row['passengers'] or 0} for row in drivers),
+            key=lambda row: -row['trips'],
+        ),
+    }
+
+def is_report_fresh(day):
+    """Whether the cached report for a day can be served as is"""
+    path = daily_report_path(day)
+    if not os.path.exists(path):
+        return False
+    built = os.path.getmtime(path)
+    if day < timezone.localdate():
+        # Complete only if built after the day ended; otherwise trips are missing
+        return built >= day_bounds(day)[1].timestamp()
+    return time.time() - built < TODAY_REPORT_MAX_AGE
+
+def get_daily_report(day, force=False):
+    """
+    Path of the PDF report for a day, building it if it is missing or stale
+
+    Args:
+        day (date): Local calendar day (not in the future)
+        force (bool): Rebuild even if a cached report exists
+
+    Returns:
+        str: Path of the PDF file
+    """
+    if not force and is_report_fresh(day):
+        return daily_report_path(day)
+    path = daily_report_path(day)
+    write_daily_report_pdf(compute_daily_summary(day), path)
+    logger.info(f"Built fleet report for {day}")
+    return path
+
+def build_daily_reports(days, workers=None, force=False, progress=None):
+    """
+    Build reports for many days in parallel
+
+    Figures come from the local rollup tables, so they are gathered in
+    this process; rendering is CPU-bound and runs in a process pool.
+
+    Args:
+        days (list): Days to build
+        workers (int): Pool sizes (defaults to the CPU count)
+        force (bool): Rebuild days that are already cached
+        progress (callable): Called with (day, path) as each report is written
+
+    Returns:
+        list: Paths of the reports written
+    """
+    days = [day for day in days if force or not is_report_fresh(day)]
+    if not days:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    summaries = [compute_daily_summary(day) for day in days]
+
+    # Spawn rather than fork: the parent holds gRPC channels and threads.
+    # The worker function lives in utils so children never import Firebase.
+    paths = [daily_report_path(day) for day in days]
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(workers, len(days)), mp_context=context) as executor:
+        for day, path in zip(days, executor.map(write_daily_report_pdf, summaries, paths)):
+            if progress:
+                progress(day, path)
+    logger.info(f"Built {len(paths)} fleet report(s)")
+    return paths
@@ -0,0 +1,215 @@
+"""
+Deadlines, retries and a circuit breaker for Firestore calls
+Every instrumented Firestore call (see monitoring.instrumentation) runs
+through call() or stream():
+
+- Each attempt gets a deadline of FIRESTORE_DEADLINE_SECONDS, and the
+  SDK's own retries are switched off, so a hung RPC cannot hold a worker
+  thread for longer than that.
+- Idempotent reads (document gets, queries that have not returned a
+  document yet, counts) are retried up to FIRESTORE_READ_RETRIES times on
+  transient errors, sleeping a random time up to an exponentially growing
+  delay ("full jitter") between attempts. Writes are never retried.
+- FIRESTORE_BREAKER_FAILURES transient failures in a row open the circuit
+  breaker: for FIRESTORE_BREAKER_RESET_SECONDS every call fails at once
+  with FirestoreUnavailable, then a single probe call decides whether it
+  closes again.
+
+Any failed or rejected call marks the current request as degraded.
+FirebaseService then serves cached data where it has it. The
+firestore_status context processor and the X-Firestore-Degraded header
+tell the user that the data may be stale or incomplete.
+"""
+
+import logging
+import random
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for one retry delay, in seconds
+MAX_RETRY_DELAY = 1.0
+
+# google.api_core exception classes (and their subclasses) worth retrying;
+# matched by name so the SDK is not imported until it is used
+TRANSIENT_ERRORS = frozenset({
+    'ServiceUnavailable', 'DeadlineExceeded', 'InternalServerError', 'BadGateway',
+    'GatewayTimeout', 'TooManyRequests', 'ResourceExhausted', 'Unknown',
+    'ConnectionError', 'TimeoutError',
+})
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class FirestoreUnavailable(Exception):
+    """The circuit breaker is open; the call was not sent to Firestore"""
+
+
+def is_transient(error):
+    """Whether an exception means Firestore was unreachable or overloaded"""
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+class CircuitBreaker:
+    """Per-process breaker over all Firestore calls"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def before_call(self):
+        """Raise FirestoreUnavailable if calls are currently being rejected"""
+        if self.state == CLOSED:
+            return
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= settings.FIRESTORE_BREAKER_RESET_SECONDS:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                # This call is the probe; everyone else keeps failing fast
+                self._probing = True
+                return
+            if self.state == CLOSED:
+                return
+        raise FirestoreUnavailable('Firestore circuit breaker is open')
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                logger.warning("Firestore circuit breaker closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                    self.state == CLOSED and self.failures >= settings.FIRESTORE_BREAKER_FAILURES):
+                logger.error(f"Firestore circuit breaker opened after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    @property
+    def is_open(self):
+        """True while calls are being rejected (open or waiting on a probe)"""
+        return self.state != CLOSED
+
+
+breaker = CircuitBreaker()
+
+
+def deadline(kwargs):
+    """SDK call keyword arguments with our deadline and without SDK retries"""
+    kwargs = dict(kwargs)
+    kwargs.setdefault('timeout', settings.FIRESTORE_DEADLINE_SECONDS)
+    kwargs.setdefault('retry', None)
+    return kwargs
+
+
+def retry_delay(attempt):
+    """Seconds to wait before retry number attempt + 1 (full jitter)"""
+    return random.uniform(0, min(MAX_RETRY_DELAY, settings.FIRESTORE_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def mark_degraded():
+    """Flag the current request as served without (complete) Firestore data"""
+    # Imported here: timing imports instrumentation, which imports this module
+    from . import timing
+
+    cost = timing.current_cost()
+    if cost is not None:
+        cost.degraded = True
+
+
+def _should_retry(error, attempt, retryable, operation):
+    """Record a failed attempt; True if it should be tried again"""
+    from . import metrics
+
+    if isinstance(error, FirestoreUnavailable):
+        metrics.firestore_rejections.inc(operation)
+        mark_degraded()
+        return False
+    if not is_transient(error):
+        # Firestore answered (NotFound, Conflict, a bad query...)
+        breaker.record_success()
+        return False
+    breaker.record_failure()
+    if retryable and attempt < settings.FIRESTORE_READ_RETRIES and not breaker.is_open:
+        metrics.firestore_retries.inc(operation)
+        logger.warning(f"Retrying Firestore {operation} after {type(error).__name__}")
+        time.sleep(retry_delay(attempt))
+        return True
+    mark_degraded()
+    return False
+
+
+def call(func, idempotent, operation):
+    """
+    Run one Firestore call under the breaker, retrying idempotent reads
+
+    Args:
+        func: Makes one attempt (already instrumented and with a deadline)
+        idempotent (bool): Whether the call may be sent again
+        operation (str): Operation kind, for logs and metrics
+
+    Returns:
+        The result of the first successful attempt
+    """
+    attempt = 0
+    while True:
+        try:
+            breaker.before_call()
+            result = func()
+        except Exception as e:
+            if _should_retry(e, attempt, idempotent, operation):
+                attempt += 1
+                continue
+            raise
+        breaker.record_success()
+        return result
+
+
+def stream(open_stream, operation='query'):
+    """
+    Yield from a streaming query under the breaker
+
+    A failed stream is only restarted while it has not produced a document,
+    so callers never see a document twice.
+    """
+    attempt = 0
+    while True:
+        started = False
+        try:
+            breaker.before_call()
+            documents = open_stream()
+            try:
+                for document in documents:
+                    started = True
+                    yield document
+            finally:
+                documents.close()
+        except GeneratorExit:
+            # The caller stopped early, after at least one document
+            breaker.record_success()
+            raise
+        except Exception as e:
+            if _should_retry(e, attempt, not started, operation):
+                attempt += 1
+                continue
+            raise
+        breaker.record_success()
+        return
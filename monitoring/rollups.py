@@ -0,0 +1,208 @@
+"""
+Hourly and daily trip rollups
+Completed trips are folded into TripRollup buckets (granularity x bucket x
+route) as they complete, so charts read a few hundred bucket rows instead of
+scanning the trip history. The local Trip cache table records which trips
+have been counted, which keeps the rollups exact when a completion is
+reported twice.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import ODSnapshot, Trip, TripRollup
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_GRANULARITIES = ('hour', 'day')
+
+def _aware(value):
+    """Trip timestamps may be naive (datetime.now()); Firestore stores those as UTC"""
+    if value is None or timezone.is_aware(value):
+        return value
+    return value.replace(tzinfo=dt_timezone.utc)
+
+def bucket_start(value, granularity):
+    """Start of the local hour or day containing a timestamp"""
+    local = timezone.localtime(_aware(value))
+    if granularity == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    return local.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def trip_contribution(trip):
+    """
+    What a completed trip adds to its buckets
+
+    Returns:
+        tuple: (timestamp, route key, passengers, duration seconds or None),
+               or None if the trip has no usable timestamp
+    """
+    start_time = _aware(trip.get('start_time'))
+    arrival_time = _aware(trip.get('arrival_time'))
+    when = start_time or _aware(trip.get('created_at')) or arrival_time
+    if when is None:
+        return None
+
+    duration = None
+    if start_time and arrival_time and arrival_time >= start_time:
+        duration = (arrival_time - start_time).total_seconds()
+
+    route = (trip.get('start_terminal') or '', trip.get('destination_terminal') or '')
+    return when, route, int(trip.get('passengers') or 0), duration
+
+def record_trip_completion(trip):
+    """
+    Fold a completed trip into the hourly and daily rollups exactly once
+
+    Args:
+        trip (dict): Trip data with 'id' (or 'trip_id') and its final values
+
+    Returns:
+        bool: True if the trip was counted now, False if it is not
+              completed, was already counted or could not be recorded
+    """
+    if trip.get('status') != 'completed':
+        return False
+    trip_id = trip.get('trip_id') or trip.get('id')
+    contribution = trip_contribution(trip)
+    if not trip_id or contribution is None:
+        return False
+    when, (origin, destination), passengers, duration = contribution
+
+    try:
+        with transaction.atomic():
+            local, created = Trip.objects.get_or_create(trip_id=trip_id, defaults={
+                'driver_id': trip.get('driver_id') or '',
+                'start_terminal': origin,
+                'destination_terminal': destination,
+                'passengers': passengers,
+                'start_time': _aware(trip.get('start_time')),
+                'arrival_time': _aware(trip.get('arrival_time')),
+                'status': 'completed',
+            })
+            if not created and not Trip.objects.filter(pk=local.pk).exclude(status='completed').update(
+                    status='completed', passengers=passengers, arrival_time=_aware(trip.get('arrival_time'))):
+                return False
+
+            for granularity in ROLLUP_GRANULARITIES:
+                bucket, _ = TripRollup.objects.get_or_create(
+                    granularity=granularity,
+                    bucket_start=bucket_start(when, granularity),
+                    start_terminal=origin,
+                    destination_terminal=destination,
+                )
+                TripRollup.objects.filter(pk=bucket.pk).update(
+                    trip_count=F('trip_count') + 1,
+                    passenger_sum=F('passenger_sum') + passengers,
+                    duration_sum_seconds=F('duration_sum_seconds') + (duration or 0),
+                    duration_count=F('duration_count') + (1 if duration is not None else 0),
+                )
+            # od_matrix loads numpy, which the trip views otherwise never need
+            from .od_matrix import invalidate_day
+
+            invalidate_day(bucket_start(when, 'day').date())
+        return True
+    except Exception as e:
+        logger.error(f"Error recording rollups for trip {trip_id}: {e}")
+        return False
+
+def rebuild_rollups(trips):
+    """
+    Replace all rollups with totals computed from the given completed trips
+
+    Args:
+        trips (iterable): Completed trip dicts with 'id'
+
+    Returns:
+        tuple: (trips counted, bucket rows written)
+    """
+    totals = defaultdict(lambda: [0, 0, 0.0, 0])
+    ledger = []
+    for trip in trips:
+        contribution = trip_contribution(trip)
+        if contribution is None:
+            continue
+        when, route, passengers, duration = contribution
+        for granularity in ROLLUP_GRANULARITIES:
+            bucket = totals[(granularity, bucket_start(when, granularity)) + route]
+            bucket[0] += 1
+            bucket[1] += passengers
+            if duration is not None:
+                bucket[2] += duration
+                bucket[3] += 1
+        ledger.append(Trip(
+            trip_id=trip['id'],
+            driver_id=trip.get('driver_id') or '',
+            start_terminal=route[0],
+            destination_terminal=route[1],
+            passengers=passengers,
+            start_time=_aware(trip.get('start_time')),
+            arrival_time=_aware(trip.get('arrival_time')),
+            status='completed',
+        ))
+
+    with transaction.atomic():
+        TripRollup.objects.all().delete()
+        Trip.objects.all().delete()
+        ODSnapshot.objects.all().delete()
+        TripRollup.objects.bulk_create([
+            TripRollup(
+                granularity=granularity,
+                bucket_start=start,
+                start_terminal=origin,
+                destination_terminal=destination,
+                trip_count=count,
+                passenger_sum=passenger_sum,
+                duration_sum_seconds=duration_sum,
+                duration_count=duration_count,
+            )
+            for (granularity, start, origin, destination), (count, passenger_sum, duration_sum, duration_count)
+            in totals.items()
+        ], batch_size=1000)
+        Trip.objects.bulk_create(ledger, batch_size=1000)
+
+    return len(ledger), len(totals)
+
+def rollup_series(granularity, start, end, start_terminal=None, destination_terminal=None, group_by=None):
+    """
+    Read a time series from the rollup tables
+
+    Args:
+        granularity (str): 'hour' or 'day'
+        start (datetime): First bucket to include
+        end (datetime): Buckets before this time are included
+        start_terminal (str): Only routes leaving this terminal
+        destination_terminal (str): Only routes arriving at this terminal
+        group_by (str): None for one series, 'terminal' (start terminal) or 'route'
+
+    Returns:
+        list: Bucket dicts ordered by time with trip_count, passenger_sum and
+              avg_duration_minutes (plus the grouping keys)
+    """
+    rows = TripRollup.objects.filter(granularity=granularity, bucket_start__gte=start, bucket_start__lt=end)
+    if start_terminal:
+        rows = rows.filter(start_terminal=start_terminal)
+    if destination_terminal:
+        rows = rows.filter(destination_terminal=destination_terminal)
+
+    keys = ['bucket_start']
+    if group_by in ('terminal', 'route'):
+        keys.append('start_terminal')
+    if group_by == 'route':
+        keys.append('destination_terminal')
+
+    series = []
+    for row in rows.order_by(*keys).values(*keys).annotate(
+            trip_count=Sum('trip_count'),
+            passenger_sum=Sum('passenger_sum'),
+            duration_sum_seconds=Sum('duration_sum_seconds'),
+            duration_count=Sum('duration_count')):
+        duration_count = row.pop('duration_count')
+        duration_sum = row.pop('duration_sum_seconds')
+        row['bucket_start'] = timezone.localtime(row['bucket_start']).isoformat()
+        row['avg_duration_minutes'] = duration_sum / duration_count / 60 if duration_count else None
+        series.append(row)
+    return series
@@ -0,0 +1,149 @@
+"""
+Slow and expensive Firestore query log
+Any Firestore operation slower than SLOW_QUERY_MS, or billing more than
+SLOW_QUERY_DOCUMENTS reads, is written as one JSON line to a rotating log
+with its query shape (collection, filter fields and operators, ordering,
+limit), cost, the FirebaseService method and the calling view and line.
+Filter values are never logged. `manage.py top_queries` summarizes the
+log by query shape.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timezone as dt_timezone
+from logging.handlers import RotatingFileHandler
+from django.conf import settings
+from . import timing
+from .instrumentation import add_listener
+
+SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Frames in these modules are plumbing, not call sites
+_SKIPPED_FILES = {
+    os.path.join(_PACKAGE_DIR, name)
+    for name in ('instrumentation.py', 'resilience.py', 'slow_queries.py', 'firebase_service.py')
+}
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def _log_handler():
+    """The rotating file handler, created on the first slow query"""
+    global _handler
+    if _handler is None:
+        with _handler_lock:
+            if _handler is None:
+                path = settings.SLOW_QUERY_LOG_PATH
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _handler = RotatingFileHandler(path, maxBytes=SLOW_QUERY_LOG_MAX_BYTES,
+                                               backupCount=SLOW_QUERY_LOG_BACKUPS, encoding='utf-8')
+                _handler.setFormatter(logging.Formatter('%(message)s'))
+    return _handler
+
+
+def call_site():
+    """
+    Where the current Firestore call came from
+
+    Returns:
+        tuple: (FirebaseService method name or None, "path:line in function"
+               of the nearest project frame outside the service, or None)
+    """
+    method = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.endswith('firebase_service.py') and method is None and frame.f_code.co_name != '<genexpr>':
+            method = frame.f_code.co_name
+        elif (filename not in _SKIPPED_FILES and filename.startswith(str(settings.BASE_DIR))
+              and 'site-packages' not in filename):
+            path = os.path.relpath(filename, settings.BASE_DIR)
+            return method, f"{path}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return method, None
+
+
+def query_shape(record):
+    """Grouping key for a log record: everything but the cost and the call site"""
+    return (
+        record.get('kind'),
+        record.get('collection'),
+        json.dumps(record.get('filters') or []),
+        json.dumps(record.get('order_by') or []),
+        record.get('limit'),
+        bool(record.get('offset')),
+        bool(record.get('cursor')),
+        record.get('method'),
+    )
+
+
+def build_record(operation):
+    """JSON-ready log record for an operation, or None if it is cheap enough"""
+    duration_ms = operation.duration * 1000
+    reasons = []
+    if duration_ms >= settings.SLOW_QUERY_MS:
+        reasons.append('slow')
+    if operation.reads > settings.SLOW_QUERY_DOCUMENTS:
+        reasons.append('large')
+    if not reasons:
+        return None
+
+    method, caller = call_site()
+    cost = timing.current_cost()
+    shape = operation.shape
+    return {
+        'time': datetime.now(dt_timezone.utc).isoformat(timespec='milliseconds'),
+        'reason': reasons,
+        'kind': operation.kind,
+        'collection': operation.collection,
+        'filters': [list(item) for item in shape.get('filters', [])],
+        'order_by': [list(item) for item in shape.get('order_by', [])],
+        'limit': shape.get('limit'),
+        'offset': shape.get('offset'),
+        'cursor': bool(shape.get('cursor')),
+        'documents': operation.reads,
+        'duration_ms': round(duration_ms, 1),
+        'error': operation.error,
+        'method': method,
+        'caller': caller,
+        'view': getattr(cost, 'view', None),
+    }
+
+
+def record_slow_query(operation):
+    """Instrumentation listener writing slow and large operations to the log"""
+    record = build_record(operation)
+    if record is None:
+        return
+    handler = _log_handler()
+    handler.handle(logging.LogRecord(__name__, logging.WARNING, record['caller'] or '', 0,
+                                     json.dumps(record, default=str), None, None))
+
+
+def read_log(path=None):
+    """
+    Records from the slow query log and its rotated backups, oldest first
+
+    Yields:
+        dict: One log record per line; malformed lines are skipped
+    """
+    path = path or settings.SLOW_QUERY_LOG_PATH
+    paths = [f"{path}.{number}" for number in range(SLOW_QUERY_LOG_BACKUPS, 0, -1)] + [path]
+    for log_path in paths:
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, encoding='utf-8') as log_file:
+            for line in log_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+add_listener(record_slow_query)
@@ -0,0 +1,97 @@
+"""
+Background tasks that run off the request path
+Slow remote side effects (QR rendering, Cloudinary uploads, Firebase Auth)
+are queued as durable jobs (see monitoring.jobs) so views can respond
+immediately; `manage.py run_workers` executes them with retry and backoff.
+"""
+
+import base64
+import hashlib
+import logging
+from django.conf import settings
+from django.contrib.auth.models import User
+from .firebase_service import firebase_service
+from .jobs import job, enqueue, PermanentJobError
+from .utils import generate_and_upload_qr
+
+logger = logging.getLogger(__name__)
+
+# Terminal QR codes
+def _mark_terminal_qr_failed(terminal_id, terminal_name):
+    firebase_service.update_terminal(terminal_id, {'qr_status': 'failed'})
+
+@job('upload_terminal_qr', on_dead=_mark_terminal_qr_failed)
+def upload_terminal_qr(terminal_id, terminal_name):
+    """
+    Generate and upload a terminal's QR code
+
+    Sets the terminal's qr_code_url and qr_status; raises so the queue
+    retries when the upload fails.
+    """
+    qr_url = generate_and_upload_qr(terminal_id, terminal_name)
+    if not qr_url:
+        raise RuntimeError(f"QR upload failed for terminal {terminal_id}")
+    firebase_service.update_terminal(terminal_id, {'qr_code_url': qr_url, 'qr_status': 'ready'})
+    logger.info(f"QR code ready for terminal {terminal_id}")
+    return qr_url
+
+def enqueue_terminal_qr_upload(terminal_id, terminal_name):
+    """Queue upload_terminal_qr for the workers"""
+    return enqueue('upload_terminal_qr', {'terminal_id': terminal_id, 'terminal_name': terminal_name})
+
+# Driver Firebase Auth accounts
+# A queued driver password is kept encrypted, and is unusable after this many
+# seconds (far longer than the retry schedule; jobs still queued then dead-letter)
+PASSWORD_TOKEN_TTL = 60 * 60
+
+def _password_cipher():
+    # Migration 0005_seal_job_passwords keeps a copy of this key derivation
+    from cryptography.fernet import Fernet
+
+    key = hashlib.sha256(f"monitoring.tasks.password:{settings.SECRET_KEY}".encode()).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+def seal_password(password):
+    """Encrypt a password for a job payload (see PASSWORD_TOKEN_TTL)"""
+    return _password_cipher().encrypt(password.encode()).decode()
+
+def open_password(token):
+    """Decrypt a sealed password; raises PermanentJobError once it has expired"""
+    from cryptography.fernet import InvalidToken
+
+    try:
+        return _password_cipher().decrypt(token.encode(), ttl=PASSWORD_TOKEN_TTL).decode()
+    except InvalidToken:
+        raise PermanentJobError("Password token expired or invalid")
+
+def _mark_driver_auth_failed(driver_id, email, password_token=None, display_name=None, django_user_id=None):
+    # Without a Firebase Auth account the driver cannot log in; remove the
+    # Django user created alongside it, as driver_create used to
+    if django_user_id:
+        User.objects.filter(pk=django_user_id).delete()
+    firebase_service.update_driver(driver_id, {'auth_status': 'failed', 'django_user_id': None})
+
+@job('create_driver_auth_user', on_dead=_mark_driver_auth_failed, scrub=('password_token',))
+def create_driver_auth_user(driver_id, email, password_token, display_name=None, django_user_id=None):
+    """Create the Firebase Auth user for a driver and link it to the driver record"""
+    from firebase_admin import auth
+
+    try:
+        auth_uid = firebase_service.create_auth_user(email, open_password(password_token), display_name)
+    except auth.EmailAlreadyExistsError:
+        raise PermanentJobError(f"Email already exists: {email}")
+    if not auth_uid:
+        raise RuntimeError(f"Could not create Firebase Auth user for {email}")
+    firebase_service.update_driver(driver_id, {'auth_uid': auth_uid, 'auth_status': 'ready'})
+    firebase_service.register_driver_aliases(driver_id, {auth_uid})
+    return auth_uid
+
+def enqueue_driver_auth_user(driver_id, email, password, display_name=None, django_user_id=None):
+    """Queue create_driver_auth_user for the workers (with the password sealed, never in plain text)"""
+    return enqueue('create_driver_auth_user', {
+        'driver_id': driver_id,
+        'email': email,
+        'password_token': seal_password(password),
+        'display_name': display_name,
+        'django_user_id': django_user_id,
+    })
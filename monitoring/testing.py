@@ -0,0 +1,476 @@
+"""
+Test helpers for code that talks to Firestore
+OfflineFirestore is an in-memory stand-in for the Firestore client that
+supports the subset of the API FirebaseService uses (documents, filtered
+and ordered queries, cursors, count aggregations, batches and field
+transforms, update-time preconditions). FirestoreTestMixin installs it behind the usual
+instrumentation so tests can assert how many round trips, reads and writes
+a block of code costs, much like Django's assertNumQueries.
+"""
+
+import copy
+import itertools
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from google.api_core.exceptions import Conflict, FailedPrecondition, NotFound
+from google.cloud.firestore_v1 import transforms, types
+from google.cloud.firestore_v1.client import Client
+from google.cloud.firestore_v1._helpers import encode_value
+from google.cloud.firestore_v1.base_aggregation import AggregationResult
+from django.core.cache import cache
+from django.test import override_settings
+from . import resilience
+from .firebase_service import firebase_service
+from .instrumentation import FirestoreCounter, InstrumentedClient
+
+_auto_ids = itertools.count(1)
+# Store key holding {(collection, document ID): update time}
+_UPDATE_TIMES = '__update_times__'
+_last_update_time = datetime.min.replace(tzinfo=dt_timezone.utc)
+
+
+def _next_update_time():
+    """Strictly increasing update times, so back-to-back writes get different versions"""
+    global _last_update_time
+    _last_update_time = max(datetime.now(dt_timezone.utc), _last_update_time + timedelta(microseconds=1))
+    return _last_update_time
+
+
+def _stored(value):
+    """Firestore keeps timestamps in UTC and returns them timezone-aware"""
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=dt_timezone.utc)
+    if isinstance(value, dict):
+        return {key: _stored(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_stored(item) for item in value]
+    return value
+
+
+def _type_rank(value):
+    """Firestore orders values of different types by type first"""
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, list):
+        return 8
+    return 9
+
+
+def _comparable(a, b):
+    return a is not None and _type_rank(a) == _type_rank(b)
+
+
+_OPERATORS = {
+    '==': lambda a, b: a == b and _type_rank(a) == _type_rank(b),
+    '!=': lambda a, b: a is not None and a != b,
+    '<': lambda a, b: _comparable(a, b) and a < b,
+    '<=': lambda a, b: _comparable(a, b) and a <= b,
+    '>': lambda a, b: _comparable(a, b) and a > b,
+    '>=': lambda a, b: _comparable(a, b) and a >= b,
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a is not None and a not in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+    'array_contains_any': lambda a, b: isinstance(a, list) and any(item in a for item in b),
+}
+
+_MISSING = object()
+
+
+def _get_path(data, field_path):
+    for part in field_path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return _MISSING
+        data = data[part]
+    return data
+
+
+def _apply(data, field_path, value):
+    """Set one (dotted) field, applying Firestore transforms and sentinels"""
+    parts = field_path.split('.')
+    parent = data
+    for part in parts[:-1]:
+        parent = parent.setdefault(part, {})
+    _apply_key(parent, parts[-1], value)
+
+
+def _apply_key(parent, key, value):
+    """Set one key of a map; set() payload keys are literal, dots included"""
+    current = parent.get(key)
+
+    if value is transforms.DELETE_FIELD:
+        parent.pop(key, None)
+    elif value is transforms.SERVER_TIMESTAMP:
+        parent[key] = datetime.now(dt_timezone.utc)
+    elif isinstance(value, transforms.ArrayUnion):
+        items = list(current) if isinstance(current, list) else []
+        parent[key] = items + [item for item in _stored(list(value.values)) if item not in items]
+    elif isinstance(value, transforms.ArrayRemove):
+        items = list(current) if isinstance(current, list) else []
+        parent[key] = [item for item in items if item not in value.values]
+    elif isinstance(value, transforms.Increment):
+        parent[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+    elif isinstance(value, transforms.Maximum):
+        parent[key] = max(current, value.value) if isinstance(current, (int, float)) else value.value
+    elif isinstance(value, transforms.Minimum):
+        parent[key] = min(current, value.value) if isinstance(current, (int, float)) else value.value
+    else:
+        parent[key] = _stored(copy.deepcopy(value))
+
+
+_TRANSFORMS = (transforms.ArrayUnion, transforms.ArrayRemove, transforms.Increment,
+               transforms.Maximum, transforms.Minimum)
+
+
+def _merge(data, changes, prefix='', applied=None):
+    """Apply a set() payload; returns the (field path, value) pairs it transformed"""
+    applied = [] if applied is None else applied
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge(data[key], value, f"{prefix}{key}.", applied)
+        else:
+            _apply_key(data, key, value)
+            if value is transforms.SERVER_TIMESTAMP or isinstance(value, _TRANSFORMS):
+                applied.append((f"{prefix}{key}", data.get(key)))
+    return applied
+
+
+def _write_result(applied, update_time):
+    """
+    WriteResult with the values the transforms produced, in field path order
+    like Firestore (array transforms report null)
+    """
+    return types.WriteResult(
+        update_time=update_time,
+        transform_results=[
+            encode_value(None if isinstance(value, list) else value)
+            for _, value in sorted(applied, key=lambda item: item[0])
+        ],
+    )
+
+
+class OfflineSnapshot:
+    """DocumentSnapshot stand-in"""
+
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        value = _get_path(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class OfflineDocument:
+    """DocumentReference stand-in (SDK options such as retry and timeout are ignored)"""
+
+    def __init__(self, store, collection, document_id):
+        self._store = store
+        self._collection = collection
+        self.id = document_id
+
+    @property
+    def _documents(self):
+        return self._store.setdefault(self._collection, {})
+
+    @property
+    def _key(self):
+        return self._collection, self.id
+
+    def _touch(self):
+        update_time = self._store.setdefault(_UPDATE_TIMES, {})[self._key] = _next_update_time()
+        return update_time
+
+    def get(self, **kwargs):
+        return OfflineSnapshot(self, copy.deepcopy(self._documents.get(self.id)),
+                               self._store.get(_UPDATE_TIMES, {}).get(self._key))
+
+    def create(self, document_data, **kwargs):
+        if self.id in self._documents:
+            raise Conflict(f"Document already exists: {self._collection}/{self.id}")
+        return self.set(document_data)
+
+    def set(self, document_data, merge=False, **kwargs):
+        if not (merge and self.id in self._documents):
+            self._documents[self.id] = {}
+        return _write_result(_merge(self._documents[self.id], document_data), self._touch())
+
+    def update(self, field_updates, option=None, **kwargs):
+        if self.id not in self._documents:
+            raise NotFound(f"No document to update: {self._collection}/{self.id}")
+        last_update_time = getattr(option, '_last_update_time', None)
+        if last_update_time is not None and last_update_time != self._store[_UPDATE_TIMES].get(self._key):
+            raise FailedPrecondition(f"Document changed since {last_update_time}: {self._collection}/{self.id}")
+        applied = []
+        for field_path, value in field_updates.items():
+            _apply(self._documents[self.id], field_path, value)
+            if value is transforms.SERVER_TIMESTAMP or isinstance(value, _TRANSFORMS):
+                applied.append((field_path, _get_path(self._documents[self.id], field_path)))
+        return _write_result(applied, self._touch())
+
+    def delete(self, **kwargs):
+        self._documents.pop(self.id, None)
+        self._store.get(_UPDATE_TIMES, {}).pop(self._key, None)
+
+    def collection(self, name):
+        return OfflineQuery(self._store, f"{self._collection}/{self.id}/{name}")
+
+
+class OfflineQuery:
+    """CollectionReference and Query stand-in"""
+
+    def __init__(self, store, collection, filters=(), orders=(), limit=None, offset=0,
+                 cursor=None, fields=None):
+        self._store = store
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+        self._cursor = cursor
+        self._fields = fields
+
+    @property
+    def id(self):
+        return self._collection.rsplit('/', 1)[-1]
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters, 'orders': self._orders, 'limit': self._limit,
+            'offset': self._offset, 'cursor': self._cursor, 'fields': self._fields,
+        }
+        state.update(changes)
+        return OfflineQuery(self._store, self._collection, **state)
+
+    def document(self, document_id=None):
+        return OfflineDocument(self._store, self._collection, document_id or f"offline{next(_auto_ids):06d}")
+
+    def where(self, field_path, op_string, value):
+        if op_string not in _OPERATORS:
+            raise ValueError(f"Unsupported operator: {op_string}")
+        return self._copy(filters=self._filters + ((field_path, op_string, _stored(value)),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def count(self, alias='count'):
+        return OfflineAggregation(self, alias)
+
+    def _sort_key(self, document_id, data):
+        key = []
+        for field_path, direction in self._orders:
+            value = _get_path(data, field_path)
+            item = (_type_rank(value), value)
+            key.append(_Reversed(item) if direction == 'DESCENDING' else item)
+        # Like Firestore, ties are broken by document ID in the last direction
+        last = self._orders[-1][1] if self._orders else 'ASCENDING'
+        key.append(_Reversed(document_id) if last == 'DESCENDING' else document_id)
+        return key
+
+    def _matches(self):
+        documents = self._store.get(self._collection, {})
+        matches = []
+        for document_id, data in documents.items():
+            values_ok = True
+            for field_path, op_string, value in self._filters:
+                found = _get_path(data, field_path)
+                if found is _MISSING or not _OPERATORS[op_string](found, value):
+                    values_ok = False
+                    break
+            # Documents without an order_by field are left out of the results
+            if values_ok and all(_get_path(data, field) is not _MISSING for field, _ in self._orders):
+                matches.append((document_id, data))
+        matches.sort(key=lambda item: self._sort_key(*item))
+
+        if self._cursor is not None:
+            if isinstance(self._cursor, dict):
+                cursor_key = self._sort_key('', self._cursor)[:-1]
+                matches = [item for item in matches if self._sort_key(*item)[:-1] > cursor_key]
+            else:
+                ids = [document_id for document_id, _ in matches]
+                if self._cursor.id in ids:
+                    matches = matches[ids.index(self._cursor.id) + 1:]
+                else:
+                    cursor_key = self._sort_key(self._cursor.id, self._cursor.to_dict() or {})
+                    matches = [item for item in matches if self._sort_key(*item) > cursor_key]
+        matches = matches[self._offset:]
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        return matches
+
+    def stream(self, **kwargs):
+        update_times = self._store.get(_UPDATE_TIMES, {})
+        for document_id, data in self._matches():
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            yield OfflineSnapshot(OfflineDocument(self._store, self._collection, document_id),
+                                  copy.deepcopy(data), update_times.get((self._collection, document_id)))
+
+    def get(self, **kwargs):
+        return list(self.stream(**kwargs))
+
+
+class _Reversed:
+    """Sort key wrapper that inverts the order of the wrapped value"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __gt__(self, other):
+        return other.value > self.value
+
+
+class OfflineAggregation:
+    """AggregationQuery stand-in (count only)"""
+
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self, **kwargs):
+        return [[AggregationResult(alias=self._alias, value=len(self._query._matches()))]]
+
+
+class OfflineBatch:
+    """WriteBatch stand-in; writes are applied on commit"""
+
+    def __init__(self):
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(lambda: reference.set(document_data, merge=merge))
+
+    def create(self, reference, document_data):
+        self._writes.append(lambda: reference.create(document_data))
+
+    def update(self, reference, field_updates):
+        self._writes.append(lambda: reference.update(field_updates))
+
+    def delete(self, reference):
+        self._writes.append(reference.delete)
+
+    def commit(self, **kwargs):
+        results = [write() for write in self._writes]
+        self._writes = []
+        return results
+
+
+class OfflineFirestore:
+    """In-memory Firestore client for tests"""
+
+    def __init__(self):
+        self.store = {}
+
+    def collection(self, name):
+        return OfflineQuery(self.store, name)
+
+    def batch(self):
+        return OfflineBatch()
+
+    write_option = staticmethod(Client.write_option)
+
+    def seed(self, collection, documents):
+        """Insert {document ID: data} directly, without going through FirebaseService"""
+        for document_id, data in documents.items():
+            self.collection(collection).document(document_id).set(data)
+
+
+def use_offline_firestore():
+    """
+    Point FirebaseService at a fresh OfflineFirestore
+
+    Returns:
+        tuple: (OfflineFirestore, the previous client to restore afterwards)
+    """
+    previous = firebase_service._db
+    offline = OfflineFirestore()
+    firebase_service._db = InstrumentedClient(offline)
+    # Drop cached reads and the terminal index built from the old client
+    cache.clear()
+    firebase_service._invalidate_terminals()
+    resilience.breaker.reset()
+    return offline, previous
+
+
+class FirestoreTestMixin:
+    """
+    TestCase mixin that runs each test against an empty OfflineFirestore
+    (available as self.firestore) and adds Firestore budget assertions.
+    View read budgets are strict, so a view going over its budget fails the test.
+    """
+
+    def setUp(self):
+        super().setUp()
+        budgets = override_settings(FIRESTORE_READ_BUDGET_MODE='strict', FIRESTORE_READ_BUDGET_RAISE=True)
+        budgets.enable()
+        self.addCleanup(budgets.disable)
+        self.firestore, previous = use_offline_firestore()
+        self.addCleanup(setattr, firebase_service, '_db', previous)
+        self.addCleanup(cache.clear)
+        self.addCleanup(resilience.breaker.reset)
+
+    @contextmanager
+    def assertFirestoreBudget(self, round_trips=None, reads=None, writes=None):
+        """
+        Fail if the block issues more Firestore round trips, document reads or
+        writes than allowed (None means unlimited)
+
+            with self.assertFirestoreBudget(round_trips=3, reads=50):
+                self.client.get(reverse('trip_list'))
+        """
+        with FirestoreCounter() as counter:
+            yield counter
+        for name, limit, used in (('round trips', round_trips, counter.round_trips),
+                                  ('reads', reads, counter.reads),
+                                  ('writes', writes, counter.writes)):
+            if limit is not None and used > limit:
+                self.fail(f"Firestore {name} budget exceeded: {used} > {limit}\n{counter.summary()}")
+
+    @contextmanager
+    def assertNumFirestoreRoundTrips(self, number):
+        """Fail unless the block issues exactly `number` Firestore round trips"""
+        with FirestoreCounter() as counter:
+            yield counter
+        self.assertEqual(counter.round_trips, number,
+                         f"{counter.round_trips} Firestore round trips, expected {number}\n{counter.summary()}")
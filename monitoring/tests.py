@@ -1,3 +1,1558 @@
+import importlib
+import json
+import math
+import threading
+from datetime import date, datetime, timedelta
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+import numpy as np
+from django.contrib.auth.models import User
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.db.models import Sum
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from . import (analytics, api_views, budgets, channels, driver_import, exports, geo, geohash, jobs, metrics,
+               od_matrix, passengers, reports, resilience, rollups, slow_queries, tasks, utils)
+from .firebase_service import (firebase_service, FirebaseService, QuerySequence, DASHBOARD_COUNTS_CACHE_KEY,
+                               TERMINALS_CACHE_KEY)
+from .geohash import haversine_m
+from .instrumentation import FirestoreCounter, InstrumentedClient
+from .models import Job, ODSnapshot, Trip, TripRollup
+from .rollups import record_trip_completion
+from .testing import FirestoreTestMixin, OfflineFirestore, OfflineQuery
+from .timing import RequestCost
 
-# Create your tests here.
+
+def seed_fleet(firestore, trips=60, drivers=5, terminals=3):
+    """Terminals T0.., drivers D0.. and trips TR000.. created a minute apart (TR000 oldest)"""
+    firestore.seed('terminals', {
+        f'T{i}': {'terminal_id': f'T{i}', 'name': f'Terminal {i}', 'latitude': 8.0 + i / 100,
+                  'longitude': 124.0 + i / 100, 'is_active': True}
+        for i in range(terminals)
+    })
+    firestore.seed('drivers', {
+        f'D{i}': {'driver_id': f'D{i}', 'name': f'Driver {i}', 'email': f'driver{i}@example.com',
+                  'is_active': True}
+        for i in range(drivers)
+    })
+    firestore.seed('meta', {'trip_driver_ids': {'driver_ids': [f'D{i}' for i in range(drivers)]}})
+    started = datetime(2025, 1, 6, 6, 0)
+    firestore.seed('trips', {
+        f'TR{i:03d}': {
+            'trip_id': f'TR{i:03d}',
+            'driver_id': f'D{i % drivers}',
+            'start_terminal': f'T{i % terminals}',
+            'destination_terminal': f'T{(i + 1) % terminals}',
+            'status': 'completed' if i % 3 else 'in_progress',
+            'passengers': i % 12,
+            'start_time': started + timedelta(minutes=i),
+            'created_at': started + timedelta(minutes=i),
+        }
+        for i in range(trips)
+    })
+
+
+class FirestoreCounterTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=10)
+
+    def test_document_get_is_one_read(self):
+        with FirestoreCounter() as counter:
+            firebase_service.get_trip('TR001')
+        self.assertEqual((counter.round_trips, counter.reads, counter.writes), (1, 1, 0))
+
+    def test_query_reads_every_returned_document(self):
+        with FirestoreCounter() as counter:
+            trips = firebase_service.get_trips_by_status('completed')
+        self.assertEqual(counter.round_trips, 1)
+        self.assertEqual(counter.reads, len(trips))
+
+    def test_empty_query_is_billed_one_read(self):
+        with FirestoreCounter() as counter:
+            self.assertEqual(firebase_service.get_trips_by_status('cancelled'), [])
+        self.assertEqual(counter.reads, 1)
+
+    def test_offset_skipped_documents_are_billed(self):
+        query = firebase_service.db.collection('trips').order_by('created_at').offset(6).limit(2)
+        with FirestoreCounter() as counter:
+            self.assertEqual(len(query.get()), 2)
+        self.assertEqual(counter.reads, 8)
+
+    def test_batch_commit_is_one_round_trip(self):
+        with FirestoreCounter() as counter:
+            written = firebase_service.batch_update_trips({f'TR{i:03d}': {'passengers': 1} for i in range(4)})
+        self.assertEqual(written, 4)
+        self.assertEqual((counter.round_trips, counter.reads, counter.writes), (1, 0, 4))
+
+    def test_other_threads_are_not_counted(self):
+        with FirestoreCounter() as counter:
+            worker = threading.Thread(target=firebase_service.get_trip, args=('TR001',))
+            worker.start()
+            worker.join()
+        self.assertEqual(counter.round_trips, 0)
+
+    def test_budget_assertion_reports_operations(self):
+        with self.assertRaisesRegex(AssertionError, r'reads budget exceeded: 10 > 5'):
+            with self.assertFirestoreBudget(reads=5):
+                firebase_service.get_all_trips()
+
+
+class TripSequenceTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=40)
+
+    def test_pages_are_newest_first(self):
+        trips = firebase_service.get_trip_sequence()
+        self.assertIsInstance(trips, QuerySequence)
+        self.assertEqual(len(trips), 40)
+        self.assertEqual([trip['id'] for trip in trips[0:3]], ['TR039', 'TR038', 'TR037'])
+        self.assertEqual(trips[39]['id'], 'TR000')
+
+    def test_filters_run_in_firestore(self):
+        trips = firebase_service.get_trip_sequence(status='completed', driver_ids=['D1', 'D2'])
+        expected = [f'TR{i:03d}' for i in range(39, -1, -1) if i % 3 and i % 5 in (1, 2)]
+        self.assertEqual([trip['id'] for trip in trips[0:100]], expected)
+        self.assertEqual(len(trips), len(expected))
+
+    def test_next_page_starts_after_previous_page(self):
+        trips = firebase_service.get_trip_sequence()
+        trips[0:15]
+        with FirestoreCounter() as counter:
+            page = firebase_service.get_trip_sequence()[15:30]
+        self.assertEqual(page[0]['id'], 'TR024')
+        self.assertNotIn('offset', counter.operations[-1].shape)
+        self.assertEqual(counter.reads, 16)
+
+    def test_new_trip_does_not_shift_cached_page_boundaries(self):
+        firebase_service.get_trip_sequence()[0:15]
+        firebase_service.create_trip({'driver_id': 'D0', 'status': 'in_progress'})
+        trips = firebase_service.get_trip_sequence()
+        self.assertEqual(len(trips), 41)
+        self.assertEqual(trips[15:30][0]['id'], 'TR025')
+
+    def test_unknown_driver_ids_match_nothing(self):
+        self.assertEqual(firebase_service.get_trip_sequence(driver_ids=[]), [])
+
+    def test_many_driver_ids_fall_back_to_a_list(self):
+        driver_ids = ['D0'] + [f'X{i}' for i in range(40)]
+        trips = firebase_service.get_trip_sequence(driver_ids=driver_ids)
+        self.assertEqual([trip['id'] for trip in trips][:2], ['TR035', 'TR030'])
+
+
+class ViewBudgetTests(FirestoreTestMixin, TestCase):
+    """Firestore cost of the main pages once per-process caches are warm"""
+
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore)
+        self.user = User.objects.create_user('staff', 'staff@example.com', 'password')
+        self.client.force_login(self.user)
+
+    def get_warm(self, url, data=None):
+        """Request a page once to fill the caches; the caller measures the next request"""
+        self.assertEqual(self.client.get(url, data).status_code, 200)
+
+    def test_trip_list_first_page(self):
+        url = reverse('trip_list')
+        self.get_warm(url)
+        with self.assertFirestoreBudget(round_trips=3, reads=50):
+            response = self.client.get(url)
+        page = response.context['page_obj']
+        self.assertEqual(page.paginator.count, 60)
+        self.assertEqual(len(page), 15)
+        self.assertEqual(page[0]['id'], 'TR059')
+        self.assertEqual(page[0]['driver_name'], 'Driver 4')
+        self.assertEqual(page[0]['start_terminal_name'], 'Terminal 2')
+
+    def test_trip_list_next_page(self):
+        url = reverse('trip_list')
+        self.get_warm(url)
+        with self.assertFirestoreBudget(round_trips=3, reads=50):
+            response = self.client.get(url, {'page': 2})
+        self.assertEqual(response.context['page_obj'][0]['id'], 'TR044')
+
+    def test_trip_list_filtered(self):
+        url = reverse('trip_list')
+        params = {'status': 'completed', 'driver': 'D1'}
+        self.get_warm(url, params)
+        with self.assertFirestoreBudget(round_trips=3, reads=50):
+            response = self.client.get(url, params)
+        trips = list(response.context['page_obj'])
+        self.assertEqual(len(trips), 8)
+        self.assertTrue(all(trip['driver_id'] == 'D1' and trip['status'] == 'completed' for trip in trips))
+
+    def test_trip_list_driver_name_search(self):
+        url = reverse('trip_list')
+        params = {'driver_name': 'driver 3'}
+        self.get_warm(url, params)
+        with self.assertFirestoreBudget(round_trips=3, reads=50):
+            response = self.client.get(url, params)
+        self.assertEqual({trip['driver_id'] for trip in response.context['page_obj']}, {'D3'})
+
+    def test_terminal_and_driver_lists(self):
+        for name in ('terminal_list', 'driver_list'):
+            self.get_warm(reverse(name))
+            with self.assertFirestoreBudget(round_trips=0):
+                self.client.get(reverse(name))
+
+    def test_api_trip_details(self):
+        with self.assertFirestoreBudget(round_trips=4, reads=4, writes=0):
+            response = self.client.get(reverse('api_trip_details', args=['TR010']))
+        self.assertEqual(response.json()['driver']['name'], 'Driver 0')
+
+    def test_api_nearest_terminals(self):
+        url = reverse('api_nearest_terminals')
+        params = {'lat': 8.0, 'lng': 124.0, 'k': 2}
+        self.get_warm(url, params)
+        with self.assertFirestoreBudget(round_trips=0):
+            response = self.client.get(url, params)
+        self.assertEqual([t['terminal_id'] for t in response.json()['terminals']], ['T0', 'T1'])
+
+
+class MetricsTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=5)
+
+    def test_thread_shards_are_summed(self):
+        counter = metrics.Counter('test_events_total', 'Test events', ('kind',))
+        self.addCleanup(metrics._registry.remove, counter)
+        workers = [threading.Thread(target=lambda: [counter.inc('a') for _ in range(100)]) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        counter.inc('b', amount=2)
+        self.assertEqual(counter.values(), {('a',): 400, ('b',): 2})
+
+    def test_shards_of_finished_threads_are_folded(self):
+        counter = metrics.Counter('test_requests_total', 'Test requests', ('view',))
+        histogram = metrics.Histogram('test_request_seconds', 'Test latency', ('view',), buckets=(1.0,))
+        self.addCleanup(metrics._registry.remove, counter)
+        self.addCleanup(metrics._registry.remove, histogram)
+
+        def handle_request():
+            counter.inc('home')
+            histogram.observe(0.5, 'home')
+
+        # Thread per request, as under runserver
+        for _ in range(50):
+            worker = threading.Thread(target=handle_request)
+            worker.start()
+            worker.join()
+        del worker
+        self.assertEqual(counter._shards, [])
+        self.assertEqual(histogram._shards, [])
+        self.assertEqual(counter.values(), {('home',): 50})
+        self.assertEqual(histogram.values(), {('home',): ([50, 0], 25.0)})
+
+    def test_histogram_exposition(self):
+        histogram = metrics.Histogram('test_latency_seconds', 'Test latency', ('view',), buckets=(0.1, 1.0))
+        self.addCleanup(metrics._registry.remove, histogram)
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, 'home')
+        self.assertEqual(histogram.render()[2:], [
+            'test_latency_seconds_bucket{view="home",le="0.1"} 2',
+            'test_latency_seconds_bucket{view="home",le="1"} 3',
+            'test_latency_seconds_bucket{view="home",le="+Inf"} 4',
+            'test_latency_seconds_sum{view="home"} 3.65',
+            'test_latency_seconds_count{view="home"} 4',
+        ])
+
+    def test_firestore_operations_and_cache_lookups_are_counted(self):
+        reads = metrics.firestore_documents_read.values().get(('query', 'drivers'), 0)
+        misses = metrics.cache_requests.values().get(('firebase:drivers', 'miss'), 0)
+        hits = metrics.cache_requests.values().get(('firebase:drivers', 'hit'), 0)
+        firebase_service.get_all_drivers()
+        firebase_service.get_all_drivers()
+        self.assertEqual(metrics.firestore_documents_read.values()[('query', 'drivers')], reads + 5)
+        self.assertEqual(metrics.cache_requests.values()[('firebase:drivers', 'miss')], misses + 1)
+        self.assertEqual(metrics.cache_requests.values()[('firebase:drivers', 'hit')], hits + 1)
+
+    def test_failed_operations_are_counted(self):
+        with self.assertRaises(Exception):
+            firebase_service.db.collection('trips').document('missing').update({'status': 'completed'})
+        self.assertGreaterEqual(metrics.firestore_errors.values()[('write', 'trips', 'NotFound')], 1)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('login'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_requests_total{view="login",method="GET",status="200"}', body)
+
+    def test_metrics_endpoint_is_restricted(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, 403)
+
+
+class ServerTimingTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=5)
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+
+    def timings(self, response):
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            entries[name] = dict(param.split('=', 1) for param in params)
+        return entries
+
+    def test_html_view_reports_firestore_and_template_time(self):
+        response = self.client.get(reverse('trip_list'))
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'firestore', 'template', 'serialize', 'app', 'total'})
+        self.assertRegex(timings['firestore']['desc'], r'^"\d+ round trips / \d+ reads / 0 writes"$')
+        self.assertGreater(float(timings['template']['dur']), 0)
+
+    def test_api_view_reports_serialization(self):
+        with self.settings(DEBUG=True):
+            response = self.client.get(reverse('api_trip_details', args=['TR001']))
+        cost = json.loads(response['X-Request-Cost'])
+        self.assertEqual((cost['firestore']['round_trips'], cost['firestore']['reads']), (4, 4))
+        self.assertEqual({op['collection'] for op in cost['firestore']['operations']},
+                         {'trips', 'drivers', 'terminals'})
+        self.assertIn('serialize', self.timings(response))
+
+    def test_cost_summary_is_debug_only(self):
+        with self.settings(DEBUG=False):
+            response = self.client.get(reverse('api_trip_details', args=['TR001']))
+        self.assertIn('Server-Timing', response)
+        self.assertNotIn('X-Request-Cost', response)
+
+    def test_breakdown_adds_up(self):
+        cost = RequestCost()
+        cost.started -= 0.030
+        cost.firestore_seconds, cost.template_seconds = 0.010, 0.005
+        timings = self.timings({'Server-Timing': cost.server_timing()})
+        self.assertEqual(timings['firestore']['dur'], '10.0')
+        self.assertEqual(timings['template']['dur'], '5.0')
+        parts = sum(float(timings[name]['dur']) for name in ('firestore', 'template', 'serialize', 'app'))
+        self.assertAlmostEqual(parts, float(timings['total']['dur']), delta=0.2)
+
+
+class SlowQueryLogTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=60)
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        self.log_path = os.path.join(log_dir.name, 'slow_queries.log')
+        overrides = self.settings(SLOW_QUERY_DOCUMENTS=15, SLOW_QUERY_MS=10000, SLOW_QUERY_LOG_PATH=self.log_path)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(setattr, slow_queries, '_handler', None)
+        slow_queries._handler = None
+
+    def tearDown(self):
+        if slow_queries._handler:
+            slow_queries._handler.close()
+        super().tearDown()
+
+    def test_large_query_is_logged_with_call_site(self):
+        firebase_service.get_trips_by_driver('D0')
+        self.assertEqual(list(slow_queries.read_log(self.log_path)), [])
+
+        self.client.get(reverse('api_active_trips'))
+        [record] = slow_queries.read_log(self.log_path)
+        self.assertEqual(record['reason'], ['large'])
+        self.assertEqual(record['method'], 'get_trips_by_status')
+        self.assertEqual((record['collection'], record['documents']), ('trips', 20))
+        self.assertEqual(record['filters'], [['status', '==']])
+        self.assertEqual(record['view'], 'api_active_trips')
+        self.assertRegex(record['caller'], r'^monitoring/api_views\.py:\d+ in ')
+
+    def test_filter_values_are_not_logged(self):
+        firebase_service.db.collection('trips').where('driver_id', '<=', 'secret-value').get()
+        [record] = slow_queries.read_log(self.log_path)
+        self.assertEqual(record['filters'], [['driver_id', '<=']])
+        with open(self.log_path) as log_file:
+            self.assertNotIn('secret-value', log_file.read())
+
+    def test_top_queries_groups_by_shape(self):
+        for _ in range(3):
+            firebase_service.get_all_trips()
+        firebase_service.db.collection('trips').where('passengers', '>=', 0).get()
+        output = StringIO()
+        call_command('top_queries', log=self.log_path, sort='count', stdout=output)
+        report = output.getvalue()
+        self.assertIn('4 logged operations in 2 query shapes', report)
+        self.assertIn('1. query trips order by created_at desc', report)
+        self.assertIn('FirebaseService.get_all_trips', report)
+        self.assertIn('3x, 180 documents', report)
+
+
+class ReadBudgetTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=30)
+        self.firestore.seed('trips', {f'A{i}': {'status': 'in_progress', 'driver_id': 'D0'} for i in range(10)})
+        self.url = reverse('api_active_trips')
+
+    def budgets(self, reads, mode):
+        return self.settings(FIRESTORE_READ_BUDGETS={'api_active_trips': {'reads': reads, 'mode': mode}})
+
+    def test_within_budget(self):
+        with self.budgets(100, 'strict'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()['count'], 20)
+
+    def test_warn_mode_logs_and_counts(self):
+        before = budgets.budget_exceeded.values().get(('api_active_trips', 'warn'), 0)
+        with self.budgets(5, 'warn'), self.assertLogs('monitoring.budgets', 'WARNING') as logs:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('api_active_trips: 20 reads > 5', logs.output[0])
+        self.assertEqual(budgets.budget_exceeded.values()[('api_active_trips', 'warn')], before + 1)
+
+    def test_strict_mode_raises_under_tests(self):
+        with self.budgets(5, 'strict'), self.assertRaises(budgets.ReadBudgetExceeded):
+            self.client.get(self.url)
+
+    def test_strict_mode_only_raises_when_enabled(self):
+        with self.budgets(5, 'strict'), self.settings(FIRESTORE_READ_BUDGET_RAISE=False), \
+                self.assertLogs('monitoring.budgets', 'WARNING'):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_trip_list_stays_within_its_budget_when_cold(self):
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+        self.assertEqual(self.client.get(reverse('trip_list')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('trip_list'), {'status': 'completed', 'driver': 'D1'}).status_code,
+                         200)
+
+    def test_shed_mode_serves_last_good_response(self):
+        with self.budgets(50, 'shed'):
+            self.assertEqual(self.client.get(self.url).json()['count'], 20)
+            # A burst of new trips pushes the view over budget once...
+            self.firestore.seed('trips', {f'B{i}': {'status': 'in_progress'} for i in range(40)})
+            with self.assertLogs('monitoring.budgets', 'WARNING'):
+                self.assertEqual(self.client.get(self.url).json()['count'], 60)
+            # ...then it is served from the last within-budget response without reads
+            with self.assertFirestoreBudget(round_trips=0):
+                response = self.client.get(self.url)
+        self.assertEqual(response['X-Read-Budget'], 'shed')
+        self.assertEqual(response.json()['count'], 20)
+
+    def test_decorator_budget(self):
+        self.assertEqual(budgets.view_budget('api_trip_details', api_views.get_trip_details),
+                         {'reads': 4, 'round_trips': 4, 'mode': 'strict'})
+        with self.settings(FIRESTORE_READ_BUDGETS={'api_trip_details': {'mode': 'shed'}}):
+            self.assertEqual(budgets.view_budget('api_trip_details', api_views.get_trip_details)['mode'], 'shed')
+
+
+class LazyInitializationTests(TestCase):
+    def test_importing_the_app_loads_no_sdk(self):
+        script = (
+            "import sys, django; django.setup(); import monitoring.urls, monitoring.driver_import; "
+            "print(sorted(m for m in ('firebase_admin', 'google.cloud.firestore', 'grpc', 'cloudinary', "
+            "'openpyxl', 'reportlab', 'numpy') if m in sys.modules))"
+        )
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                env=dict(os.environ, DJANGO_SETTINGS_MODULE='MobileFleet.settings'))
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_client_is_recreated_after_fork(self):
+        saved_db, saved_lock = firebase_service._db, FirebaseService._init_lock
+        created = []
+
+        def initialize():
+            created.append(object())
+            firebase_service._db = created[-1]
+
+        try:
+            firebase_service._reset_after_fork()
+            self.assertIsNot(FirebaseService._init_lock, saved_lock)
+            with mock.patch.object(firebase_service, '_initialize_firebase', side_effect=initialize):
+                self.assertIs(firebase_service.db, firebase_service.db)
+            self.assertEqual(len(created), 1)
+        finally:
+            firebase_service._db, FirebaseService._init_lock = saved_db, saved_lock
+
+
+class ChannelPoolTests(TestCase):
+    def setUp(self):
+        previous = channels._current_pool
+        self.addCleanup(setattr, channels, '_current_pool', previous)
+        self.pool = channels.ClientPool(OfflineFirestore, 2)
+        for client in self.pool.clients:
+            client.seed('trips', {'TR1': {'status': 'completed'}})
+
+    def test_threads_are_pinned_round_robin(self):
+        picks = {}
+
+        def work(name):
+            picks[name] = [self.pool.client() for _ in range(3)]
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for clients in picks.values():
+            self.assertEqual(len({id(client) for client in clients}), 1)
+        used = [id(clients[0]) for clients in picks.values()]
+        self.assertEqual(sorted(used.count(id(client)) for client in self.pool.clients), [2, 2])
+
+    def test_operations_are_counted_per_channel(self):
+        db = InstrumentedClient(self.pool)
+        channel = str(self.pool.channel_index())
+        before = channels.channel_operations.values().get((channel,), 0)
+        db.collection('trips').document('TR1').get()
+        list(db.collection('trips').stream())
+        self.assertEqual(channels.channel_operations.values()[(channel,)], before + 2)
+        rendered = metrics.render()
+        self.assertIn('firestore_channel_pool_size 2', rendered)
+        self.assertIn(f'firestore_channel_threads{{channel="{channel}"}}', rendered)
+
+    def test_channels_keep_alive_while_idle(self):
+        options = dict(channels.channel_options())
+        self.assertEqual(options['grpc.keepalive_permit_without_calls'], 1)
+        self.assertEqual(options['grpc.client_idle_timeout_ms'], channels.NEVER)
+
+
+class ResilienceTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=5)
+        overrides = self.settings(FIRESTORE_RETRY_BASE_SECONDS=0, FIRESTORE_READ_RETRIES=2,
+                                  FIRESTORE_BREAKER_FAILURES=3, FIRESTORE_BREAKER_RESET_SECONDS=30)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def flaky(self, failures):
+        """Patch OfflineQuery.stream to fail `failures` times before working"""
+        stream = OfflineQuery.stream
+        calls = []
+
+        def patched(query, **kwargs):
+            calls.append(kwargs)
+            if len(calls) <= failures:
+                raise ServiceUnavailable('unavailable')
+            return stream(query, **kwargs)
+        return mock.patch.object(OfflineQuery, 'stream', patched), calls
+
+    def test_reads_get_a_deadline_and_no_sdk_retries(self):
+        patch, calls = self.flaky(0)
+        with patch, self.settings(FIRESTORE_DEADLINE_SECONDS=2.5):
+            firebase_service.get_trips_by_status('completed')
+        self.assertEqual(calls, [{'timeout': 2.5, 'retry': None}])
+
+    def test_transient_read_errors_are_retried(self):
+        patch, calls = self.flaky(2)
+        with patch, self.assertLogs('monitoring.resilience', 'WARNING'), self.assertNumFirestoreRoundTrips(3):
+            trips = firebase_service.get_trips_by_status('completed')
+        self.assertEqual(len(trips), 3)
+        self.assertEqual(len(calls), 3)
+        self.assertFalse(resilience.breaker.is_open)
+
+    def test_writes_are_not_retried(self):
+        with mock.patch('monitoring.testing.OfflineDocument.set', side_effect=ServiceUnavailable('down')) as write:
+            self.assertIsNone(firebase_service.create_terminal({'name': 'New', 'latitude': 8.0, 'longitude': 124.0}))
+        self.assertEqual(write.call_count, 1)
+
+    def test_non_transient_errors_do_not_trip_the_breaker(self):
+        for _ in range(5):
+            with self.assertRaises(NotFound):
+                firebase_service.db.collection('trips').document('missing').update({'status': 'x'})
+        self.assertFalse(resilience.breaker.is_open)
+
+    def test_breaker_opens_fails_fast_and_recovers(self):
+        patch, calls = self.flaky(3)
+        with patch, self.assertLogs('monitoring.resilience', 'WARNING'):
+            self.assertEqual(firebase_service.get_trips_by_status('completed'), [])
+            self.assertTrue(resilience.breaker.is_open)
+            with self.assertNumFirestoreRoundTrips(0):
+                self.assertEqual(firebase_service.get_trips_by_status('completed'), [])
+            self.assertEqual(len(calls), 3)
+
+            # After the reset timeout one probe goes through and closes the breaker
+            resilience.breaker.opened_at -= 30
+            self.assertEqual(len(firebase_service.get_trips_by_status('completed')), 3)
+        self.assertFalse(resilience.breaker.is_open)
+
+    def test_cached_reads_fall_back_to_last_good_copy(self):
+        terminals = firebase_service.get_all_terminals()
+        self.assertEqual(len(terminals), 3)
+        firebase_service._invalidate_terminals()
+        patch, _ = self.flaky(10)
+        with patch, self.assertLogs('monitoring', 'WARNING'):
+            self.assertEqual(firebase_service.get_all_terminals(), terminals)
+
+    def test_degraded_banner_and_header(self):
+        User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.login(username='admin', password='secret')
+        response = self.client.get(reverse('terminal_list'))
+        self.assertNotIn('X-Firestore-Degraded', response)
+        self.assertNotContains(response, 'data-firestore-degraded')
+
+        firebase_service._invalidate_terminals()
+        patch, _ = self.flaky(10)
+        with patch, self.assertLogs('monitoring', 'WARNING'):
+            response = self.client.get(reverse('terminal_list'))
+        self.assertEqual(response['X-Firestore-Degraded'], '1')
+        self.assertContains(response, 'data-firestore-degraded')
+
+
+class StaleWhileRevalidateTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=60)
+
+    def expire(self, key):
+        value, _ = cache.get(key)
+        cache.set(key, (value, time.time() - 1), 600)
+
+    def test_stale_value_is_served_while_one_refresh_runs(self):
+        terminals = firebase_service.get_all_terminals()
+        self.firestore.seed('terminals', {'T9': {'terminal_id': 'T9', 'name': 'Terminal 9'}})
+        self.expire(TERMINALS_CACHE_KEY)
+        before = metrics.cache_refreshes.values().get((TERMINALS_CACHE_KEY, 'ok'), 0)
+
+        with self.assertNumFirestoreRoundTrips(0):
+            self.assertEqual(firebase_service.get_all_terminals(), terminals)
+            self.assertEqual(firebase_service.get_all_terminals(), terminals)
+        firebase_service._refreshes[TERMINALS_CACHE_KEY].result(timeout=5)
+
+        self.assertEqual(metrics.cache_refreshes.values()[(TERMINALS_CACHE_KEY, 'ok')], before + 1)
+        with self.assertNumFirestoreRoundTrips(0):
+            self.assertEqual(len(firebase_service.get_all_terminals()), 4)
+
+    def test_writes_are_not_served_stale(self):
+        firebase_service.get_all_terminals()
+        self.expire(TERMINALS_CACHE_KEY)
+        firebase_service.create_terminal({'name': 'New', 'latitude': 8.5, 'longitude': 124.5})
+        self.assertEqual(len(firebase_service.get_all_terminals()), 4)
+
+    def test_slow_refresh_does_not_overwrite_newer_data(self):
+        old = firebase_service.get_all_terminals()
+        self.expire(TERMINALS_CACHE_KEY)
+        stale_entry = cache.get(TERMINALS_CACHE_KEY)
+        # While a refresh is still loading, a write invalidates the key and a request reloads it
+        firebase_service.create_terminal({'name': 'New', 'latitude': 8.5, 'longitude': 124.5})
+        self.assertEqual(len(firebase_service.get_all_terminals()), 4)
+
+        firebase_service._refresh(TERMINALS_CACHE_KEY, stale_entry, lambda: old, 300, 900)
+        self.assertEqual(len(firebase_service.get_all_terminals()), 4)
+
+    def test_dashboard_counts_use_count_aggregations(self):
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+        self.client.get(reverse('home'))
+        with self.assertFirestoreBudget(round_trips=1, reads=10):
+            response = self.client.get(reverse('home'))
+        self.assertEqual((response.context['active_trips'], response.context['completed_trips']), (20, 40))
+
+        self.expire(DASHBOARD_COUNTS_CACHE_KEY)
+        with self.assertFirestoreBudget(round_trips=1, reads=10):
+            self.client.get(reverse('home'))
+        firebase_service._refreshes[DASHBOARD_COUNTS_CACHE_KEY].result(timeout=5)
+
+
+class PassengerDeltaTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.firestore.seed('trips', {
+            'TR1': {'trip_id': 'TR1', 'status': 'in_progress', 'passengers': 3},
+            'TR2': {'trip_id': 'TR2', 'status': 'completed', 'passengers': 9},
+        })
+
+    def post(self, trip_id, body):
+        return self.client.post(reverse('api_passengers_delta', args=[trip_id]), json.dumps(body),
+                                content_type='application/json')
+
+    def test_delta_is_one_write_and_returns_the_new_count(self):
+        self.assertEqual(self.post('TR1', {'delta': 2}).json()['passengers'], 5)
+        # The trip's version is now known, so a tap is a single conditional write
+        with self.assertFirestoreBudget(round_trips=1, reads=0, writes=1):
+            response = self.post('TR1', {'delta': -1})
+        self.assertEqual(response.json(), {'success': True, 'trip_id': 'TR1', 'passengers': 4, 'coalesced': 1})
+        self.assertEqual(firebase_service.get_trip('TR1')['passengers'], 4)
+
+    def test_concurrent_deltas_are_coalesced(self):
+        results = []
+        barrier = threading.Barrier(5)
+
+        def tap(delta):
+            barrier.wait()
+            results.append(passengers.apply_passenger_delta('TR1', delta))
+
+        with mock.patch.object(passengers, 'PASSENGER_DELTA_WINDOW', 0.3), \
+                mock.patch.object(firebase_service, 'increment_trip_passengers',
+                                  wraps=firebase_service.increment_trip_passengers) as increment:
+            threads = [threading.Thread(target=tap, args=(delta,)) for delta in (1, 1, 1, -1, 1)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        increment.assert_called_once_with('TR1', 3)
+        self.assertEqual(results, [(6, None, 5)] * 5)
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.post('TR1', {'delta': 0}).status_code, 400)
+        self.assertEqual(self.post('TR1', {'delta': True}).status_code, 400)
+        self.assertEqual(self.post('TR1', {'delta': 500}).status_code, 400)
+        self.assertEqual(self.post('TR2', {'delta': 1}).json()['error'], 'Trip is not active')
+        self.assertEqual(self.post('missing', {'delta': 1}).status_code, 404)
+        self.assertEqual(firebase_service.get_trip('TR2')['passengers'], 9)
+
+    def test_count_does_not_go_below_zero(self):
+        self.assertEqual(self.post('TR1', {'delta': -5}).json()['passengers'], 0)
+        self.assertEqual(self.post('TR1', {'delta': -1}).json()['passengers'], 0)
+        self.assertEqual(firebase_service.get_trip('TR1')['passengers'], 0)
+
+    def test_trip_completed_by_another_worker_is_not_changed(self):
+        self.assertEqual(self.post('TR1', {'delta': 1}).status_code, 200)
+        # Another worker completes the trip; this process's cached copy still says in_progress
+        self.firestore.collection('trips').document('TR1').update({'status': 'completed'})
+        response = self.post('TR1', {'delta': 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Trip is not active')
+        self.assertEqual(firebase_service.get_trip('TR1')['passengers'], 4)
+
+
+class ConditionalTripUpdateTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        trip = {'driver_id': 'DR1', 'start_terminal': 'T1', 'destination_terminal': 'T2',
+                'created_at': datetime(2024, 5, 1, 8, 0), 'start_time': datetime(2024, 5, 1, 8, 5)}
+        self.firestore.seed('trips', {
+            'TR1': {**trip, 'trip_id': 'TR1', 'status': 'in_progress', 'passengers': 3},
+            'TR2': {**trip, 'trip_id': 'TR2', 'status': 'cancelled', 'passengers': 0},
+        })
+
+    def post(self, name, trip_id, body):
+        return self.client.post(reverse(name, args=[trip_id]), json.dumps(body),
+                                content_type='application/json')
+
+    def concurrent_update(self, trip_id, update_data):
+        """A write from another worker, bypassing this process's caches"""
+        self.firestore.collection('trips').document(trip_id).update(update_data)
+
+    def test_stop_trip_reads_once_and_does_not_read_back(self):
+        with self.assertFirestoreBudget(round_trips=2, reads=1, writes=1):
+            response = self.post('api_stop_trip', 'TR1', {'passengers': 7})
+        trip = response.json()['trip']
+        self.assertEqual((trip['status'], trip['passengers']), ('completed', 7))
+        self.assertIn('arrival_time', trip)
+        self.assertEqual(firebase_service.get_trip('TR1')['status'], 'completed')
+
+    def test_known_version_skips_the_read(self):
+        firebase_service.get_trip('TR1')
+        with self.assertNumFirestoreRoundTrips(1):
+            response = self.post('api_update_passengers', 'TR1', {'passengers': 5})
+        self.assertEqual(response.json()['trip']['passengers'], 5)
+        # The write result's version is cached, so the next update is one write too
+        with self.assertNumFirestoreRoundTrips(1):
+            response = self.post('api_stop_trip', 'TR1', {})
+        self.assertEqual(response.json()['trip']['passengers'], 5)
+
+    def test_concurrent_completion_is_not_overwritten(self):
+        firebase_service.get_trip('TR1')
+        self.concurrent_update('TR1', {'status': 'completed', 'passengers': 8})
+        response = self.post('api_update_passengers', 'TR1', {'passengers': 4})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Trip is not active')
+        self.assertEqual(firebase_service.get_trip('TR1')['passengers'], 8)
+        self.assertEqual(self.post('api_stop_trip', 'missing', {}).status_code, 404)
+
+    def test_write_racing_the_update_is_kept(self):
+        seen = []
+
+        def changes(trip):
+            seen.append(trip.get('notes'))
+            if len(seen) == 1:
+                self.concurrent_update('TR1', {'notes': 'delayed'})
+            return {'passengers': trip['passengers'] + 1}
+
+        conflicts = metrics.firestore_conditional_updates.values().get(('conflict',), 0)
+        trip, error = firebase_service.update_trip_if('TR1', 'in_progress', changes)
+        self.assertIsNone(error)
+        self.assertEqual(seen, [None, 'delayed'])
+        self.assertEqual((trip['notes'], trip['passengers']), ('delayed', 4))
+        self.assertEqual(firebase_service.get_trip('TR1')['notes'], 'delayed')
+        self.assertEqual(metrics.firestore_conditional_updates.values()[('conflict',)], conflicts + 1)
+
+    def test_trip_card_status_transitions(self):
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+        url = reverse('trip_update_status', args=['TR1'])
+        with self.assertFirestoreBudget(round_trips=2, reads=1, writes=1):
+            response = self.client.post(url, {'status': 'completed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['trip']['status'], 'completed')
+        self.assertIsNotNone(response.context['trip']['arrival_time'])
+        # A second click (or a second admin) cannot complete or cancel it again
+        response = self.client.post(url, {'status': 'cancelled'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(firebase_service.get_trip('TR1')['status'], 'completed')
+        response = self.client.post(reverse('trip_update_status', args=['TR2']), {'status': 'in_progress'})
+        self.assertEqual(response.context['trip']['status'], 'in_progress')
+
+
+class TripDriverIdIndexTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=10)
+
+    def stored_ids(self):
+        return set(self.firestore.collection('meta').document('trip_driver_ids').get().to_dict()['driver_ids'])
+
+    def test_trip_writes_add_new_driver_ids(self):
+        firebase_service.create_trip({'driver_id': 'N1', 'status': 'in_progress'})
+        firebase_service.update_trip('TR001', {'driver_id': 'N2'})
+        trip, error = firebase_service.update_trip_if('TR000', 'in_progress', {'driver_id': 'N3'})
+        self.assertIsNone(error)
+        self.assertEqual(self.stored_ids(), {'D0', 'D1', 'D2', 'D3', 'D4', 'N1', 'N2', 'N3'})
+        self.assertEqual(firebase_service.get_trip_driver_ids(), self.stored_ids())
+
+    def test_known_driver_ids_are_not_written_again(self):
+        firebase_service.get_trip_driver_ids()
+        with FirestoreCounter() as counter:
+            firebase_service.update_trip('TR001', {'driver_id': 'D2'})
+        self.assertEqual(counter.writes, 1)
+
+    def test_unknown_ids_become_dropdown_placeholders_without_a_scan(self):
+        self.firestore.seed('meta', {'trip_driver_ids': {'driver_ids': ['D0', 'D1', 'DRV001']}})
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+        url = reverse('trip_list')
+        self.client.get(url)
+        with mock.patch.object(firebase_service, 'get_all_trips', side_effect=AssertionError('trip scan')), \
+                self.assertFirestoreBudget(round_trips=3, reads=50):
+            response = self.client.get(url)
+        names = {driver['driver_id']: driver['name'] for driver in response.context['drivers']}
+        self.assertEqual(names['DRV001'], 'Unknown Driver (DRV001)')
+        self.assertEqual(names['D1'], 'Driver 1')
+        self.assertEqual(len(names), 6)
+
+    def test_canonicalize_rebuilds_the_index(self):
+        self.firestore.seed('trips', {'LEGACY': {'driver_id': 'Driver1@Example.com', 'status': 'completed'}})
+        self.firestore.seed('meta', {'trip_driver_ids': {'driver_ids': ['Driver1@Example.com', 'GONE']}})
+        call_command('canonicalize_driver_ids', stdout=StringIO())
+        self.assertEqual(firebase_service.get_trip('LEGACY')['driver_id'], 'D1')
+        self.assertEqual(self.stored_ids(), {'D0', 'D1', 'D2', 'D3', 'D4'})
+        self.assertEqual(firebase_service.get_trip_driver_ids(), self.stored_ids())
+
+
+class RouteAnalyticsTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=0)
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+        rng = random.Random(36)
+        started = timezone.make_aware(datetime(2025, 1, 6, 6, 0))
+        # (origin, destination, duration in seconds or None, passengers)
+        self.trips = (
+            [('T0', 'T1', rng.uniform(600, 3600), rng.randint(0, 12)) for _ in range(40)]
+            + [('T1', 'T2', 1234.5, 7)]
+            + [('T2', 'T0', 900, 3), ('T2', 'T0', None, 5), ('T2', 'T0', 1500, 1)]
+            + [('T1', 'T0', None, 2)]
+        )
+        Trip.objects.bulk_create(
+            Trip(trip_id=f'R{i:03d}', driver_id='D0', start_terminal=origin, destination_terminal=destination,
+                 passengers=passengers, start_time=started + timedelta(hours=i),
+                 arrival_time=None if duration is None else started + timedelta(hours=i, seconds=duration),
+                 status='completed')
+            for i, (origin, destination, duration, passengers) in enumerate(self.trips)
+        )
+        Trip.objects.create(trip_id='RUNNING', driver_id='D0', start_terminal='T0', destination_terminal='T1',
+                            start_time=started, status='in_progress')
+
+    def test_matches_numpy_per_route(self):
+        arrays, routes = analytics.load_trip_arrays()
+        stats = analytics.route_duration_stats(arrays['start'], arrays['arrival'], arrays['route'],
+                                               arrays['passengers'], len(routes))
+        self.assertEqual(len(routes), 4)
+        for code, route in enumerate(routes):
+            trips = [(duration, passengers) for origin, destination, duration, passengers in self.trips
+                     if (origin, destination) == route]
+            durations = [duration for duration, _ in trips if duration is not None]
+            self.assertEqual((stats['trips'][code], stats['timed_trips'][code]), (len(trips), len(durations)))
+            self.assertAlmostEqual(stats['passengers_per_trip'][code], np.mean([p for _, p in trips]))
+            if not durations:
+                self.assertTrue(all(np.isnan(stats[key][code]) for key in ('mean', 'p50', 'p90', 'p99')))
+                continue
+            self.assertAlmostEqual(stats['mean'][code], np.mean(durations), places=6)
+            for q in (50, 90, 99):
+                self.assertAlmostEqual(stats[f'p{q}'][code], np.percentile(durations, q), places=6,
+                                       msg=(route, q))
+
+    def test_single_and_untimed_trips(self):
+        stats = {(row['start_terminal'], row['destination_terminal']): row for row in analytics.compute_route_stats()}
+        single = stats[('T1', 'T2')]
+        self.assertEqual({single[key] for key in ('mean_minutes', 'median_minutes', 'p90_minutes', 'p99_minutes')},
+                         {20.57})
+        self.assertEqual((stats[('T2', 'T0')]['trips'], stats[('T2', 'T0')]['timed_trips']), (3, 2))
+        untimed = stats[('T1', 'T0')]
+        self.assertEqual((untimed['timed_trips'], untimed['median_minutes'], untimed['passengers_per_trip']),
+                         (0, None, 2))
+
+    def test_empty_table(self):
+        Trip.objects.all().delete()
+        self.assertEqual(analytics.compute_route_stats(), [])
+        response = self.client.get(reverse('api_route_analytics'))
+        self.assertEqual(response.json()['routes'], [])
+
+    def test_api_filters_and_names_routes(self):
+        response = self.client.get(reverse('api_route_analytics'), {'terminal': 'T2'})
+        routes = response.json()['routes']
+        self.assertEqual([(r['start_terminal_name'], r['destination_terminal_name']) for r in routes],
+                         [('Terminal 2', 'Terminal 0')])
+        response = self.client.get(reverse('api_route_analytics'), {'min_trips': 2})
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(self.client.get(reverse('api_route_analytics'), {'min_trips': 'x'}).status_code, 400)
+
+
+class ODMatrixTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=0)
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+        self.count = 0
+
+    def complete(self, day, origin, destination, passengers):
+        self.count += 1
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(minutes=self.count)
+        self.assertTrue(record_trip_completion({
+            'id': f'OD{self.count}', 'status': 'completed', 'start_terminal': origin,
+            'destination_terminal': destination, 'passengers': passengers,
+            'start_time': start, 'arrival_time': start + timedelta(minutes=30),
+        }))
+
+    def cell(self, matrix, origin, destination):
+        return (int(matrix.trips[matrix.index[origin], matrix.index[destination]]),
+                int(matrix.passengers[matrix.index[origin], matrix.index[destination]]))
+
+    def test_window_sums_closed_days_and_today(self):
+        self.complete(self.yesterday, 'T0', 'T1', 4)
+        self.complete(self.yesterday, 'T1', 'T2', 2)
+        self.complete(self.today, 'T0', 'T1', 3)
+        matrix = od_matrix.window_matrix(self.yesterday, self.today, terminals=['T2', 'T1', 'T0'])
+
+        self.assertEqual(matrix.terminals, ['T2', 'T1', 'T0'])
+        self.assertEqual(self.cell(matrix, 'T0', 'T1'), (2, 7))
+        self.assertEqual(self.cell(matrix, 'T1', 'T2'), (1, 2))
+        totals = TripRollup.objects.filter(granularity='day').aggregate(Sum('trip_count'), Sum('passenger_sum'))
+        self.assertEqual((matrix.trips.sum(), matrix.passengers.sum()),
+                         (totals['trip_count__sum'], totals['passenger_sum__sum']))
+        # Only the closed day is materialized
+        self.assertEqual(list(ODSnapshot.objects.values_list('day', flat=True)), [self.yesterday])
+
+    def test_late_completion_replaces_the_snapshot(self):
+        self.complete(self.yesterday, 'T0', 'T1', 4)
+        od_matrix.window_matrix(self.yesterday, self.yesterday)
+        self.assertEqual(ODSnapshot.objects.get().trips, [[0, 1], [0, 0]])
+
+        self.complete(self.yesterday, 'T1', 'T0', 6)
+        self.assertFalse(ODSnapshot.objects.exists())
+        matrix = od_matrix.window_matrix(self.yesterday, self.yesterday)
+        self.assertEqual(self.cell(matrix, 'T1', 'T0'), (1, 6))
+        self.assertEqual(ODSnapshot.objects.get().trips, [[0, 1], [1, 0]])
+
+    def test_adding_matrices_aligns_terminals_by_id(self):
+        total = od_matrix.ODMatrix(['A', 'B'])
+        total.add('A', 'B', 2, 5)
+        other = od_matrix.ODMatrix(['C', 'B', 'A'])
+        other.add('B', 'A', 1, 1)
+        other.add('A', 'B', 3, 3)
+        other.add('C', 'A', 1, 4)
+        total.add_matrix(other)
+        self.assertEqual(total.terminals, ['A', 'B', 'C'])
+        self.assertEqual(self.cell(total, 'A', 'B'), (5, 8))
+        self.assertEqual(self.cell(total, 'B', 'A'), (1, 1))
+        self.assertEqual(self.cell(total, 'C', 'A'), (1, 4))
+        self.assertEqual(total.trips.sum(), 7)
+
+    def test_rebuild_clears_snapshots(self):
+        self.complete(self.yesterday, 'T0', 'T1', 4)
+        od_matrix.window_matrix(self.yesterday, self.yesterday)
+        self.assertTrue(ODSnapshot.objects.exists())
+        rollups.rebuild_rollups([])
+        self.assertFalse(ODSnapshot.objects.exists())
+
+    def test_api_returns_the_named_matrix(self):
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+        self.complete(self.yesterday, 'T0', 'T1', 4)
+        self.complete(self.today, 'T1', 'T0', 1)
+        response = self.client.get(reverse('api_od_matrix'), {'start': self.yesterday.isoformat()})
+        data = response.json()
+        self.assertEqual((data['total_trips'], data['total_passengers']), (2, 5))
+        self.assertEqual([t['name'] for t in data['terminals']], ['Terminal 0', 'Terminal 1', 'Terminal 2'])
+        self.assertEqual(self.client.get(reverse('api_od_matrix'), {'start': 'x'}).status_code, 400)
+
+
+class DriverAliasTests(FirestoreTestMixin, TestCase):
+    def test_changed_email_resolves_to_the_driver(self):
+        driver_id = firebase_service.create_driver({'name': 'Ana', 'email': 'ana@example.com'})
+        self.assertEqual(firebase_service.canonical_driver_id('ANA@example.com'), driver_id)
+
+        self.assertTrue(firebase_service.update_driver(driver_id, {'email': 'ana.cruz@example.com'}))
+        self.assertEqual(firebase_service.canonical_driver_id('ana.cruz@example.com'), driver_id)
+        self.assertEqual(firebase_service.canonical_driver_id('ana@example.com'), driver_id)
+
+    def test_other_updates_leave_the_aliases_alone(self):
+        driver_id = firebase_service.create_driver({'name': 'Ana', 'email': 'ana@example.com'})
+        with FirestoreCounter() as counter:
+            firebase_service.update_driver(driver_id, {'contact': '0917'})
+        self.assertEqual(counter.writes, 1)
+
+
+class TripRollupTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=3)
+
+    def post(self, name, trip_id, body):
+        return self.client.post(reverse(name, args=[trip_id]), json.dumps(body),
+                                content_type='application/json')
+
+    def test_only_the_completion_is_counted(self):
+        self.assertEqual(self.post('api_update_passengers', 'TR000', {'passengers': 4}).status_code, 200)
+        self.assertFalse(TripRollup.objects.exists())
+        self.assertFalse(Trip.objects.exists())
+
+        self.assertEqual(self.post('api_stop_trip', 'TR000', {'passengers': 9}).status_code, 200)
+        rollup = TripRollup.objects.get(granularity='day')
+        self.assertEqual((rollup.trip_count, rollup.passenger_sum, rollup.duration_count), (1, 9, 1))
+        self.assertEqual((rollup.start_terminal, rollup.destination_terminal), ('T0', 'T1'))
+        self.assertEqual(Trip.objects.get(trip_id='TR000').passengers, 9)
+
+    def test_trips_that_are_not_completed_are_ignored(self):
+        trip = {**firebase_service.get_trip('TR000'), 'id': 'TR000'}
+        self.assertFalse(record_trip_completion(trip))
+        self.assertFalse(TripRollup.objects.exists())
+
+    def completed(self, trip_id, minutes):
+        trip = {**firebase_service.get_trip(trip_id), 'id': trip_id, 'status': 'completed'}
+        trip['arrival_time'] = trip['start_time'] + timedelta(minutes=minutes)
+        return trip
+
+    def test_a_completion_reported_twice_is_counted_once(self):
+        trip = self.completed('TR001', 20)
+        self.assertTrue(record_trip_completion(trip))
+        self.assertFalse(record_trip_completion(trip))
+        self.assertEqual(list(TripRollup.objects.values_list('granularity', 'trip_count', 'passenger_sum')
+                              .order_by('granularity')), [('day', 1, 1), ('hour', 1, 1)])
+
+    def test_series_buckets_by_local_time(self):
+        record_trip_completion(self.completed('TR001', 20))
+        record_trip_completion(self.completed('TR002', 40))
+        start = timezone.make_aware(datetime(2025, 1, 6))
+        series = rollups.rollup_series('day', start, start + timedelta(days=1))
+        self.assertEqual(series, [{'bucket_start': '2025-01-06T00:00:00+08:00', 'trip_count': 2,
+                                   'passenger_sum': 3, 'avg_duration_minutes': 30}])
+        by_route = rollups.rollup_series('hour', start, start + timedelta(days=1), group_by='route')
+        self.assertEqual([(row['bucket_start'], row['start_terminal'], row['destination_terminal'])
+                          for row in by_route],
+                         [('2025-01-06T14:00:00+08:00', 'T1', 'T2'), ('2025-01-06T14:00:00+08:00', 'T2', 'T0')])
+
+    def test_rebuild_matches_incremental_recording(self):
+        trips = [self.completed('TR001', 20), self.completed('TR002', 40)]
+        for trip in trips:
+            record_trip_completion(trip)
+        fields = ('granularity', 'bucket_start', 'start_terminal', 'destination_terminal', 'trip_count',
+                  'passenger_sum', 'duration_sum_seconds', 'duration_count')
+        recorded = sorted(TripRollup.objects.values_list(*fields))
+        self.assertEqual(rollups.rebuild_rollups(trips), (2, 4))
+        self.assertEqual(sorted(TripRollup.objects.values_list(*fields)), recorded)
+        # The ledger is rebuilt too, so a late duplicate is still ignored
+        self.assertFalse(record_trip_completion(trips[0]))
+
+
+class TerminalQRJobTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+        with mock.patch.object(utils, 'upload_to_cloudinary') as upload, \
+                mock.patch.object(tasks, 'generate_and_upload_qr') as generate:
+            response = self.client.post(reverse('terminal_create'),
+                                        {'name': 'North Pier', 'latitude': '8.5', 'longitude': '124.6'})
+        self.assertRedirects(response, reverse('terminal_list'))
+        upload.assert_not_called()
+        generate.assert_not_called()
+        self.terminal_id = firebase_service.get_all_terminals()[0]['id']
+        self.queued = Job.objects.get(name='upload_terminal_qr')
+
+    def run_queued(self):
+        Job.objects.filter(pk=self.queued.pk, status='queued').update(run_at=timezone.now())
+        return jobs.run_job(jobs.claim_next_job('test-worker'))
+
+    def qr_cell(self):
+        return self.client.get(reverse('terminal_list')).content.decode()
+
+    def test_create_leaves_the_terminal_pending(self):
+        self.assertEqual(self.queued.payload, {'terminal_id': self.terminal_id, 'terminal_name': 'North Pier'})
+        self.assertEqual(firebase_service.get_terminal(self.terminal_id)['qr_status'], 'pending')
+        self.assertIn('Generating...', self.qr_cell())
+
+    def test_job_sets_the_qr_url(self):
+        url = 'https://res.cloudinary.com/demo/qr.png'
+        with mock.patch.object(tasks, 'generate_and_upload_qr', return_value=url) as generate:
+            self.assertEqual(self.run_queued(), 'succeeded')
+        generate.assert_called_once_with(self.terminal_id, 'North Pier')
+        terminal = firebase_service.get_terminal(self.terminal_id)
+        self.assertEqual((terminal['qr_code_url'], terminal['qr_status']), (url, 'ready'))
+        self.assertIn(url, self.qr_cell())
+
+    def test_failing_upload_retries_then_shows_failed(self):
+        with mock.patch.object(tasks, 'generate_and_upload_qr', return_value=None):
+            claimed = jobs.claim_next_job('test-worker')
+            self.assertEqual(jobs.run_job(claimed), 'queued')
+            self.assertGreater(Job.objects.get(pk=self.queued.pk).run_at,
+                               timezone.now() + timedelta(seconds=jobs.RETRY_BASE_DELAY - 1))
+            self.assertIn('Generating...', self.qr_cell())
+            statuses = [self.run_queued() for _ in range(self.queued.max_attempts - 1)]
+        self.assertEqual(statuses[-1], 'dead')
+        self.assertEqual(Job.objects.get(pk=self.queued.pk).attempts, self.queued.max_attempts)
+        self.assertEqual(firebase_service.get_terminal(self.terminal_id)['qr_status'], 'failed')
+        self.assertIn('QR failed', self.qr_cell())
+
+
+class DriverAuthJobTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('driver@example.com', 'driver@example.com', 's3cret-pass')
+        self.driver_id = firebase_service.create_driver({'name': 'Ana', 'email': 'driver@example.com',
+                                                         'auth_status': 'pending', 'django_user_id': self.user.id})
+        self.queued = tasks.enqueue_driver_auth_user(self.driver_id, 'driver@example.com', 's3cret-pass', 'Ana',
+                                                     django_user_id=self.user.id)
+
+    def run_queued(self):
+        return jobs.run_job(jobs.claim_next_job('test-worker'))
+
+    def test_password_is_never_stored_in_plain_text(self):
+        payload = Job.objects.get(pk=self.queued.pk).payload
+        self.assertNotIn('password', payload)
+        self.assertNotIn('s3cret-pass', json.dumps(payload))
+        self.assertEqual(tasks.open_password(payload['password_token']), 's3cret-pass')
+
+        with mock.patch.object(firebase_service, 'create_auth_user', return_value='UID1') as create:
+            self.assertEqual(self.run_queued(), 'succeeded')
+        create.assert_called_once_with('driver@example.com', 's3cret-pass', 'Ana')
+        self.assertNotIn('password_token', Job.objects.get(pk=self.queued.pk).payload)
+        self.assertEqual(firebase_service.get_driver(self.driver_id)['auth_status'], 'ready')
+
+    def test_taken_email_dead_letters_at_once(self):
+        from firebase_admin import auth
+
+        error = auth.EmailAlreadyExistsError('taken', None, None)
+        with mock.patch.object(firebase_service, 'create_auth_user', side_effect=error):
+            self.assertEqual(self.run_queued(), 'dead')
+        self.assertEqual(Job.objects.get(pk=self.queued.pk).attempts, 1)
+        self.assertEqual(firebase_service.get_driver(self.driver_id)['auth_status'], 'failed')
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+
+    def test_migration_seals_passwords_the_tasks_can_open(self):
+        migration = importlib.import_module('monitoring.migrations.0005_seal_job_passwords')
+        self.assertEqual(tasks.open_password(migration.seal_password('s3cret-pass')), 's3cret-pass')
+
+    def test_expired_token_cannot_be_used(self):
+        token = Job.objects.get(pk=self.queued.pk).payload['password_token']
+        with mock.patch.object(tasks, 'PASSWORD_TOKEN_TTL', -1):
+            with self.assertRaises(jobs.PermanentJobError):
+                tasks.open_password(token)
+
+
+class DriverImportTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=0, drivers=1)
+        self.rows = [
+            (2, {'name': 'Ana Cruz', 'email': 'Ana@example.com', 'password': 'secret1', 'contact': '',
+                 'license_number': 'L1'}),
+            (3, {'name': 'Ben', 'email': 'ben@example.com', 'password': '', 'contact': '', 'license_number': ''}),
+            (4, {'name': 'Old', 'email': 'driver0@example.com', 'password': 'secret1', 'contact': '',
+                 'license_number': ''}),
+            (5, {'name': 'Ana', 'email': 'ana@example.com', 'password': 'secret1', 'contact': '',
+                 'license_number': ''}),
+        ]
+
+    def test_creates_users_drivers_and_auth_accounts(self):
+        with mock.patch.object(firebase_service, 'import_auth_users', return_value={}) as imported:
+            report = driver_import.import_drivers(self.rows, default_password='default1')
+        self.assertEqual([entry['status'] for entry in report], ['created', 'created', 'skipped', 'skipped'])
+        self.assertEqual([user['uid'] for user in imported.call_args.args[0]],
+                         [report[0]['driver_id'], report[1]['driver_id']])
+
+        user = User.objects.get(username='ana@example.com')
+        self.assertEqual((user.first_name, user.last_name), ('Ana', 'Cruz'))
+        self.assertTrue(user.check_password('secret1'))
+        self.assertTrue(User.objects.get(username='ben@example.com').check_password('default1'))
+        driver = firebase_service.get_driver(report[0]['driver_id'])
+        self.assertEqual((driver['django_user_id'], driver['auth_status']), (user.id, 'ready'))
+
+    def test_failed_user_insert_rolls_back_auth_accounts(self):
+        with mock.patch.object(firebase_service, 'import_auth_users', return_value={}), \
+                mock.patch.object(firebase_service, 'delete_auth_users') as deleted, \
+                mock.patch.object(User.objects, 'bulk_create', side_effect=IntegrityError('duplicate username')):
+            report = driver_import.import_drivers(self.rows[:2], default_password='default1')
+        self.assertEqual([entry['status'] for entry in report], ['failed', 'failed'])
+        self.assertEqual(len(deleted.call_args.args[0]), 2)
+        self.assertEqual(len(firebase_service.get_all_drivers()), 1)
+
+    def test_dry_run_only_validates(self):
+        rows = self.rows + [(6, {'name': '', 'email': 'x@example.com', 'password': 'secret1', 'contact': '',
+                                 'license_number': ''})]
+        with mock.patch.object(firebase_service, 'import_auth_users') as imported:
+            report = driver_import.import_drivers(rows, dry_run=True)
+        imported.assert_not_called()
+        self.assertEqual([(entry['row'], entry['status']) for entry in report],
+                         [(2, 'valid'), (3, 'failed'), (4, 'skipped'), (5, 'skipped'), (6, 'failed')])
+        self.assertFalse(User.objects.exists())
+
+    def test_rows_rejected_by_auth_get_no_account(self):
+        with mock.patch.object(firebase_service, 'import_auth_users', return_value={0: 'EMAIL_EXISTS'}):
+            report = driver_import.import_drivers(self.rows[:2], default_password='default1')
+        self.assertEqual([entry['status'] for entry in report], ['failed', 'created'])
+        self.assertIn('EMAIL_EXISTS', report[0]['message'])
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['ben@example.com'])
+
+    def test_failed_driver_writes_roll_back_users_and_auth_accounts(self):
+        with mock.patch.object(firebase_service, 'import_auth_users', return_value={}), \
+                mock.patch.object(firebase_service, 'delete_auth_users') as deleted, \
+                mock.patch.object(firebase_service, 'batch_create_drivers', return_value=[]):
+            report = driver_import.import_drivers(self.rows[:2], default_password='default1')
+        self.assertEqual([entry['status'] for entry in report], ['failed', 'failed'])
+        self.assertEqual(len(deleted.call_args.args[0]), 2)
+        self.assertFalse(User.objects.exists())
+
+    def test_reads_csv_uploads(self):
+        upload = BytesIO('\ufeffName,Email,Password\nAna Cruz,ana@example.com,secret1\n,,\n'.encode())
+        rows = driver_import.read_driver_rows(upload, 'drivers.csv')
+        self.assertEqual(rows, [(2, {'name': 'Ana Cruz', 'email': 'ana@example.com', 'password': 'secret1',
+                                     'contact': '', 'license_number': ''})])
+
+
+class TripExportTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=12)
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+
+    def test_streams_every_page_newest_first(self):
+        with FirestoreCounter() as counter:
+            trips = list(firebase_service.iter_trips(page_size=5))
+        self.assertEqual([trip['id'] for trip in trips], [f'TR{i:03d}' for i in range(11, -1, -1)])
+        self.assertEqual(counter.round_trips, 3)
+
+    def test_csv_applies_the_list_filters(self):
+        response = self.client.get(reverse('trip_export_csv'),
+                                   {'status': 'completed', 'driver': 'D1'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(exports.TRIP_EXPORT_FIELDS))
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['TR011', 'TR001'])
+        self.assertIn('Driver 1', lines[1])
+        self.assertIn('Terminal 2', lines[1])
+
+    def test_ndjson_date_range_includes_the_end_day(self):
+        response = self.client.get(reverse('trip_export_ndjson'),
+                                   {'start': '2025-01-06', 'end': '2025-01-06'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 12)
+        self.assertTrue(rows[-1]['created_at'].startswith('2025-01-06T06:00:00'))
+        response = self.client.get(reverse('trip_export_ndjson'), {'start': '2025-01-07'})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_bad_dates_are_rejected(self):
+        self.assertEqual(self.client.get(reverse('trip_export_csv'), {'end': '06/01/2025'}).status_code, 400)
+
+
+class TerminalIndexTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(geo, '_index', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def brute_force(self, terminals, lat, lng, k):
+        distances = sorted((haversine_m(lat, lng, t['latitude'], t['longitude']), t['terminal_id'])
+                           for t in terminals)
+        return [terminal_id for _, terminal_id in distances[:k]]
+
+    def test_matches_a_brute_force_search(self):
+        rng = random.Random(38)
+        terminals = [{'terminal_id': f'T{i}', 'latitude': rng.uniform(-60, 60), 'longitude': rng.uniform(-180, 180)}
+                     for i in range(300)]
+        index = geo.TerminalIndex(terminals)
+        # Includes points across the antimeridian and near the poles
+        for lat, lng in [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(50)] + [(0, 179.9), (89, 0)]:
+            nearest = index.nearest(lat, lng, k=5)
+            self.assertEqual([t['terminal_id'] for t, _ in nearest], self.brute_force(terminals, lat, lng, 5))
+            self.assertEqual([distance for _, distance in nearest], sorted(distance for _, distance in nearest))
+
+    def test_skips_inactive_terminals_and_bad_coordinates(self):
+        index = geo.TerminalIndex([
+            {'terminal_id': 'A', 'latitude': 8.0, 'longitude': 124.0},
+            {'terminal_id': 'B', 'latitude': 8.0, 'longitude': 124.0, 'is_active': False},
+            {'terminal_id': 'C', 'latitude': 'x', 'longitude': 124.0},
+            {'terminal_id': 'D', 'latitude': 95.0, 'longitude': 124.0},
+        ])
+        self.assertEqual(len(index), 1)
+        self.assertEqual([t['terminal_id'] for t, _ in index.nearest(0, 0, k=3)], ['A'])
+        self.assertEqual(geo.TerminalIndex([]).nearest(0, 0), [])
+
+    def test_rebuilt_after_terminal_writes(self):
+        seed_fleet(self.firestore, trips=0)
+        self.assertEqual(geo.nearest_terminals(8.5, 124.5)[0][0]['terminal_id'], 'T2')
+        with self.assertFirestoreBudget(round_trips=0):
+            geo.nearest_terminals(8.5, 124.5)
+        terminal_id = firebase_service.create_terminal({'name': 'Pier', 'latitude': 8.5, 'longitude': 124.5})
+        terminal, distance = geo.nearest_terminals(8.5, 124.5)[0]
+        self.assertEqual((terminal['terminal_id'], distance), (terminal_id, 0))
+
+
+class GeohashCoverageTests(FirestoreTestMixin, TestCase):
+    def test_encode_matches_the_reference(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        # Prefixes are the enclosing cells
+        self.assertEqual(geohash.encode(8.0, 124.0, 5), geohash.encode(8.0, 124.0)[:5])
+
+    def test_ranges_cover_every_point_in_the_circle(self):
+        rng = random.Random(39)
+        for lat, lng, radius in [(8.0, 124.0, 500), (8.0, 124.0, 20000), (0.0, 179.99, 3000),
+                                 (-33.9, 18.4, 150000), (85.0, 10.0, 50000)]:
+            ranges = geohash.covering_ranges(lat, lng, radius)
+            self.assertTrue(0 < len(ranges) <= geohash.MAX_COVERING_CELLS)
+            for _ in range(200):
+                # A random point inside the circle
+                bearing, fraction = rng.uniform(0, 2 * math.pi), math.sqrt(rng.random()) * 0.999
+                dlat = radius * fraction * math.cos(bearing) / geohash.METERS_PER_DEGREE
+                dlng = (radius * fraction * math.sin(bearing)
+                        / (geohash.METERS_PER_DEGREE * math.cos(math.radians(lat + dlat))))
+                point = (lat + dlat, (lng + dlng + 180.0) % 360.0 - 180.0)
+                if haversine_m(lat, lng, *point) > radius:
+                    continue
+                cell = geohash.encode(*point)
+                self.assertTrue(any(low <= cell <= high for low, high in ranges), (lat, lng, radius, point))
+
+    def test_huge_radius_has_no_ranges(self):
+        self.assertEqual(geohash.covering_ranges(0.0, 0.0, 20_000_000), [])
+
+    def test_terminals_within_matches_the_distance_filter(self):
+        rng = random.Random(39)
+        terminals = {}
+        for i in range(200):
+            lat, lng = 8.0 + rng.uniform(-0.2, 0.2), 124.0 + rng.uniform(-0.2, 0.2)
+            terminals[f'T{i}'] = {'terminal_id': f'T{i}', 'name': f'Terminal {i}', 'is_active': i % 10 != 0,
+                                  'latitude': lat, 'longitude': lng, 'geohash': geohash.encode(lat, lng)}
+        self.firestore.seed('terminals', terminals)
+        expected = sorted(
+            (haversine_m(8.0, 124.0, t['latitude'], t['longitude']), terminal_id)
+            for terminal_id, t in terminals.items()
+            if t['is_active'] and haversine_m(8.0, 124.0, t['latitude'], t['longitude']) <= 5000
+        )
+        with FirestoreCounter() as counter:
+            terminals = firebase_service.get_terminals_within(8.0, 124.0, 5000)
+        self.assertTrue(expected)
+        self.assertEqual([t['id'] for t in terminals], [terminal_id for _, terminal_id in expected])
+        self.assertLessEqual(counter.round_trips, geohash.MAX_COVERING_CELLS)
+        self.assertLess(counter.reads, 100)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.dead = []
+        jobs.job('test_echo', scrub=('secret',))(lambda **payload: self.calls.append(payload))
+        self.addCleanup(jobs._handlers.pop, 'test_echo')
+        jobs.job('test_fail', max_attempts=2, on_dead=lambda **payload: self.dead.append(payload),
+                 scrub=('secret',))(self.fail_job)
+        self.addCleanup(jobs._handlers.pop, 'test_fail')
+
+    def fail_job(self, **payload):
+        raise RuntimeError('remote unavailable')
+
+    def test_each_job_is_claimed_once_and_only_when_due(self):
+        later = jobs.enqueue('test_echo', {'n': 1}, delay=60)
+        due = jobs.enqueue('test_echo', {'n': 2})
+        claimed = jobs.claim_next_job('worker-a')
+        self.assertEqual((claimed.pk, claimed.status, claimed.locked_by), (due.pk, 'running', 'worker-a'))
+        self.assertIsNone(jobs.claim_next_job('worker-b'))
+        self.assertEqual(Job.objects.get(pk=later.pk).status, 'queued')
+
+    def test_success_scrubs_the_payload(self):
+        queued = jobs.enqueue('test_echo', {'n': 1, 'secret': 'x'})
+        self.assertEqual(jobs.run_job(jobs.claim_next_job('worker')), 'succeeded')
+        self.assertEqual(self.calls, [{'n': 1, 'secret': 'x'}])
+        finished = Job.objects.get(pk=queued.pk)
+        self.assertEqual((finished.payload, finished.attempts, finished.locked_by), ({'n': 1}, 1, ''))
+        self.assertIsNotNone(finished.finished_at)
+
+    def test_failures_retry_with_backoff_then_dead_letter(self):
+        queued = jobs.enqueue('test_fail', {'secret': 'x'})
+        self.assertEqual(jobs.run_job(jobs.claim_next_job('worker')), 'queued')
+        retried = Job.objects.get(pk=queued.pk)
+        self.assertGreaterEqual(retried.run_at, timezone.now() + timedelta(seconds=jobs.RETRY_BASE_DELAY - 1))
+        self.assertIn('remote unavailable', retried.last_error)
+        # The payload is kept for the retry
+        self.assertEqual(retried.payload, {'secret': 'x'})
+        self.assertIsNone(jobs.claim_next_job('worker'))
+
+        Job.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        self.assertEqual(jobs.run_job(jobs.claim_next_job('worker')), 'dead')
+        self.assertEqual(self.dead, [{'secret': 'x'}])
+        dead = Job.objects.get(pk=queued.pk)
+        self.assertEqual((dead.attempts, dead.payload), (2, {}))
+
+    def test_permanent_errors_skip_the_retries(self):
+        def reject(**payload):
+            raise jobs.PermanentJobError('bad input')
+        jobs.job('test_reject')(reject)
+        self.addCleanup(jobs._handlers.pop, 'test_reject')
+        queued = jobs.enqueue('test_reject')
+        self.assertEqual(jobs.run_job(jobs.claim_next_job('worker')), 'dead')
+        self.assertEqual(Job.objects.get(pk=queued.pk).attempts, 1)
+
+    def test_unknown_jobs_are_dead_lettered(self):
+        jobs.enqueue('test_missing', max_attempts=1)
+        self.assertEqual(jobs.run_job(jobs.claim_next_job('worker')), 'dead')
+        self.assertIn('No handler registered', Job.objects.get().last_error)
+
+    def test_stale_jobs_are_requeued_unless_their_worker_is_alive(self):
+        lost = jobs.enqueue('test_echo', {'n': 1})
+        running = jobs.enqueue('test_echo', {'n': 2})
+        for queued in (lost, running):
+            self.assertIsNotNone(jobs.claim_next_job(f'worker-{queued.pk}'))
+        Job.objects.update(locked_at=timezone.now() - timedelta(seconds=jobs.VISIBILITY_TIMEOUT + 1))
+        # The live worker's heartbeat refreshes its lock
+        self.assertTrue(jobs.touch_job(Job.objects.get(pk=running.pk)))
+
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(Job.objects.get(pk=lost.pk).status, 'queued')
+        self.assertEqual(Job.objects.get(pk=running.pk).status, 'running')
+        # A worker whose job was requeued no longer holds it
+        self.assertFalse(jobs.touch_job(Job(pk=lost.pk, locked_by=f'worker-{lost.pk}')))
+
+    def test_heartbeat_touches_the_job_while_it_runs(self):
+        queued = jobs.enqueue('test_echo')
+        with mock.patch.object(jobs, 'touch_job', return_value=True) as touch:
+            with jobs.heartbeat(queued, interval=0.01):
+                time.sleep(0.1)
+            calls = touch.call_count
+            time.sleep(0.05)
+        self.assertGreater(calls, 1)
+        self.assertEqual(touch.call_count, calls)
+
+
+class DailyReportTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(reports, 'REPORT_DIR', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_report(self, day, built):
+        path = reports.daily_report_path(day)
+        with open(path, 'wb') as report:
+            report.write(b'%PDF-1.4')
+        os.utime(path, (built.timestamp(), built.timestamp()))
+
+    def test_past_day_built_during_the_day_is_rebuilt(self):
+        day = timezone.localdate() - timedelta(days=2)
+        start, end = reports.day_bounds(day)
+        self.write_report(day, start + timedelta(hours=10))
+        self.assertFalse(reports.is_report_fresh(day))
+        self.write_report(day, end + timedelta(minutes=1))
+        self.assertTrue(reports.is_report_fresh(day))
+
+    def seed_day(self):
+        seed_fleet(self.firestore, trips=6)
+        self.firestore.seed('trips', {
+            # 01:00 on Jan 6 in Manila
+            'TRX': {'trip_id': 'TRX', 'driver_id': 'D0', 'start_terminal': 'T0', 'destination_terminal': 'T2',
+                    'status': 'completed', 'passengers': 3, 'start_time': datetime(2025, 1, 5, 17, 0),
+                    'arrival_time': datetime(2025, 1, 5, 17, 30), 'created_at': datetime(2025, 1, 5, 17, 0)},
+            'TRY': {'trip_id': 'TRY', 'driver_id': 'D0', 'start_terminal': 'T0', 'destination_terminal': 'T1',
+                    'status': 'completed', 'passengers': 9, 'start_time': datetime(2025, 1, 6, 16, 0),
+                    'created_at': datetime(2025, 1, 6, 16, 0)},
+        })
+        for trip_id in ('TR001', 'TR002', 'TR004', 'TR005', 'TRX', 'TRY'):
+            self.assertTrue(record_trip_completion({**firebase_service.get_trip(trip_id), 'id': trip_id}))
+
+    def test_summary_covers_the_local_day(self):
+        self.seed_day()
+        with self.assertFirestoreBudget(round_trips=3):
+            summary = reports.compute_daily_summary(date(2025, 1, 6))
+        # Every trip created that day, but only completed trips below
+        self.assertEqual((summary['total_trips'], summary['completed_trips'], summary['total_passengers']),
+                         (7, 5, 15))
+        self.assertEqual(summary['avg_travel_minutes'], 30)
+        terminals = {row['name']: (row['departures'], row['arrivals']) for row in summary['terminals']}
+        self.assertEqual(terminals, {'Terminal 0': (1, 2), 'Terminal 1': (2, 0), 'Terminal 2': (2, 3)})
+        routes = {row['name']: (row['trips'], row['passengers']) for row in summary['routes']}
+        self.assertEqual(routes['Terminal 2 -> Terminal 0'], (2, 7))
+        self.assertEqual(summary['drivers'][0], {'name': 'Driver 0', 'trips': 2, 'passengers': 8})
+        self.assertEqual(sum(row['trips'] for row in summary['drivers']), 5)
+
+    def test_past_day_is_built_once(self):
+        self.seed_day()
+        day = date(2025, 1, 6)
+        path = reports.get_daily_report(day)
+        with open(path, 'rb') as report:
+            self.assertTrue(report.read().startswith(b'%PDF'))
+        with self.assertFirestoreBudget(round_trips=0):
+            self.assertEqual(reports.get_daily_report(day), path)
+        self.assertEqual(reports.build_daily_reports([day]), [])
+
+    def test_today_expires(self):
+        day = timezone.localdate()
+        self.write_report(day, timezone.now())
+        self.assertTrue(reports.is_report_fresh(day))
+        self.write_report(day, timezone.now() - timedelta(seconds=reports.TODAY_REPORT_MAX_AGE + 1))
+        self.assertFalse(reports.is_report_fresh(day))
+
+
+class TerminalQRImageTests(FirestoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        seed_fleet(self.firestore, trips=0)
+        self.client.force_login(User.objects.create_user('staff', 'staff@example.com', 'password'))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_dir = directory.name
+        patcher = mock.patch.object(utils, 'QR_CACHE_DIR', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        utils.render_qr_image.cache_clear()
+        self.addCleanup(utils.render_qr_image.cache_clear)
+
+    def test_image_is_private_to_the_browser(self):
+        response = self.client.get(reverse('terminal_qr_png', args=['T0']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_unknown_terminals_and_parameters_render_nothing(self):
+        self.assertEqual(self.client.get(reverse('terminal_qr_png', args=['nope'])).status_code, 404)
+        url = reverse('terminal_qr_svg', args=['T0'])
+        self.assertEqual(self.client.get(url, {'size': 7}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'border': 'x'}).status_code, 400)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        self.assertEqual(self.client.get(url, {'size': 20, 'border': 0}).status_code, 200)
+
+    def test_sheet_renders_in_process_and_keeps_reportlab_settings(self):
+        from reportlab import rl_config
+        use_a85 = rl_config.useA85
+        with mock.patch.object(utils, 'ProcessPoolExecutor', side_effect=AssertionError('pool started')):
+            response = self.client.get(reverse('terminal_qr_sheet'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(rl_config.useA85, use_a85)
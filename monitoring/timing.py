@@ -0,0 +1,156 @@
+"""
+Per-request cost accounting
+ServerTimingMiddleware opens a RequestCost for each request. Firestore
+operations (from the instrumentation listener), template rendering (the
+TimedDjangoTemplates backend) and JSON serialization (this module's
+JsonResponse) add to the cost of the request running on the current
+thread, and the middleware reports it in a Server-Timing header.
+"""
+
+import json
+import threading
+import time
+from django import http
+from django.core.serializers.json import DjangoJSONEncoder
+from django.template.backends.django import DjangoTemplates
+from .instrumentation import add_listener
+
+_state = threading.local()
+
+
+class RequestCost:
+    """Where the time of one request went"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # URL name of the view handling the request, once resolved
+        self.view = None
+        self.firestore_seconds = 0.0
+        self.round_trips = 0
+        self.reads = 0
+        self.writes = 0
+        self.template_seconds = 0.0
+        self.serialize_seconds = 0.0
+        # (kind, collection) -> [round trips, reads, writes, seconds]
+        self.collections = {}
+        # Set when a Firestore call failed or was rejected (see monitoring.resilience)
+        self.degraded = False
+
+    def add_operation(self, operation):
+        self.firestore_seconds += operation.duration
+        self.round_trips += 1
+        self.reads += operation.reads
+        self.writes += operation.writes
+        entry = self.collections.setdefault((operation.kind, operation.collection), [0, 0, 0, 0.0])
+        entry[0] += 1
+        entry[1] += operation.reads
+        entry[2] += operation.writes
+        entry[3] += operation.duration
+
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Server-Timing header value (durations in milliseconds)"""
+        total = self.total_seconds()
+        other = max(total - self.firestore_seconds - self.template_seconds - self.serialize_seconds, 0.0)
+        return ', '.join([
+            f'firestore;dur={self.firestore_seconds * 1000:.1f};'
+            f'desc="{self.round_trips} round trips / {self.reads} reads / {self.writes} writes"',
+            f'template;dur={self.template_seconds * 1000:.1f}',
+            f'serialize;dur={self.serialize_seconds * 1000:.1f}',
+            f'app;dur={other * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+    def summary(self):
+        """JSON-ready breakdown, including Firestore cost per operation and collection"""
+        return {
+            'total_ms': round(self.total_seconds() * 1000, 1),
+            'template_ms': round(self.template_seconds * 1000, 1),
+            'serialize_ms': round(self.serialize_seconds * 1000, 1),
+            'degraded': self.degraded,
+            'firestore': {
+                'ms': round(self.firestore_seconds * 1000, 1),
+                'round_trips': self.round_trips,
+                'reads': self.reads,
+                'writes': self.writes,
+                'operations': [
+                    {'kind': kind, 'collection': collection, 'round_trips': round_trips,
+                     'reads': reads, 'writes': writes, 'ms': round(seconds * 1000, 1)}
+                    for (kind, collection), (round_trips, reads, writes, seconds)
+                    in sorted(self.collections.items(), key=lambda item: -item[1][3])
+                ],
+            },
+        }
+
+
+def start_request():
+    """Begin accounting for the request on this thread"""
+    _state.cost = RequestCost()
+    return _state.cost
+
+
+def finish_request():
+    cost = getattr(_state, 'cost', None)
+    _state.cost = None
+    return cost
+
+
+def current_cost():
+    """The RequestCost of the request running on this thread, if any"""
+    return getattr(_state, 'cost', None)
+
+
+def _record_operation(operation):
+    cost = getattr(_state, 'cost', None)
+    if cost is not None:
+        cost.add_operation(operation)
+
+
+add_listener(_record_operation)
+
+
+class TimedTemplate:
+    """Backend template wrapper that adds its render time to the request cost"""
+
+    def __init__(self, template):
+        self._template = template
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self._template.render(context, request)
+        finally:
+            cost = current_cost()
+            if cost is not None:
+                cost.template_seconds += time.perf_counter() - started
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template backend that times top-level template renders"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class JsonResponse(http.JsonResponse):
+    """django.http.JsonResponse that adds its encoding time to the request cost"""
+
+    def __init__(self, data, encoder=DjangoJSONEncoder, safe=True, json_dumps_params=None, **kwargs):
+        started = time.perf_counter()
+        super().__init__(data, encoder, safe, json_dumps_params, **kwargs)
+        cost = current_cost()
+        if cost is not None:
+            cost.serialize_seconds += time.perf_counter() - started
+
+
+def cost_header(cost):
+    """Compact JSON of RequestCost.summary() for a response header"""
+    return json.dumps(cost.summary(), separators=(',', ':'))
@@ -9,17 +9,23 @@ urlpatterns = [
     # Dashboard
     path('', views.home, name='home'),
     path('firebase-config/', views.firebase_config, name='firebase_config'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('reports/daily/<str:date>.pdf', views.daily_report, name='daily_report'),
 
     # Terminal Management
     path('terminals/', views.terminal_list, name='terminal_list'),
     path('terminals/create/', views.terminal_create, name='terminal_create'),
+    path('terminals/qr-sheet.pdf', views.terminal_qr_sheet, name='terminal_qr_sheet'),
     path('terminals/<str:terminal_id>/', views.terminal_detail, name='terminal_detail'),
+    path('terminals/<str:terminal_id>/qr.png', views.terminal_qr_image, {'fmt': 'png'}, name='terminal_qr_png'),
+    path('terminals/<str:terminal_id>/qr.svg', views.terminal_qr_image, {'fmt': 'svg'}, name='terminal_qr_svg'),
     path('terminals/<str:terminal_id>/edit/', views.terminal_edit, name='terminal_edit'),
     path('terminals/<str:terminal_id>/delete/', views.terminal_delete, name='terminal_delete'),
 
     # Driver Management
     path('drivers/', views.driver_list, name='driver_list'),
     path('drivers/create/', views.driver_create, name='driver_create'),
+    path('drivers/import/', views.driver_import, name='driver_import'),
     path('drivers/<str:driver_id>/', views.driver_detail, name='driver_detail'),
     path('drivers/<str:driver_id>/edit/', views.driver_edit, name='driver_edit'),
     path('drivers/<str:driver_id>/delete/', views.driver_delete, name='driver_delete'),
@@ -27,6 +33,8 @@ urlpatterns = [
     # Trip Management
     path('trips/', views.trip_list, name='trip_list'),
     path('trips/create/', views.trip_create, name='trip_create'),
+    path('trips/export.csv', views.trip_export, {'fmt': 'csv'}, name='trip_export_csv'),
+    path('trips/export.ndjson', views.trip_export, {'fmt': 'ndjson'}, name='trip_export_ndjson'),
     path('trips/<str:trip_id>/', views.trip_detail, name='trip_detail'),
     path('trips/<str:trip_id>/update-status/', views.trip_update_status, name='trip_update_status'),
 ]
@@ -1,21 +1,60 @@
 import qrcode
-import cloudinary
-import cloudinary.uploader
+import qrcode.image.svg
 from django.conf import settings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from io import BytesIO
 import base64
+import hashlib
 import logging
+import multiprocessing
+import os
+import tempfile
+import threading
 
 logger = logging.getLogger(__name__)
 
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=settings.CLOUDINARY_CONFIG['cloud_name'],
-    api_key=settings.CLOUDINARY_CONFIG['api_key'],
-    api_secret=settings.CLOUDINARY_CONFIG['api_secret']
-)
+# Rendered QR images are cached in memory and on disk, keyed by payload and
+# rendering parameters, so each distinct image is only rasterized once.
+QR_CACHE_DIR = os.path.join(settings.MEDIA_ROOT, 'qr_cache')
+QR_IMAGE_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+# Rendering parameters the QR image endpoint accepts (each combination is a cached file)
+QR_IMAGE_SIZES = (5, 10, 20)
+QR_IMAGE_BORDERS = (0, 2, 4)
+# Rows shown per table in the daily fleet report
+REPORT_TABLE_LIMIT = 25
 
-def generate_qr_code(data, size=10, border=4):
+_cloudinary_uploader = None
+_cloudinary_lock = threading.Lock()
+# reportlab is imported inside the PDF renderers: utils is loaded with the
+# URLconf and most processes never build a PDF.
+# reportlab reads its settings from the process-wide rl_config while building
+_rl_config_lock = threading.Lock()
+
+
+def _cloudinary():
+    """cloudinary.uploader, imported and configured on the first upload"""
+    global _cloudinary_uploader
+    if _cloudinary_uploader is None:
+        with _cloudinary_lock:
+            if _cloudinary_uploader is None:
+                import cloudinary
+                import cloudinary.uploader
+
+                cloudinary.config(
+                    cloud_name=settings.CLOUDINARY_CONFIG['cloud_name'],
+                    api_key=settings.CLOUDINARY_CONFIG['api_key'],
+                    api_secret=settings.CLOUDINARY_CONFIG['api_secret']
+                )
+                _cloudinary_uploader = cloudinary.uploader
+    return _cloudinary_uploader
+
+
+def generate_qr_code(data, size=10, border=4, image_factory=None):
     """
     Generate QR code for given data
 
@@ -23,6 +62,7 @@ def generate_qr_code(data, size=10, border=4):
         data (str): Data to encode in QR code
         size (int): Size of QR code
         border (int): Border size
+        image_factory: qrcode image class (defaults to a PIL image)
 
     Returns:
         PIL.Image: QR code image
@@ -37,7 +77,10 @@ def generate_qr_code(data, size=10, border=4):
         qr.add_data(data)
         qr.make(fit=True)
 
-        img = qr.make_image(fill_color="black", back_color="white")
+        if image_factory:
+            img = qr.make_image(image_factory=image_factory)
+        else:
+            img = qr.make_image(fill_color="black", back_color="white")
         logger.info(f"QR code generated for data: {data[:50]}...")
         return img
     except Exception as e:
@@ -72,7 +115,7 @@ def upload_to_cloudinary(image, public_id=None, folder="qr_codes"):
         if public_id:
             upload_params['public_id'] = public_id
 
-        result = cloudinary.uploader.upload(img_buffer, **upload_params)
+        result = _cloudinary().upload(img_buffer, **upload_params)
         logger.info(f"Image uploaded to Cloudinary: {result.get('public_id')}")
         return result
     except Exception as e:
@@ -92,7 +135,7 @@ def generate_and_upload_qr(terminal_id, terminal_name):
     """
     try:
         # Generate QR code data (you can customize this format)
-        qr_data = f"terminal_id:{terminal_id}"
+        qr_data = terminal_qr_data(terminal_id)
 
         # Generate QR code
         qr_image = generate_qr_code(qr_data)
@@ -110,6 +153,253 @@ def generate_and_upload_qr(terminal_id, terminal_name):
         logger.error(f"Error generating and uploading QR code: {e}")
         return None
 
+def terminal_qr_data(terminal_id):
+    """Payload encoded in a terminal's QR code"""
+    return f"terminal_id:{terminal_id}"
+
+def qr_image_etag(data, fmt='png', size=10, border=4):
+    """
+    Cache key / ETag for a rendered QR image
+
+    The same value names the on-disk cache file, so it changes whenever
+    the payload or any rendering parameter changes.
+    """
+    key = f"{fmt}:{size}:{border}:{data}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def qr_image_cache_path(data, fmt='png', size=10, border=4):
+    """Path of the on-disk cache file for a rendered QR image"""
+    return os.path.join(QR_CACHE_DIR, f"{qr_image_etag(data, fmt, size, border)}.{fmt}")
+
+@lru_cache(maxsize=256)
+def render_qr_image(data, fmt='png', size=10, border=4):
+    """
+    Render a QR code to PNG or SVG bytes, using the on-disk cache
+
+    Args:
+        data (str): Data to encode
+        fmt (str): 'png' or 'svg'
+        size (int): Box size in pixels
+        border (int): Border size in boxes
+
+    Returns:
+        bytes: Encoded image
+
+    Raises:
+        ValueError: If the format is unknown or the QR code cannot be generated
+    """
+    if fmt not in QR_IMAGE_FORMATS:
+        raise ValueError(f"Unsupported QR image format: {fmt}")
+
+    path = qr_image_cache_path(data, fmt, size, border)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    image_factory = qrcode.image.svg.SvgPathImage if fmt == 'svg' else None
+    qr_image = generate_qr_code(data, size=size, border=border, image_factory=image_factory)
+    if not qr_image:
+        raise ValueError(f"Could not generate QR code for: {data[:50]}")
+
+    img_buffer = BytesIO()
+    if fmt == 'svg':
+        qr_image.save(img_buffer)
+    else:
+        qr_image.save(img_buffer, format='PNG')
+    content = img_buffer.getvalue()
+
+    # Write atomically so concurrent workers never serve a partial file
+    try:
+        os.makedirs(QR_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write QR cache file {path}: {e}")
+
+    return content
+
+def render_qr_pngs(payloads, workers=None, min_parallel=16):
+    """
+    Render many QR codes to PNG bytes, optionally rasterizing cache misses in a process pool
+
+    Args:
+        payloads (list): QR payload strings
+        workers (int): Pool size; None or 1 renders in-process (web requests must)
+        min_parallel (int): Below this many misses, render in-process
+
+    Returns:
+        list: PNG bytes in the same order as payloads
+    """
+    images = {}
+    missing = []
+    for data in dict.fromkeys(payloads):
+        if os.path.exists(qr_image_cache_path(data)):
+            images[data] = render_qr_image(data)
+        else:
+            missing.append(data)
+
+    if workers and workers > 1 and len(missing) >= min_parallel:
+        # Spawn rather than fork: the parent may hold gRPC channels and threads
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            chunksize = max(1, len(missing) // (workers * 4))
+            for data, content in zip(missing, executor.map(render_qr_image, missing, chunksize=chunksize)):
+                images[data] = content
+    else:
+        for data in missing:
+            images[data] = render_qr_image(data)
+
+    return [images[data] for data in payloads]
+
+def render_qr_sheet_pdf(terminals, output, columns=3, rows=4, workers=None):
+    """
+    Write an N-up printable PDF sheet of terminal QR codes
+
+    Args:
+        terminals (list): Terminal dicts with 'terminal_id' (or 'id') and 'name'
+        output: Writable binary file object
+        columns (int): QR codes per row
+        rows (int): Rows per page
+        workers (int): Process pool size for rasterization (None renders in-process)
+
+    Returns:
+        int: Number of QR codes written
+    """
+    terminal_ids = [t.get('terminal_id') or t.get('id') for t in terminals]
+    pngs = render_qr_pngs([terminal_qr_data(tid) for tid in terminal_ids], workers=workers)
+
+    # ASCII85 is pure Python without reportlab's C accelerators and dominates
+    # the render time for image-heavy sheets; binary streams are valid PDF.
+    with _rl_settings(useA85=0):
+        _draw_qr_sheet(terminals, terminal_ids, pngs, output, columns, rows)
+    return len(terminals)
+
+@contextmanager
+def _rl_settings(**overrides):
+    """
+    Apply reportlab settings for one document build and restore them afterwards
+
+    Builds are serialized because rl_config is shared by every thread.
+    """
+    from reportlab import rl_config
+
+    with _rl_config_lock:
+        saved = {name: getattr(rl_config, name) for name in overrides}
+        try:
+            for name, value in overrides.items():
+                setattr(rl_config, name, value)
+            yield
+        finally:
+            for name, value in saved.items():
+                setattr(rl_config, name, value)
+
+def _draw_qr_sheet(terminals, terminal_ids, pngs, output, columns, rows):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    page_width, page_height = A4
+    margin = 36
+    cell_width = (page_width - 2 * margin) / columns
+    cell_height = (page_height - 2 * margin) / rows
+    label_height = 28
+    qr_size = min(cell_width, cell_height - label_height) - 12
+
+    pdf = canvas.Canvas(output, pagesize=A4)
+    pdf.setTitle("Terminal QR Codes")
+    per_page = columns * rows
+    for index, (terminal, terminal_id, png) in enumerate(zip(terminals, terminal_ids, pngs)):
+        if index and index % per_page == 0:
+            pdf.showPage()
+        slot = index % per_page
+        x = margin + (slot % columns) * cell_width
+        y = page_height - margin - (slot // columns + 1) * cell_height
+
+        pdf.drawImage(ImageReader(BytesIO(png)), x + (cell_width - qr_size) / 2,
+                      y + label_height, width=qr_size, height=qr_size)
+        pdf.setFont("Helvetica-Bold", 10)
+        pdf.drawCentredString(x + cell_width / 2, y + 16, (terminal.get('name') or 'Unnamed Terminal')[:40])
+        pdf.setFont("Helvetica", 7)
+        pdf.drawCentredString(x + cell_width / 2, y + 6, terminal_id or '')
+    pdf.save()
+
+def _report_table(header, rows):
+    from reportlab.lib import colors
+    from reportlab.platypus import Table, TableStyle
+
+    table = Table([header] + rows[:REPORT_TABLE_LIMIT], repeatRows=1, hAlign='LEFT')
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#7c3aed')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f3f4f6')]),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#d1d5db')),
+    ]))
+    return table
+
+def render_daily_report_pdf(summary, output):
+    """
+    Render daily fleet figures (see reports.compute_daily_summary) as a PDF
+
+    Args:
+        summary (dict): Daily figures
+        output: Writable binary file object or path
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+    styles = getSampleStyleSheet()
+    doc = SimpleDocTemplate(output, pagesize=A4, title=f"Fleet Report {summary['date']}")
+    average = summary['avg_travel_minutes']
+
+    story = [
+        Paragraph(f"MobileFleet Daily Report — {summary['date']}", styles['Title']),
+        Paragraph(f"Generated {summary['generated_at']}", styles['Normal']),
+        Spacer(1, 12),
+        _report_table(['Summary', ''], [
+            ['Trips', summary['total_trips'] if summary['total_trips'] is not None else '—'],
+            ['Completed trips', summary['completed_trips']],
+            ['Passengers', summary['total_passengers']],
+            ['Average travel time', f"{average:.1f} min" if average is not None else '—'],
+        ]),
+    ]
+    sections = [
+        ('Trips per Terminal', ['Terminal', 'Departures', 'Arrivals'], 'terminals', ('departures', 'arrivals')),
+        ('Passengers per Route', ['Route', 'Trips', 'Passengers'], 'routes', ('trips', 'passengers')),
+        ('Driver Activity', ['Driver', 'Trips', 'Passengers'], 'drivers', ('trips', 'passengers')),
+    ]
+    for title, header, key, columns in sections:
+        story += [Spacer(1, 18), Paragraph(title, styles['Heading2'])]
+        if summary[key]:
+            story.append(_report_table(header, [[row['name']] + [row[c] for c in columns] for row in summary[key]]))
+        else:
+            story.append(Paragraph("No trips recorded.", styles['Normal']))
+
+    # Never while a QR sheet build has changed rl_config
+    with _rl_settings():
+        doc.build(story)
+
+def write_daily_report_pdf(summary, path):
+    """Render a daily report to a file atomically, so readers never see a partial PDF"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            render_daily_report_pdf(summary, output)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return path
+
 def get_qr_code_base64(data):
     """
     Generate QR code and return as base64 string for display
@@ -4,17 +4,43 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponse, Http404, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, condition
 from django.conf import settings
 import json
+from .driver_import import read_driver_rows, import_drivers
+from .exports import parse_export_filters, iter_trip_export, TRIP_EXPORT_CONTENT_TYPES
+from .reports import get_daily_report
+from .rollups import record_trip_completion
 from .firebase_service import firebase_service
-from .utils import generate_and_upload_qr, get_qr_code_base64
+from . import metrics
+from .timing import JsonResponse
+from .budgets import read_budget
+from .tasks import enqueue_terminal_qr_upload, enqueue_driver_auth_user
+from .utils import (
+    terminal_qr_data, qr_image_etag, render_qr_image, render_qr_sheet_pdf,
+    QR_IMAGE_FORMATS, QR_IMAGE_SIZES, QR_IMAGE_BORDERS,
+)
 import logging
+import tempfile
+from datetime import datetime, timedelta
+from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
+# QR images never change for a given payload, so let browsers keep them
+QR_IMAGE_MAX_AGE = 60 * 60 * 24 * 365
+# Dashboard O-D heat map: window length and number of busiest terminals shown
+DASHBOARD_OD_DAYS = 7
+DASHBOARD_OD_TERMINALS = 12
+# Reports for past days only change when rebuilt with build_daily_reports --force
+DAILY_REPORT_MAX_AGE = 60 * 60 * 24
+# Trip card status buttons: {new status: status the trip must have}
+TRIP_STATUS_TRANSITIONS = {'completed': 'in_progress', 'cancelled': 'in_progress', 'in_progress': 'cancelled'}
+
 def login_view(request):
     """User login view"""
     if request.user.is_authenticated:
@@ -47,8 +73,7 @@ def home(request):
         # Get summary statistics
         terminals = firebase_service.get_all_terminals()
         drivers = firebase_service.get_all_drivers()
-        active_trips = firebase_service.get_active_trips()
-        completed_trips = firebase_service.get_completed_trips()
+        trip_counts = firebase_service.get_dashboard_counts()
 
         # Get recent trips and resolve terminal names
         recent_trips = firebase_service.get_all_trips(limit=10)
@@ -66,13 +91,33 @@ def home(request):
             trip['start_terminal_name'] = terminal_map.get(start_terminal_id, start_terminal_id or 'Unknown')
             trip['destination_terminal_name'] = terminal_map.get(destination_terminal_id, destination_terminal_id or 'Unknown')
 
+        # Origin-destination heat map for the busiest terminals this week
+        # (imported here so loading the URLconf does not load numpy)
+        from .od_matrix import window_matrix, od_matrix_context
+
+        today = timezone.localdate()
+        od_matrix = window_matrix(today - timedelta(days=DASHBOARD_OD_DAYS - 1), today,
+                                  terminals=terminal_map).top(DASHBOARD_OD_TERMINALS)
+        od = od_matrix_context(od_matrix, terminal_map)
+        od_rows = [
+            {'name': terminal['name'], 'cells': [
+                {'trips': trips, 'passengers': passengers, 'level': level}
+                for trips, passengers, level in zip(od['trips'][i], od['passengers'][i], od['levels'][i])
+            ]}
+            for i, terminal in enumerate(od['terminals'])
+        ] if od['total_trips'] else []
+
         context = {
             'total_terminals': len(terminals),
             'total_drivers': len(drivers),
-            'active_trips': len(active_trips),
-            'completed_trips': len(completed_trips),
+            'active_trips': trip_counts['in_progress'],
+            'completed_trips': trip_counts['completed'],
             'recent_trips': recent_trips,
             'firebase_project_id': settings.FIREBASE_PROJECT_ID,
+            'report_date': (today - timedelta(days=1)).isoformat(),
+            'od_terminals': od['terminals'],
+            'od_rows': od_rows,
+            'od_days': DASHBOARD_OD_DAYS,
         }
         return render(request, 'monitoring/dashboard.html', context)
     except Exception as e:
@@ -81,6 +126,32 @@ def home(request):
         return render(request, 'monitoring/dashboard.html', {'error': str(e)})
 
 
+@login_required(login_url='login')
+@require_http_methods(["GET", "HEAD"])
+def daily_report(request, date):
+    """Serve the cached daily fleet PDF report, building it on first request"""
+    try:
+        day = datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        raise Http404("Invalid report date")
+    if day > timezone.localdate():
+        raise Http404("No report for a future date")
+
+    try:
+        path = get_daily_report(day)
+    except Exception as e:
+        logger.error(f"Error building fleet report for {day}: {e}")
+        messages.error(request, "Error generating the daily report")
+        return redirect('home')
+
+    response = FileResponse(open(path, 'rb'), filename=f"fleet-report-{day}.pdf",
+                            content_type='application/pdf')
+    if day < timezone.localdate():
+        patch_cache_control(response, private=True, max_age=DAILY_REPORT_MAX_AGE)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 @login_required(login_url='login')
 def firebase_config(request):
     """Provide Firebase configuration for frontend"""
@@ -97,6 +168,13 @@ def firebase_config(request):
     }
     return JsonResponse(config)
 
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """Prometheus scrape endpoint for this process's metrics"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 
 # Terminal Management Views
 @login_required(login_url='login')
@@ -139,16 +217,16 @@ def terminal_create(request):
                 'latitude': float(latitude) if latitude else None,
                 'longitude': float(longitude) if longitude else None,
                 'is_active': True,
+                'qr_status': 'pending',
             }
 
             # Create terminal in Firebase
             terminal_id = firebase_service.create_terminal(terminal_data)
 
             if terminal_id:
-                # Generate and upload QR code
-                qr_url = generate_and_upload_qr(terminal_id, name)
-                if qr_url:
-                    firebase_service.update_terminal(terminal_id, {'qr_code_url': qr_url})
+                # QR generation and upload happen in the background; the
+                # terminal gets its qr_code_url when the upload finishes
+                enqueue_terminal_qr_upload(terminal_id, name)
 
                 messages.success(request, f"Terminal '{name}' created successfully")
                 return redirect('terminal_list')
@@ -169,14 +247,12 @@ def terminal_detail(request, terminal_id):
             messages.error(request, "Terminal not found")
             return redirect('terminal_list')
 
-        # Generate QR code for display
-        qr_data = f"terminal_id:{terminal_id}"
-        qr_base64 = get_qr_code_base64(qr_data)
-
+        # The QR image is served (and HTTP-cached) by terminal_qr_image
         context = {
             'terminal': terminal,
             'terminal_id': terminal_id,
-            'qr_base64': qr_base64,
+            'qr_image_url': reverse('terminal_qr_png', args=[terminal_id]),
+            'qr_svg_url': reverse('terminal_qr_svg', args=[terminal_id]),
         }
         return render(request, 'monitoring/terminals/detail.html', context)
     except Exception as e:
@@ -184,6 +260,89 @@ def terminal_detail(request, terminal_id):
         messages.error(request, "Error loading terminal details")
         return redirect('terminal_list')
 
+def _qr_image_params(request, terminal_id, fmt):
+    """
+    Payload and rendering parameters for a terminal QR image request
+
+    Returns:
+        tuple: (data, fmt, size, border), or None if the format, size or
+               border is not one of the allowed values
+    """
+    try:
+        size = int(request.GET.get('size', 10))
+        border = int(request.GET.get('border', 4))
+    except ValueError:
+        return None
+    if fmt not in QR_IMAGE_FORMATS or size not in QR_IMAGE_SIZES or border not in QR_IMAGE_BORDERS:
+        return None
+    return terminal_qr_data(terminal_id), fmt, size, border
+
+def _terminal_exists(request, terminal_id):
+    """
+    Checked against the cached terminal list first; unknown IDs cost one read
+    (remembered on the request, which both the ETag function and the view ask)
+    """
+    if not hasattr(request, '_terminal_exists'):
+        request._terminal_exists = (
+            any(terminal.get('id') == terminal_id for terminal in firebase_service.get_all_terminals())
+            or firebase_service.get_terminal(terminal_id) is not None
+        )
+    return request._terminal_exists
+
+def _qr_image_etag(request, terminal_id, fmt):
+    params = _qr_image_params(request, terminal_id, fmt)
+    if params is None or not _terminal_exists(request, terminal_id):
+        return None
+    return qr_image_etag(*params)
+
+@login_required(login_url='login')
+@require_http_methods(["GET", "HEAD"])
+@condition(etag_func=_qr_image_etag)
+def terminal_qr_image(request, terminal_id, fmt):
+    """
+    Serve a terminal's QR code as PNG or SVG with long-lived caching headers
+    Only sizes in QR_IMAGE_SIZES and borders in QR_IMAGE_BORDERS are
+    rendered, so the on-disk image cache stays bounded.
+    """
+    if fmt not in QR_IMAGE_FORMATS:
+        raise Http404("Unknown image format")
+    params = _qr_image_params(request, terminal_id, fmt)
+    if params is None:
+        return HttpResponse(f"size must be one of {QR_IMAGE_SIZES} and border one of {QR_IMAGE_BORDERS}",
+                            status=400, content_type='text/plain')
+    if not _terminal_exists(request, terminal_id):
+        raise Http404("Terminal not found")
+
+    try:
+        content = render_qr_image(*params)
+    except ValueError as e:
+        logger.error(f"Error rendering QR image for terminal {terminal_id}: {e}")
+        return HttpResponse(status=500)
+
+    response = HttpResponse(content, content_type=QR_IMAGE_FORMATS[fmt])
+    # Behind a login, so only the user's own browser may keep it
+    patch_cache_control(response, private=True, max_age=QR_IMAGE_MAX_AGE, immutable=True)
+    return response
+
+@login_required(login_url='login')
+def terminal_qr_sheet(request):
+    """Download a printable PDF sheet with the QR codes of all active terminals"""
+    try:
+        terminals = [t for t in firebase_service.get_all_terminals() if t.get('is_active', True)]
+        terminals.sort(key=lambda t: (t.get('name') or '').lower())
+
+        # Spool to disk past a few MB so large sheets stream without being held in memory
+        output = tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024)
+        # Rendered in-process: a request must not spawn a process pool
+        render_qr_sheet_pdf(terminals, output)
+        output.seek(0)
+        return FileResponse(output, as_attachment=True, filename='terminal_qr_codes.pdf',
+                            content_type='application/pdf')
+    except Exception as e:
+        logger.error(f"Error generating QR sheet: {e}")
+        messages.error(request, "Error generating QR code sheet")
+        return redirect('terminal_list')
+
 @login_required(login_url='login')
 def terminal_edit(request, terminal_id):
     """Edit terminal"""
@@ -306,23 +465,15 @@ def driver_create(request):
                 messages.error(request, f"Failed to create user account: {str(e)}")
                 return render(request, 'monitoring/drivers/create.html')
 
-            # Create Firebase Auth user
-            auth_uid = firebase_service.create_auth_user(email, password, name)
-            
-            if not auth_uid:
-                # Delete the Django user if Firebase creation fails
-                user.delete()
-                messages.error(request, "Failed to create Firebase authentication. Email may already be in use.")
-                return render(request, 'monitoring/drivers/create.html')
-
-            # Create driver data with auth_uid and Django user id
+            # Create driver data with Django user id; the Firebase Auth user is
+            # created by a background job, which links auth_uid when it finishes
             driver_data = {
                 'name': name,
                 'email': email,
                 'contact': contact or '',
                 'license_number': license_number or '',
                 'is_active': True,
-                'auth_uid': auth_uid,  # Link to Firebase Auth
+                'auth_status': 'pending',
                 'django_user_id': user.id,  # Link to Django User
             }
 
@@ -330,7 +481,9 @@ def driver_create(request):
             driver_id = firebase_service.create_driver(driver_data)
 
             if driver_id:
-                messages.success(request, f"Driver '{name}' created successfully. Can now login with email: {email}")
+                enqueue_driver_auth_user(driver_id, email, password, name, django_user_id=user.id)
+                messages.success(request, f"Driver '{name}' created. The login account for {email} is pending "
+                                          f"and can be used once it has been set up.")
                 return redirect('driver_list')
             else:
                 # Delete user and log error if driver creation fails
@@ -342,6 +495,39 @@ def driver_create(request):
 
     return render(request, 'monitoring/drivers/create.html')
 
+@login_required(login_url='login')
+def driver_import(request):
+    """Bulk create drivers from an uploaded CSV or XLSX file"""
+    context = {}
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        dry_run = request.POST.get('dry_run') == 'on'
+        if not upload:
+            messages.error(request, "Please choose a CSV or XLSX file")
+            return render(request, 'monitoring/drivers/import.html')
+
+        try:
+            rows = read_driver_rows(upload, upload.name)
+            report = import_drivers(
+                rows,
+                default_password=request.POST.get('default_password') or None,
+                dry_run=dry_run,
+            )
+            summary = {}
+            for entry in report:
+                summary[entry['status']] = summary.get(entry['status'], 0) + 1
+
+            context = {'report': report, 'summary': summary, 'dry_run': dry_run}
+            if dry_run:
+                messages.info(request, f"Dry run: {summary.get('valid', 0)} of {len(report)} rows are ready to import")
+            else:
+                messages.success(request, f"Imported {summary.get('created', 0)} of {len(report)} drivers")
+        except Exception as e:
+            logger.error(f"Error importing drivers: {e}")
+            messages.error(request, f"Error importing drivers: {str(e)}")
+
+    return render(request, 'monitoring/drivers/import.html', context)
+
 @login_required(login_url='login')
 def driver_detail(request, driver_id):
     """View driver details"""
@@ -431,6 +617,11 @@ def driver_delete(request, driver_id):
 
 # Trip Management Views
 @login_required(login_url='login')
+# A warm request costs up to 3 round trips and ~20 reads (page count, one
+# page of trips). A cold one also loads the driver and terminal lists and the
+# driver alias/ID indexes (3 more round trips, one read per document, cached
+# for CACHE_TIMEOUT); the read headroom covers about 20 drivers plus terminals.
+@read_budget(reads=40, round_trips=6)
 def trip_list(request):
     """List all trips with filtering"""
     try:
@@ -439,7 +630,7 @@ def trip_list(request):
         driver_filter = request.GET.get('driver', '')
         # New: allow searching by driver name (partial match). This parameter
         # is used by the frontend keyup search. If provided, we'll resolve it
-        # to matching driver_ids or fall back to matching trip.driver_name.
+        # to the matching drivers' canonical IDs.
         driver_name_query = request.GET.get('driver_name', '').strip()
 
         # Get the current user's driver record to auto-filter their trips
@@ -448,17 +639,17 @@ def trip_list(request):
         auto_filter_driver = False
         
         # Try to find the driver associated with the current user
+        drivers = firebase_service.get_all_drivers()
+        # Trips reference drivers by their canonical (document) ID; see
+        # the canonicalize_driver_ids command for migrating legacy trips.
+        for driver in drivers:
+            driver['driver_id'] = driver.get('id') or driver.get('driver_id')
+
         try:
-            drivers = firebase_service.get_all_drivers()
+            user_email = current_user.email.lower()
             for driver in drivers:
-                # Normalize driver identifier for matching
-                normalized_id = driver.get('driver_id') or driver.get('id') or driver.get('auth_uid') or (driver.get('email') or '').lower()
-                # Ensure the driver record we keep has a normalized driver_id field
-                driver['driver_id'] = normalized_id
-
                 # Match by django_user_id or email
                 driver_email = driver.get('email', '').lower()
-                user_email = current_user.email.lower()
                 django_id = driver.get('django_user_id')
 
                 if django_id == current_user.id or driver_email == user_email:
@@ -466,77 +657,39 @@ def trip_list(request):
                     auto_filter_driver = True
                     # Auto-set driver filter if user is a driver and no filter is specified
                     if not driver_filter:
-                        driver_filter = normalized_id
-                        logger.info(f"Auto-filtering trips for driver {current_user.username} (ID: {normalized_id})")
+                        driver_filter = driver['driver_id']
+                        logger.info(f"Auto-filtering trips for driver {current_user.username} (ID: {driver_filter})")
                     break
         except Exception as e:
             logger.warning(f"Could not find driver for user {current_user.id}: {e}")
 
         # Get trips based on filter
-        if status_filter == 'active':
-            trips = firebase_service.get_active_trips()
-        elif status_filter == 'completed':
-            trips = firebase_service.get_completed_trips()
-        elif status_filter == 'cancelled':
-            trips = firebase_service.get_trips_by_status('cancelled')
-        else:
-            trips = firebase_service.get_all_trips()
+        status = {
+            'active': 'in_progress',
+            'completed': 'completed',
+            'cancelled': 'cancelled',
+        }.get(status_filter)
+
+        driver_ids = None
+        if driver_filter:
+            # Exact match on the canonical ID; legacy aliases resolve via the alias map
+            driver_filter = firebase_service.canonical_driver_id(driver_filter)
+            driver_ids = [driver_filter]
 
-        # Filter by driver if specified (mandatory for drivers viewing their own trips)
-        # Prepare driver_name based filtering: build a set of matching driver ids
-        driver_name_ids = set()
         if driver_name_query:
-            try:
-                all_drivers = firebase_service.get_all_drivers()
-                for d in all_drivers:
-                    name = (d.get('name') or '').lower()
-                    normalized_id = d.get('driver_id') or d.get('id') or d.get('auth_uid') or (d.get('email') or '').lower()
-                    if driver_name_query.lower() in name and normalized_id:
-                        driver_name_ids.add(normalized_id)
-            except Exception:
-                logger.debug('Could not resolve driver_name to ids')
-
-        if driver_filter or driver_name_ids:
-            # Use flexible matching to avoid missing trips due to case differences
-            # or slightly different identifier fields between drivers and trips.
-            df = str(driver_filter).strip().lower() if driver_filter else ''
-
-            def driver_matches(trip):
-                # Check several possible fields that may contain driver identifiers
-                for key in ('driver_id', 'driver', 'driver_name', 'assigned_driver'):
-                    val = trip.get(key)
-                    if not val:
-                        continue
-                    sval = str(val).strip().lower()
-                    # If we have explicit driver filter (id), match against it
-                    if df:
-                        if sval == df:
-                            return True
-                        if df in sval or sval in df:
-                            return True
-
-                    # If name-based ids were found, match driver_id against them
-                    if trip.get('driver_id') and str(trip.get('driver_id')) in driver_name_ids:
-                        return True
-
-                    # As fallback, if driver_name_query is present, try matching trip.driver_name
-                    if driver_name_query:
-                        if driver_name_query.lower() in sval:
-                            return True
-
-                return False
-
-            trips = [trip for trip in trips if driver_matches(trip)]
-
-        # Get all drivers and terminals for filter dropdown and name resolution
-        drivers = firebase_service.get_all_drivers()
+            # Resolve the name search to driver IDs, then match trips exactly
+            query = driver_name_query.lower()
+            driver_name_ids = {d['driver_id'] for d in drivers
+                               if query in (d.get('name') or '').lower()}
+            if driver_ids is None:
+                driver_ids = list(driver_name_ids)
+            else:
+                driver_ids = [i for i in driver_ids if i in driver_name_ids]
+
+        # Filtering, ordering and paging happen in Firestore; only the
+        # requested page of trips is read
+        trips = firebase_service.get_trip_sequence(status=status, driver_ids=driver_ids)
 
-        # Normalize driver IDs so template and server-side filtering use a consistent identifier.
-        # Some driver records may have 'driver_id' (created by this app), others may only have 'id',
-        # or might use 'auth_uid' or email. Normalize to a single `driver_id` value.
-        for driver in drivers:
-            normalized = driver.get('driver_id') or driver.get('id') or driver.get('auth_uid') or (driver.get('email') or '').lower()
-            driver['driver_id'] = normalized
         terminals = firebase_service.get_all_terminals()
 
         # Create mappings for quick lookup
@@ -545,8 +698,13 @@ def trip_list(request):
         driver_map = {driver.get('driver_id'): driver.get('name', 'Unknown Driver')
                  for driver in drivers}
 
-        # Resolve terminal and driver names in trips
-        for trip in trips:
+        # Pagination
+        paginator = Paginator(trips, 15)
+        page_number = request.GET.get('page')
+        page_obj = paginator.get_page(page_number)
+
+        # Resolve terminal and driver names for the trips on this page
+        for trip in page_obj:
             start_terminal_id = trip.get('start_terminal')
             destination_terminal_id = trip.get('destination_terminal')
             driver_id = trip.get('driver_id')
@@ -558,23 +716,13 @@ def trip_list(request):
 
         # Ensure dropdown includes any driver identifiers referenced by trips
         # (handles legacy/alias IDs like 'DRV001' that don't have driver docs).
-        try:
-            all_trips_for_ids = firebase_service.get_all_trips()
-            unique_trip_driver_ids = {t.get('driver_id') for t in all_trips_for_ids if t.get('driver_id')}
-            for tid in unique_trip_driver_ids:
-                if tid and tid not in driver_map:
-                    # Add a placeholder driver entry so the dropdown can select this id
-                    placeholder = {'driver_id': tid, 'name': f'Unknown Driver ({tid})'}
-                    drivers.append(placeholder)
-                    driver_map[tid] = placeholder['name']
-        except Exception:
-            # If Firestore can't be queried here, skip adding placeholders
-            logger.debug('Could not load all trips to reconcile missing driver ids')
-
-        # Pagination
-        paginator = Paginator(trips, 15)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        # The IDs come from the distinct-values index maintained on trip writes.
+        for tid in sorted(firebase_service.get_trip_driver_ids()):
+            if tid not in driver_map:
+                # Add a placeholder driver entry so the dropdown can select this id
+                placeholder = {'driver_id': tid, 'name': f'Unknown Driver ({tid})'}
+                drivers.append(placeholder)
+                driver_map[tid] = placeholder['name']
 
         context = {
             'trips': page_obj,
@@ -596,6 +744,34 @@ def trip_list(request):
         messages.error(request, "Error loading trips")
         return render(request, 'monitoring/trips/list.html', {'trips': [], 'drivers': []})
 
+@login_required(login_url='login')
+@require_http_methods(["GET"])
+def trip_export(request, fmt):
+    """Stream trips matching the list filters as CSV or NDJSON"""
+    if fmt not in TRIP_EXPORT_CONTENT_TYPES:
+        raise Http404("Unknown export format")
+
+    params = request.GET.dict()
+    if not params.get('driver'):
+        # Drivers export their own trips by default, like the trip list
+        user_email = (request.user.email or '').lower()
+        for driver in firebase_service.get_all_drivers():
+            if driver.get('django_user_id') == request.user.id or (
+                    user_email and (driver.get('email') or '').lower() == user_email):
+                params['driver'] = driver['id']
+                break
+
+    try:
+        filters = parse_export_filters(params)
+    except ValueError:
+        return HttpResponse("Dates must be in YYYY-MM-DD format", status=400)
+
+    response = StreamingHttpResponse(
+        iter_trip_export(fmt, **filters), content_type=TRIP_EXPORT_CONTENT_TYPES[fmt]
+    )
+    response['Content-Disposition'] = f'attachment; filename="trips.{fmt}"'
+    return response
+
 @login_required(login_url='login')
 def trip_detail(request, trip_id):
     """View trip details"""
@@ -674,29 +850,39 @@ def trip_create(request):
         return render(request, 'monitoring/trips/create.html', {'drivers': [], 'terminals': []})
 
 @login_required(login_url='login')
+@read_budget(reads=1, round_trips=2)
 def trip_update_status(request, trip_id):
     """Update trip status (HTMX endpoint)"""
     if request.method == 'POST':
         try:
             new_status = request.POST.get('status')
-            if new_status not in ['in_progress', 'completed', 'cancelled']:
+            if new_status not in TRIP_STATUS_TRANSITIONS:
                 return JsonResponse({'error': 'Invalid status'}, status=400)
 
-            trip = firebase_service.get_trip(trip_id)
-            if not trip:
-                return JsonResponse({'error': 'Trip not found'}, status=404)
+            def update_data(trip):
+                changes = {'status': new_status}
+
+                # Set arrival time if completing trip
+                if new_status == 'completed' and not trip.get('arrival_time'):
+                    changes['arrival_time'] = datetime.now()
+                return changes
 
-            update_data = {'status': new_status}
+            # Only from the status the card offered this button for, so two
+            # people clicking at once cannot both apply a transition
+            trip, error = firebase_service.update_trip_if(
+                trip_id, TRIP_STATUS_TRANSITIONS[new_status], update_data)
+
+            if error == 'not_found':
+                return JsonResponse({'error': 'Trip not found'}, status=404)
+            if error == 'wrong_status':
+                return JsonResponse({'error': f"Trip is already {trip.get('status') or 'changed'}"}, status=409)
 
-            # Set arrival time if completing trip
-            if new_status == 'completed' and not trip.get('arrival_time'):
-                from datetime import datetime
-                update_data['arrival_time'] = datetime.now()
+            if error is None:
+                if new_status == 'completed':
+                    record_trip_completion({**trip, 'id': trip_id})
 
-            if firebase_service.update_trip(trip_id, update_data):
                 # Return updated trip card for HTMX
-                updated_trip = firebase_service.get_trip(trip_id)
-                context = {'trip': updated_trip}
+                context = {'trip': {**trip, 'id': trip_id}}
                 return render(request, 'monitoring/trips/trip_card.html', context)
             else:
                 return JsonResponse({'error': 'Failed to update trip'}, status=500)